@@ -0,0 +1,62 @@
+"""
+Load test of the `AsyncBatchingBackend`: an event loop running 50k timed coroutines per second.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import asyncio
+
+import pytest
+
+from time_execution import settings, time_execution_async
+from time_execution.backends.asynchronous import AsyncBatchingBackend
+from time_execution.backends.base import BaseMetricsBackend
+
+RATE = 50000
+TICK = 0.01
+DURATION = 1
+
+
+class AsyncCountingBackend(BaseMetricsBackend):
+    def __init__(self):
+        self.count = 0
+
+    async def write(self, name, **data):
+        await self.bulk_write([data])
+
+    async def bulk_write(self, metrics):
+        await asyncio.sleep(0)  # yield to the loop like a request would
+        self.count += len(metrics)
+
+
+@time_execution_async
+async def handler():
+    await asyncio.sleep(0)
+    return True
+
+
+async def load_test():
+    backend = AsyncBatchingBackend(AsyncCountingBackend, queue_maxsize=RATE, bulk_size=500, bulk_timeout=0.1)
+    loop = asyncio.get_running_loop()
+    per_tick = int(RATE * TICK)
+    max_lag = 0.0
+    tasks = []
+    with settings(backends=[backend], hooks=[]):
+        start = loop.time()
+        for tick in range(int(DURATION / TICK)):
+            due = start + tick * TICK
+            await asyncio.sleep(max(due - loop.time(), 0))
+            max_lag = max(max_lag, loop.time() - due)
+            tasks.extend(loop.create_task(handler()) for _ in range(per_tick))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+        await backend.aclose()
+    assert backend.backend.count == len(tasks)
+    return len(tasks) / elapsed, max_lag
+
+
+@pytest.mark.benchmark(group="asynchronous")
+def test_load(benchmark):
+    rate, max_lag = benchmark.pedantic(lambda: asyncio.run(load_test()), rounds=3)
+    benchmark.extra_info["coroutines_per_second"] = round(rate)
+    benchmark.extra_info["max_loop_lag_ms"] = round(max_lag * 1000, 2)
@@ -0,0 +1,42 @@
+"""
+Aggregating a batch of the `ThreadedBackend` worker, from a list of dicts or from a `ColumnarBatch`.
+
+Both include building the batch from the queued records, as the worker does.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import pytest
+
+from benchmarks.test_records import NullBackend
+from time_execution.backends.aggregating import AggregatingBackend
+from time_execution.columns import ColumnarBatch
+from time_execution.records import MetricRecord
+from time_execution.timestamps import convert_timestamps
+
+pytestmark = pytest.mark.benchmark(group="columns")
+
+BATCH_SIZE = 500
+
+RECORDS = [
+    MetricRecord("series-%d" % (i % 10), float(i % 100), "value", "localhost", 1468371723000004000 + i)
+    for i in range(BATCH_SIZE)
+]
+
+
+@pytest.fixture
+def backend():
+    return AggregatingBackend(NullBackend, flush_interval=None)
+
+
+def test_dicts(benchmark, backend):
+    def bulk_write():
+        metrics = [record.to_dict() for record in RECORDS]
+        convert_timestamps(metrics)
+        backend.bulk_write(metrics)
+
+    benchmark(bulk_write)
+
+
+def test_columns(benchmark, backend):
+    benchmark(lambda: backend.bulk_write_columns(ColumnarBatch.from_metrics(RECORDS)))
@@ -0,0 +1,103 @@
+"""
+Overhead of `time_execution` compared with an undecorated call.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import time
+
+import pytest
+
+from time_execution import settings, time_execution
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend
+from time_execution.deferred import deferred
+
+pytestmark = pytest.mark.benchmark(group="decorator")
+
+HOOK_COUNTS = (0, 1, 5)
+
+
+class NullBackend(BaseMetricsBackend):
+    def write(self, name, **data):
+        pass
+
+
+def plain_hook(response, exception, metric, func, func_args, func_kwargs):
+    return {"plain": True}
+
+
+def generator_hook(func, func_args, func_kwargs):
+    response, exception, metric = yield
+    return {"generator": True}
+
+
+HOOKS = {"plain": plain_hook, "generator": generator_hook}
+
+
+def bare():
+    return True
+
+
+@time_execution
+def decorated():
+    return True
+
+
+def test_bare_call(benchmark):
+    assert benchmark(bare) is True
+
+
+def test_decorated_inactive(benchmark):
+    with settings(backends=[], hooks=[]):
+        assert benchmark(decorated) is True
+
+
+def test_decorated_active(benchmark):
+    with settings(backends=[NullBackend()], hooks=[]):
+        assert benchmark(decorated) is True
+
+
+@pytest.mark.benchmark(group="decorator-spans")
+@pytest.mark.parametrize("spans", [False, True])
+def test_nested(benchmark, spans):
+    @time_execution
+    def parent():
+        decorated()
+        return decorated()
+
+    with settings(backends=[NullBackend()], hooks=[], spans=spans):
+        assert benchmark(parent) is True
+
+
+@pytest.mark.benchmark(group="decorator-hooks")
+@pytest.mark.parametrize("count", HOOK_COUNTS)
+@pytest.mark.parametrize("kind", sorted(HOOKS))
+def test_hooks(benchmark, kind, count):
+    func = time_execution(extra_hooks=[HOOKS[kind]] * count)(bare)
+    with settings(backends=[NullBackend()], hooks=[]):
+        assert benchmark(func) is True
+
+
+class NullBulkBackend(BaseMetricsBackend):
+    def bulk_write(self, metrics):
+        pass
+
+
+def slow_hook(response, **kwargs):
+    deadline = time.perf_counter() + 0.00002
+    while time.perf_counter() < deadline:
+        pass
+    return {"response_size": len(str(response))}
+
+
+@pytest.mark.benchmark(group="decorator-deferred")
+@pytest.mark.parametrize("kind", ["inline", "deferred"])
+def test_slow_hook(benchmark, kind):
+    """A hook taking 20 µs, run by the caller or by the worker of the `ThreadedBackend`."""
+    hook = slow_hook if kind == "inline" else deferred(slow_hook, needs=("response",))
+    # The worker may fall behind, the metrics it can't take are discarded.
+    backend = ThreadedBackend(NullBulkBackend, bulk_size=500, drop_report_interval=3600)
+    with settings(backends=[backend], hooks=[hook]):
+        assert benchmark(decorated) is True
+    backend.close(timeout=5)
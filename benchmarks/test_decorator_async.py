@@ -0,0 +1,74 @@
+"""
+Overhead of `time_execution_async` compared with an undecorated coroutine.
+
+Every round awaits the coroutine `CALLS` times on one event loop, so the cost of running the loop
+doesn't hide the one of the decorator; divide the times by `CALLS` for the cost per call.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import asyncio
+
+import pytest
+
+from benchmarks.test_decorator import HOOK_COUNTS, HOOKS, NullBackend
+from time_execution import settings, time_execution_async
+
+pytestmark = pytest.mark.benchmark(group="decorator-async")
+
+CALLS = 1000
+
+
+async def coroutine_hook(response, exception, metric, func, func_args, func_kwargs):
+    return {"coroutine": True}
+
+
+ASYNC_HOOKS = dict(HOOKS, coroutine=coroutine_hook)
+
+
+async def bare():
+    return True
+
+
+@time_execution_async
+async def decorated():
+    return True
+
+
+@pytest.fixture
+def run(benchmark):
+    loop = asyncio.new_event_loop()
+
+    async def calls(func):
+        for _ in range(CALLS):
+            await func()
+
+    def run(func):
+        benchmark.extra_info["calls_per_round"] = CALLS
+        benchmark(lambda: loop.run_until_complete(calls(func)))
+
+    yield run
+    loop.close()
+
+
+def test_bare_call(run):
+    run(bare)
+
+
+def test_decorated_inactive(run):
+    with settings(backends=[], hooks=[]):
+        run(decorated)
+
+
+def test_decorated_active(run):
+    with settings(backends=[NullBackend()], hooks=[]):
+        run(decorated)
+
+
+@pytest.mark.benchmark(group="decorator-async-hooks")
+@pytest.mark.parametrize("count", HOOK_COUNTS)
+@pytest.mark.parametrize("kind", sorted(ASYNC_HOOKS))
+def test_hooks(run, kind, count):
+    func = time_execution_async(extra_hooks=[ASYNC_HOOKS[kind]] * count)(bare)
+    with settings(backends=[NullBackend()], hooks=[]):
+        run(func)
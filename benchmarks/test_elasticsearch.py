@@ -0,0 +1,99 @@
+"""
+`ElasticsearchBackend.bulk_write` serialization cost against a local fake Elasticsearch endpoint.
+
+Reports the bytes sent and the CPU time per 10k metrics, for the NDJSON fast path (with and without
+compression) and for passing action dicts to the client, as it used to be done.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from time_execution.backends.elasticsearch import ElasticsearchBackend, json_serializer, orjson_serializer
+
+METRICS_COUNT = 10000
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.rfile.read(length)
+        self.server.bytes_received += length
+        body = b'{"took":0,"errors":false,"items":[]}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_PUT = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def fake_elasticsearch():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeElasticsearchHandler)
+    server.bytes_received = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def metrics():
+    return [
+        {
+            "name": "benchmarks.test_elasticsearch.function_%d" % (i % 50),
+            "value": i / 7.0,
+            "hostname": "localhost",
+            "origin": "benchmark",
+            "timestamp": datetime.utcnow(),
+        }
+        for i in range(METRICS_COUNT)
+    ]
+
+
+def legacy_bulk_write(backend, metrics):
+    actions = []
+    index = backend.get_index()
+    for metric in metrics:
+        actions.append({"index": {"_index": index}})
+        actions.append(metric)
+    backend.client.bulk(operations=actions)
+
+
+def run(benchmark, fake_elasticsearch, bulk_write):
+    def measured():
+        fake_elasticsearch.bytes_received = 0
+        cpu_start = time.process_time()
+        bulk_write()
+        return time.process_time() - cpu_start, fake_elasticsearch.bytes_received
+
+    cpu, bytes_sent = benchmark.pedantic(measured, rounds=5, warmup_rounds=1)
+    benchmark.extra_info["bytes_per_10k_metrics"] = bytes_sent * 10000 // METRICS_COUNT
+    benchmark.extra_info["cpu_ms_per_10k_metrics"] = round(cpu * 1000 * 10000 / METRICS_COUNT, 1)
+
+
+@pytest.mark.benchmark(group="elasticsearch-bulk")
+@pytest.mark.parametrize("http_compress", [False, True], ids=["plain", "gzip"])
+@pytest.mark.parametrize("serializer", [orjson_serializer, json_serializer], ids=["orjson", "json"])
+def test_ndjson_bulk_write(benchmark, fake_elasticsearch, metrics, serializer, http_compress):
+    backend = ElasticsearchBackend(
+        "http://127.0.0.1:%d" % fake_elasticsearch.server_port, serializer=serializer, http_compress=http_compress
+    )
+    run(benchmark, fake_elasticsearch, lambda: backend.bulk_write(metrics))
+
+
+@pytest.mark.benchmark(group="elasticsearch-bulk")
+def test_legacy_bulk_write(benchmark, fake_elasticsearch, metrics):
+    backend = ElasticsearchBackend("http://127.0.0.1:%d" % fake_elasticsearch.server_port)
+    run(benchmark, fake_elasticsearch, lambda: legacy_bulk_write(backend, metrics))
@@ -0,0 +1,74 @@
+"""
+Cost of a timed call queued by the `ThreadedBackend`, as a `MetricRecord` or as a dict.
+
+Next to the time, the memory held per queued metric is stored in the `extra_info` of the benchmark:
+the number of allocated blocks and their size, measured with `tracemalloc`.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import gc
+import tracemalloc
+
+import pytest
+
+from time_execution import settings, time_execution
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend
+
+pytestmark = pytest.mark.benchmark(group="records")
+
+CALLS = 10000
+
+
+class NullBackend(BaseMetricsBackend):
+    def bulk_write(self, metrics):
+        pass
+
+
+class DictThreadedBackend(ThreadedBackend):
+    """The `ThreadedBackend` as if it didn't accept records: every metric is queued as a dict."""
+
+    accepts_records = False
+
+
+BACKENDS = {"dict": DictThreadedBackend, "record": ThreadedBackend}
+
+
+@time_execution
+def decorated():
+    return True
+
+
+def queued_allocations(backend):
+    """Return the number of blocks and bytes allocated per metric queued by a timed call."""
+    backend.worker_limit = 0
+    backend.thread.join()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(CALLS):
+            decorated()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    while not backend._queue.empty():
+        backend._queue.get_nowait()
+    return sum(stat.count_diff for stat in stats) / CALLS, sum(stat.size_diff for stat in stats) / CALLS
+
+
+@pytest.mark.parametrize("kind", sorted(BACKENDS))
+def test_queued_call(benchmark, kind):
+    backend = BACKENDS[kind](NullBackend, queue_maxsize=CALLS * 2, queue_timeout=0.01, bulk_size=500)
+    with settings(backends=[backend], hooks=[]):
+        decorated()
+        blocks, size = queued_allocations(backend)
+        benchmark.extra_info["blocks_per_metric"] = round(blocks, 1)
+        benchmark.extra_info["bytes_per_metric"] = round(size)
+
+        backend.worker_limit = None
+        backend.start_worker()
+        assert benchmark(decorated) is True
+    backend.worker_limit = 0
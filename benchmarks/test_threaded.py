@@ -0,0 +1,121 @@
+"""
+`ThreadedBackend.write()` latency and sustained throughput per queue implementation and number of workers.
+
+Run with `make benchmark`, or `pytest benchmarks`.
+"""
+
+import threading
+import time
+
+import pytest
+
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend
+
+QUEUES = {
+    "ring-buffer": "time_execution.queues.RingBufferQueue",
+    "multiprocessing": "multiprocessing.Queue",
+}
+
+
+class CountingBackend(BaseMetricsBackend):
+    def __init__(self):
+        self.count = 0
+        self.received = threading.Event()
+        self.expected = None
+
+    def write(self, name, **data):
+        self.bulk_write([data])
+
+    def bulk_write(self, metrics):
+        self.count += len(metrics)
+        if self.expected is not None and self.count >= self.expected:
+            self.received.set()
+
+
+@pytest.fixture(params=sorted(QUEUES))
+def threaded_backend(request):
+    backend = ThreadedBackend(
+        CountingBackend,
+        queue_class=QUEUES[request.param],
+        queue_maxsize=1000000,
+        queue_timeout=0.01,
+        bulk_size=500,
+        bulk_timeout=0.01,
+    )
+    yield backend
+    backend.worker_limit = 0
+    if hasattr(backend._queue, "cancel_join_thread"):
+        # don't wait at exit for the feeder thread to push the left-overs of the latency benchmark
+        backend._queue.cancel_join_thread()
+
+
+@pytest.mark.benchmark(group="threaded-write")
+def test_write_latency(benchmark, threaded_backend):
+    benchmark(threaded_backend.write, "benchmark", value=1.0, hostname="localhost")
+
+
+@pytest.mark.benchmark(group="threaded-throughput")
+def test_sustained_throughput(benchmark, threaded_backend):
+    count = 50000
+    counting_backend = threaded_backend.backend
+
+    def send():
+        counting_backend.count = 0
+        counting_backend.received.clear()
+        counting_backend.expected = count
+        start = time.perf_counter()
+        for _ in range(count):
+            threaded_backend.write("benchmark", value=1.0, hostname="localhost")
+        assert counting_backend.received.wait(30)
+        return count / (time.perf_counter() - start)
+
+    throughput = benchmark.pedantic(send, rounds=3)
+    benchmark.extra_info["metrics_per_second"] = round(throughput)
+
+
+ROUND_TRIP = 0.005
+
+
+class RoundTripBackend(CountingBackend):
+    """Takes `ROUND_TRIP` seconds per bulk, like a remote Elasticsearch."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def bulk_write(self, metrics):
+        time.sleep(ROUND_TRIP)
+        with self.lock:
+            super().bulk_write(metrics)
+
+
+@pytest.mark.benchmark(group="threaded-workers")
+@pytest.mark.parametrize("workers", [1, 2, 4, 8])
+def test_workers_throughput(benchmark, workers):
+    count = 20000
+    backend = ThreadedBackend(
+        RoundTripBackend,
+        # room for all the metrics in every queue, however unevenly the names are spread over them
+        queue_maxsize=count * workers,
+        queue_timeout=0.01,
+        bulk_size=100,
+        bulk_timeout=0.01,
+        workers=workers,
+    )
+    round_trip_backend = backend.backend
+    names = ["benchmark-%d" % i for i in range(100)]
+
+    def send():
+        round_trip_backend.count = 0
+        round_trip_backend.received.clear()
+        round_trip_backend.expected = count
+        start = time.perf_counter()
+        for i in range(count):
+            backend.write(names[i % 100], value=1.0, hostname="localhost")
+        assert round_trip_backend.received.wait(30)
+        return count / (time.perf_counter() - start)
+
+    throughput = benchmark.pedantic(send, rounds=3)
+    benchmark.extra_info["metrics_per_second"] = round(throughput)
+    backend.worker_limit = 0
@@ -24,8 +24,11 @@ setup(
         "typing-extensions>=4.5.0,<5.0.0",
     ],
     extras_require={
-        "all": ["elasticsearch>=8.0.0,<9.0.0"],
+        "all": ["elasticsearch[async]>=8.0.0,<9.0.0", "orjson>=3.0.0"],
+        "async": ["elasticsearch[async]>=8.0.0,<9.0.0"],
         "elasticsearch": ["elasticsearch>=8.0.0,<9.0.0"],
+        "numpy": ["numpy"],
+        "orjson": ["orjson>=3.0.0"],
     },
     packages=find_packages(exclude=["tests*"]),
     tests_require=["tox"],
@@ -1,4 +1,10 @@
+import time
+
+import pytest
+
 from time_execution import time_execution
+from time_execution.backends import threaded
+from time_execution.backends.base import BaseMetricsBackend
 
 
 @time_execution
@@ -11,3 +17,42 @@ class Dummy(object):
     @time_execution
     def go(self, *args, **kwargs):
         pass
+
+
+class MemoryBackend(BaseMetricsBackend):
+    """Keeps the metrics it's sent in `metrics`, and in `bulks` as they were sent."""
+
+    def __init__(self, fail=False):
+        self.metrics = []
+        self.bulks = []
+        self.fail = fail
+        self.closed = False
+
+    def write(self, name, **data):
+        self.bulk_write([dict(data, name=name)])
+
+    def bulk_write(self, metrics):
+        if self.fail:
+            raise RuntimeError("mocked error")
+        self.bulks.append(metrics)
+        self.metrics.extend(metrics)
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def close_threaded_backends():
+    """Stop the workers started by a test, rather than leaving them to the exit of the session."""
+    before = set(threaded._instances)
+    yield
+    for backend in set(threaded._instances) - before:
+        backend.close(timeout=5)
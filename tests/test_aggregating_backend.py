@@ -0,0 +1,128 @@
+import time
+from datetime import datetime
+
+import mock
+import pytest
+from freezegun import freeze_time
+
+from tests.conftest import MemoryBackend, go
+from time_execution import SHORT_HOSTNAME, settings
+from time_execution.backends.aggregating import AggregatingBackend
+from time_execution.columns import ColumnarBatch
+from time_execution.records import MetricRecord
+from time_execution.sketch import DDSketch
+
+
+@pytest.fixture
+def backend():
+    return AggregatingBackend(MemoryBackend, flush_interval=None, percentiles=(50, 99))
+
+
+class TestAggregatingBackend:
+    def test_flush_per_series(self, backend):
+        now = datetime.now()
+        for value in range(1, 101):
+            backend.write("a", value=float(value), hostname="host")
+        backend.bulk_write([{"name": "b", "value": 3.0, "hostname": "host", "origin": "app"}])
+        with freeze_time(now):
+            backend.flush()
+
+        (bulk,) = backend.backend.bulks
+        documents = {document["name"]: document for document in bulk}
+        a = documents["a"]
+        assert a["count"] == 100
+        assert a["sum"] == 5050.0
+        assert (a["min"], a["max"]) == (1.0, 100.0)
+        assert a["p50"] == pytest.approx(50, rel=0.01)
+        assert a["p99"] == pytest.approx(99, rel=0.01)
+        assert a["hostname"] == "host"
+        assert a["timestamp"] == now
+        assert "origin" not in a
+        assert documents["b"]["origin"] == "app"
+        assert DDSketch.from_dict(a["sketch"]).count == 100
+
+    def test_write_record(self, backend):
+        backend.write_record(MetricRecord("a", 2.0, "value", "host", 0, origin="app"))
+        backend.write_record(MetricRecord("a", 9.0, "value", "host", 0, origin="app", extra={"value": 4.0}))
+        backend.flush()
+        ((document,),) = backend.backend.bulks
+        assert (document["count"], document["sum"], document["origin"]) == (2, 6.0, "app")
+
+    def test_bulk_write_columns(self, backend):
+        batch = ColumnarBatch.from_metrics(
+            [{"name": "a", "value": float(value), "hostname": "host"} for value in range(1, 11)]
+            + [{"name": "dropped", "count": 1}]
+        )
+        backend.bulk_write_columns(batch)
+        backend.bulk_write_columns(ColumnarBatch.from_metrics([{"name": "a", "duration": 5.0}], "duration"))
+        backend.flush()
+        ((document,),) = backend.backend.bulks
+        assert (document["name"], document["count"], document["sum"]) == ("a", 10, 55.0)
+
+    def test_sample_weight(self, backend):
+        # 90 fast calls sampled at 10%, 10 slow ones all timed
+        backend.bulk_write_columns(
+            ColumnarBatch.from_metrics(
+                [{"name": "a", "value": 1.0, "sample_weight": 10.0} for _ in range(9)]
+                + [{"name": "a", "value": 100.0} for _ in range(10)]
+            )
+        )
+        backend.write_record(MetricRecord("a", 1.0, "value", None, 0, sample_weight=10.0))
+        backend.flush()
+        ((document,),) = backend.backend.bulks
+        assert (document["count"], document["sum"]) == (110, 1100.0)
+        assert document["p50"] == pytest.approx(1, rel=0.01)
+        assert document["p99"] == pytest.approx(100, rel=0.01)
+
+    def test_flush_starts_over(self, backend):
+        backend.write("a", value=1.0)
+        backend.flush()
+        backend.flush()
+        assert len(backend.backend.bulks) == 1
+
+    def test_without_sketch(self):
+        backend = AggregatingBackend(MemoryBackend, flush_interval=None, include_sketch=False)
+        backend.write("a", value=1.0)
+        backend.flush()
+        assert "sketch" not in backend.backend.bulks[0][0]
+
+    def test_ignores_metrics_without_duration(self, backend):
+        backend.write("cpu.load", load=1.0)
+        backend.flush()
+        assert backend.backend.bulks == []
+
+    def test_sketches_of_processes_merge(self):
+        backends = [AggregatingBackend(MemoryBackend, flush_interval=None) for _ in range(2)]
+        for i, value in enumerate(range(1, 1001)):
+            backends[i % 2].write("a", value=float(value))
+        merged = DDSketch()
+        for backend in backends:
+            backend.flush()
+            merged.merge(DDSketch.from_dict(backend.backend.bulks[0][0]["sketch"]))
+        assert merged.bins == DDSketch.of(float(value) for value in range(1, 1001)).bins
+
+    @mock.patch("time_execution.backends.aggregating.logger")
+    def test_flush_error(self, mocked_logger, backend):
+        backend.backend.bulk_write = mock.Mock(side_effect=RuntimeError("mocked"))
+        backend.write("a", value=1.0)
+        backend.flush()
+        mocked_logger.warning.assert_called_once()
+
+    def test_flush_interval(self):
+        backend = AggregatingBackend(MemoryBackend, flush_interval=0.1)
+        try:
+            with settings(backends=[backend], hooks=[]):
+                go()
+                go()
+            time.sleep(0.3)
+            (bulk,) = backend.backend.bulks
+            assert bulk[0]["name"] == go.get_fqn()
+            assert bulk[0]["hostname"] == SHORT_HOSTNAME
+            assert bulk[0]["count"] == 2
+        finally:
+            backend.stop_flusher()
+        assert backend.thread is None
+
+    def test_backend_importpath(self):
+        backend = AggregatingBackend("tests.conftest.MemoryBackend", flush_interval=None)
+        assert isinstance(backend.backend, MemoryBackend)
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from datetime import datetime
+
+import mock
+import pytest
+
+from time_execution import settings, time_execution_async
+from time_execution.backends.asynchronous import AsyncBatchingBackend
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.records import MetricRecord
+
+
+class AsyncMemoryBackend(BaseMetricsBackend):
+    def __init__(self, fail=False):
+        self.bulks = []
+        self.closed = False
+        self.fail = fail
+
+    async def write(self, name, **data):
+        await self.bulk_write([dict(data, name=name)])
+
+    async def bulk_write(self, metrics):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("mocked error")
+        self.bulks.append(metrics)
+
+    async def close(self):
+        self.closed = True
+
+
+@time_execution_async
+async def go_async(arg=None):
+    await asyncio.sleep(0)
+    return arg
+
+
+class TestAsyncBatchingBackend:
+    pytestmark = pytest.mark.asyncio
+
+    async def test_bulk_size(self):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, bulk_size=10, bulk_timeout=60)
+        for i in range(25):
+            backend.write("metric", value=i)
+        await asyncio.sleep(0.01)
+        assert [len(bulk) for bulk in backend.backend.bulks] == [10, 10]
+
+        await backend.aclose()
+        assert [len(bulk) for bulk in backend.backend.bulks] == [10, 10, 5]
+        assert [metric["value"] for bulk in backend.backend.bulks for metric in bulk] == list(range(25))
+        assert backend.backend.closed
+
+    async def test_bulk_timeout(self):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, bulk_size=10, bulk_timeout=0.05)
+        backend.write("metric", value=1)
+        await asyncio.sleep(0.01)
+        assert backend.backend.bulks == []
+        await asyncio.sleep(0.1)
+        (bulk,) = backend.backend.bulks
+        assert bulk[0]["name"] == "metric"
+        assert "timestamp" in bulk[0]
+        await backend.aclose()
+
+    async def test_backend_import_path(self):
+        backend = AsyncBatchingBackend(
+            "tests.test_asynchronous_backend.AsyncMemoryBackend", backend_kwargs={"fail": True}
+        )
+        assert isinstance(backend.backend, AsyncMemoryBackend)
+        assert backend.backend.fail
+
+    @mock.patch("time_execution.backends.asynchronous.logger")
+    async def test_write_failure(self, mocked_logger):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, backend_kwargs={"fail": True})
+        backend.write("metric")
+        await backend.aclose()
+        mocked_logger.warning.assert_called_once()
+
+    @mock.patch("time_execution.backends.asynchronous.logger")
+    async def test_queue_full(self, mocked_logger):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, queue_maxsize=2, bulk_size=10)
+        for i in range(5):
+            backend.write("metric", value=i)
+        # The first discarded metric is reported right away, the others later.
+        mocked_logger.warning.assert_called_once_with("Discarded %d metrics, %s", 1, "the queue is full")
+        await backend.aclose()
+        mocked_logger.warning.assert_called_with("Discarded %d metrics, %s", 2, "the queue is full")
+        assert sum(len(bulk) for bulk in backend.backend.bulks) == 2
+
+    async def test_write_from_another_thread(self):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, bulk_size=2)
+        backend.write("metric", value=1)
+        thread = threading.Thread(target=backend.write, args=("metric",), kwargs={"value": 2})
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.01)
+        assert [metric["value"] for metric in backend.backend.bulks[0]] == [1, 2]
+        await backend.aclose()
+
+    @mock.patch("time_execution.backends.asynchronous.logger")
+    async def test_write_after_close(self, mocked_logger):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend)
+        backend.write("metric")
+        await backend.aclose()
+        backend.write("metric")
+        mocked_logger.warning.assert_called_once()
+        assert len(backend.backend.bulks) == 1
+
+    async def test_with_decorator(self):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, bulk_size=100)
+        with settings(backends=[backend]):
+            await asyncio.gather(*(go_async(i) for i in range(100)))
+            await asyncio.sleep(0.01)
+        (bulk,) = backend.backend.bulks
+        assert {metric["name"] for metric in bulk} == {"tests.test_asynchronous_backend.go_async"}
+        await backend.aclose()
+
+    async def test_records_are_sent_as_dicts(self):
+        backend = AsyncBatchingBackend(AsyncMemoryBackend, bulk_size=2)
+        backend.write_record(MetricRecord("a", 1.0, "value", "host", 1468371723000004000))
+        backend.write("b", value=2.0)
+        await asyncio.sleep(0.01)
+        ((a, b),) = backend.backend.bulks
+        assert a == {"name": "a", "value": 1.0, "hostname": "host", "timestamp": datetime(2016, 7, 13, 1, 2, 3, 4)}
+        assert (b["name"], b["value"]) == ("b", 2.0)
+        await backend.aclose()
+
+
+@mock.patch("time_execution.backends.asynchronous.logger")
+def test_write_without_event_loop(mocked_logger):
+    backend = AsyncBatchingBackend(AsyncMemoryBackend)
+    backend.write("metric")
+    mocked_logger.warning.assert_called_once()
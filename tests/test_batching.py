@@ -0,0 +1,96 @@
+import pytest
+
+from tests.test_sampling import FakeClock
+from time_execution.batching import AdaptiveBatching
+
+
+def feed(batching, clock, batches, size, interval, latency, failed=False):
+    """Observe batches of `size` metrics every `interval` seconds, i.e. `size / interval` metrics per second."""
+    for _ in range(batches):
+        clock.now += interval
+        batching.observe(size, latency, failed)
+
+
+class TestAdaptiveBatching:
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            dict(target_delay=0),
+            dict(min_bulk_size=0),
+            dict(min_bulk_size=10, max_bulk_size=5),
+            dict(min_bulk_timeout=0),
+            dict(min_bulk_timeout=2, max_bulk_timeout=1),
+            dict(window=0),
+        ],
+    )
+    def test_invalid_bounds(self, kwargs):
+        with pytest.raises(ValueError):
+            AdaptiveBatching(**kwargs)
+
+    def test_bind_clamps(self):
+        batching = AdaptiveBatching(target_delay=2, min_bulk_size=10, max_bulk_size=100)
+        assert batching.bind(500, 5, senders=2) == (100, 2)
+        assert batching.senders == 2
+        assert batching.bind(1, 0) == (10, 0.01)
+
+    def test_keeps_settings_until_the_arrival_rate_is_known(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(clock=clock)
+        batching.bind(50, 1)
+        feed(batching, clock, 5, size=10, interval=0.1, latency=0.05)
+        assert batching.snapshot() == {
+            "bulk_size": 50,
+            "bulk_timeout": 1,
+            "latency": pytest.approx(0.05),
+            "arrival_rate": None,
+            "error_rate": 0.0,
+        }
+
+    def test_peak(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(target_delay=1, clock=clock)
+        batching.bind(50, 1)
+        feed(batching, clock, 200, size=100, interval=0.1, latency=0.1)
+        snapshot = batching.snapshot()
+        # the metrics wait what's left of the target delay, and fill up the batches in that time
+        assert snapshot["arrival_rate"] == pytest.approx(1000)
+        assert snapshot["bulk_timeout"] == pytest.approx(0.9)
+        assert snapshot["bulk_size"] == pytest.approx(900, abs=5)
+
+    def test_off_peak(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(target_delay=1, clock=clock)
+        batching.bind(50, 1)
+        feed(batching, clock, 100, size=2, interval=1, latency=0.1)
+        assert batching.bulk_size == 2
+        assert batching.bulk_timeout == pytest.approx(0.9)
+
+    def test_keeps_up_with_arrival_rate(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(target_delay=0.6, max_bulk_size=10000, clock=clock)
+        batching.bind(50, 1, senders=2)
+        feed(batching, clock, 200, size=200, interval=0.1, latency=0.5)
+        # the target can't be met: the batches are as large as the workers need, and sent straight away
+        assert batching.bulk_timeout == pytest.approx(0.1)
+        assert batching.bulk_size == pytest.approx(1000 * 0.5 * 1.25, abs=5)
+
+    def test_bounds(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(target_delay=1, max_bulk_size=100, min_bulk_timeout=0.2, clock=clock)
+        feed(batching, clock, 100, size=1000, interval=0.1, latency=2)
+        assert batching.bulk_size == 100
+        assert batching.bulk_timeout == pytest.approx(0.2)
+
+    def test_failures_back_off(self):
+        clock = FakeClock()
+        batching = AdaptiveBatching(target_delay=1, clock=clock)
+        batching.bind(400, 0.2)
+        feed(batching, clock, 2, size=1000, interval=0.5, latency=1, failed=True)
+        assert batching.bulk_size == 100
+        assert batching.bulk_timeout == pytest.approx(0.8)
+        assert batching.error_rate == pytest.approx(0.36)
+        assert batching.latency is None
+
+        # the batches don't grow whilst failures are frequent
+        feed(batching, clock, 3, size=1000, interval=0.5, latency=0.1)
+        assert batching.bulk_size == 100
@@ -0,0 +1,113 @@
+import multiprocessing
+import socket
+import struct
+from datetime import datetime
+
+import mock
+import pytest
+
+from tests.conftest import MemoryBackend, go, wait_for
+from time_execution import settings
+from time_execution.backends.collector import CollectorClientBackend, MetricsCollector, encode_frame
+from time_execution.backends.threaded import ThreadedBackend
+
+
+def received(collector):
+    return [metric for bulk in collector.backend.backend.bulks for metric in bulk]
+
+
+@pytest.fixture
+def collector(tmp_path):
+    collector = MetricsCollector(str(tmp_path / "metrics.sock"), MemoryBackend, queue_timeout=0.05, bulk_timeout=0.05)
+    collector.start()
+    yield collector
+    collector.shutdown()
+    collector.backend.worker_limit = 0
+
+
+def produce(path, count):
+    backend = ThreadedBackend(CollectorClientBackend, backend_kwargs={"path": path}, queue_timeout=0.05)
+    settings.configure(backends=[backend], hooks=[])
+    for _ in range(count):
+        go()
+
+
+class TestMetricsCollector:
+    def test_collects_bulks(self, collector):
+        now = datetime(2020, 1, 2, 3, 4, 5)
+        client = CollectorClientBackend(collector.path)
+        client.bulk_write(
+            [{"name": "a", "value": 1.0, "timestamp": now}, {"name": "b", "value": 2.0, "timestamp": now}]
+        )
+        client.write("c", value=3.0, timestamp=now)
+
+        wait_for(lambda: len(received(collector)) == 3)
+        assert received(collector) == [
+            {"name": "a", "value": 1.0, "timestamp": "2020-01-02T03:04:05"},
+            {"name": "b", "value": 2.0, "timestamp": "2020-01-02T03:04:05"},
+            {"name": "c", "value": 3.0, "timestamp": "2020-01-02T03:04:05"},
+        ]
+        client.close()
+
+    def test_invalid_frame(self, collector):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(collector.path)
+            sock.sendall(struct.pack("!I", 3) + b"xyz" + encode_frame([{"name": "a", "value": 1.0}]))
+            wait_for(lambda: len(received(collector)) == 1)
+
+    def test_client_reconnects(self, collector):
+        client = CollectorClientBackend(collector.path)
+        client.write("a", value=1.0)
+        wait_for(lambda: len(received(collector)) == 1)
+        # the connection breaks, e.g. because the collector was restarted
+        client._socket.shutdown(socket.SHUT_RDWR)
+        client.write("b", value=1.0)
+        client.write("c", value=1.0)
+        wait_for(lambda: [metric["name"] for metric in received(collector)] == ["a", "b", "c"])
+
+    def test_concurrent_workers(self, collector):
+        backend = ThreadedBackend(
+            CollectorClientBackend, backend_kwargs={"path": collector.path}, workers=2, bulk_size=10, bulk_timeout=0.01
+        )
+        # frames large enough to be sent in several chunks, which mustn't interleave
+        padding = "x" * 100000
+        for i in range(100):
+            backend.write("metric-%d" % (i % 8), value=float(i), padding=padding)
+        assert backend.close(timeout=10)
+        wait_for(lambda: len(received(collector)) == 100)
+        assert sorted(metric["value"] for metric in received(collector)) == list(range(100))
+
+    def test_client_forked(self, collector):
+        client = CollectorClientBackend(collector.path)
+        client.write("parent", value=1.0)
+        with client._lock:
+            # held by a thread of the parent at the time of the fork
+            process = multiprocessing.get_context("fork").Process(target=client.write, args=("child",))
+            process.start()
+        process.join()
+        assert process.exitcode == 0
+        client.write("parent", value=2.0)
+        wait_for(lambda: len(received(collector)) == 3)
+        assert sorted(metric["name"] for metric in received(collector)) == ["child", "parent", "parent"]
+        client.close()
+
+    @mock.patch("time_execution.backends.collector.logger")
+    def test_collector_unavailable(self, mocked_logger, tmp_path):
+        client = CollectorClientBackend(str(tmp_path / "missing.sock"))
+        client.write("a", value=1.0)
+        mocked_logger.warning.assert_called_once()
+        # raised for the ThreadedBackend to count and spool the failed batch
+        with pytest.raises(OSError):
+            client.bulk_write([{"name": "a", "value": 1.0}])
+
+    def test_multiple_processes(self, collector):
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=produce, args=(collector.path, 100)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        wait_for(lambda: len(received(collector)) == 400)
+        assert {metric["name"] for metric in received(collector)} == {go.get_fqn()}
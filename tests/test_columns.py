@@ -0,0 +1,83 @@
+import math
+from datetime import datetime
+
+import mock
+import pytest
+
+from time_execution.columns import ColumnarBatch
+from time_execution.records import MetricRecord
+
+TIMESTAMP_NS = 1468371723000004000
+TIMESTAMP = datetime(2016, 7, 13, 1, 2, 3, 4)
+
+
+def metrics():
+    return [
+        MetricRecord("a", 1.0, "value", "host", TIMESTAMP_NS, cpu_time=0.5),
+        MetricRecord("b", 2.0, "value", "host", TIMESTAMP_NS, origin="app", extra={"key": "value"}),
+        {"name": "a", "value": 3.0, "hostname": "other", "timestamp_ns": TIMESTAMP_NS, "sample_weight": 2.0},
+        {"name": "dropped", "count": 3, "timestamp": TIMESTAMP},
+    ]
+
+
+class TestColumnarBatch:
+    def test_columns(self):
+        batch = ColumnarBatch.from_metrics(metrics())
+        assert len(batch) == 4
+        assert batch.names == ["a", "b", "dropped"]
+        assert list(batch.name_codes) == [0, 1, 0, 2]
+        assert batch.hostnames == ["host", "other", None]
+        assert list(batch.hostname_codes) == [0, 0, 1, 2]
+        assert batch.origins == [None, "app"]
+        assert list(batch.origin_codes) == [0, 1, 0, 0]
+        assert list(batch.durations)[:3] == [1.0, 2.0, 3.0]
+        assert list(batch.timestamps_ns) == [TIMESTAMP_NS, TIMESTAMP_NS, TIMESTAMP_NS, -1]
+        assert list(batch.sample_weights)[2] == 2.0
+        assert batch.extras == [{"cpu_time": 0.5}, {"key": "value"}, None, {"count": 3, "timestamp": TIMESTAMP}]
+
+    def test_to_dicts(self):
+        expected = [metric.to_dict() if isinstance(metric, MetricRecord) else dict(metric) for metric in metrics()]
+        for metric in expected[:3]:
+            del metric["timestamp_ns"]
+            metric["timestamp"] = TIMESTAMP
+        assert ColumnarBatch.from_metrics(metrics()).to_dicts() == expected
+
+    def test_span_fields(self):
+        record = MetricRecord("a", 1.0, "value", "host", TIMESTAMP_NS, span_id="b", parent_id="a", self_time=0.5)
+        batch = ColumnarBatch.from_metrics([record])
+        assert batch.extras == [{"span_id": "b", "parent_id": "a", "self_time": 0.5}]
+        assert batch.to_dicts()[0]["span_id"] == "b"
+
+    def test_duration_field(self):
+        batch = ColumnarBatch.from_metrics(
+            [MetricRecord("a", 1.0, "value", "host", TIMESTAMP_NS), {"name": "a", "duration": 2.0}], "duration"
+        )
+        assert list(batch.durations)[1] == 2.0
+        assert batch.extras[0] == {"value": 1.0}
+
+    def test_not_a_number(self):
+        batch = ColumnarBatch.from_metrics([{"name": "a", "value": "n/a", "sample_weight": None}])
+        assert math.isnan(batch.durations[0])
+        assert batch.to_dicts() == [{"name": "a", "value": "n/a", "sample_weight": None}]
+
+    def test_series(self):
+        series = ColumnarBatch.from_metrics(metrics() * 2).series()
+        assert {key: (list(durations), list(weights)) for key, (durations, weights) in series.items()} == {
+            ("a", "host", None): ([1.0, 1.0], [1.0, 1.0]),
+            ("b", "host", "app"): ([2.0, 2.0], [1.0, 1.0]),
+            ("a", "other", None): ([3.0, 3.0], [2.0, 2.0]),
+        }
+
+    def test_to_numpy(self):
+        numpy = pytest.importorskip("numpy")
+        batch = ColumnarBatch.from_metrics(metrics())
+        columns = batch.to_numpy()
+        assert columns["durations"][:3].tolist() == [1.0, 2.0, 3.0]
+        assert columns["timestamps_ns"].dtype == numpy.int64
+        # views of the columns, not copies
+        assert not columns["name_codes"].flags.owndata
+
+    def test_to_numpy_without_numpy(self):
+        with mock.patch("time_execution.columns.numpy", None):
+            with pytest.raises(ImportError):
+                ColumnarBatch().to_numpy()
@@ -0,0 +1,30 @@
+import threading
+
+from time_execution.counters import AtomicCounter
+
+
+class TestAtomicCounter:
+    def test_value(self):
+        counter = AtomicCounter()
+        assert counter.value == 0
+        counter.increment()
+        counter.increment()
+        assert counter.value == 2
+        assert counter.value == 2
+
+    def test_concurrent_increments(self):
+        counter = AtomicCounter()
+        count, threads = 10000, 4
+
+        def increment():
+            for _ in range(count):
+                counter.increment()
+
+        workers = [threading.Thread(target=increment) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            counter.value  # reads don't interfere with the increments
+        for worker in workers:
+            worker.join()
+        assert counter.value == count * threads
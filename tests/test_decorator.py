@@ -0,0 +1,232 @@
+import gc
+import time
+
+import mock
+import pytest
+
+from tests.conftest import go
+from tests.test_decorator_async import go_async
+from tests.test_hooks import CollectorBackend, global_hook
+from time_execution import settings, time_execution
+from time_execution.timed import Base
+
+
+class TestInactive:
+    def test_nothing_listening(self):
+        with settings(backends=[], hooks=[]):
+            with mock.patch.object(Base, "get_record") as mocked_get_record:
+                assert go() is True
+            mocked_get_record.assert_not_called()
+
+    def test_backend_configured_at_runtime(self):
+        collector = CollectorBackend()
+        with settings(backends=[], hooks=[]):
+            go()
+            with settings(backends=[collector], hooks=[]):
+                go()
+                assert collector.metrics[0][go.get_fqn()]["value"] >= 0
+                with settings(backends=[], hooks=[]):
+                    go()
+            assert len(collector.metrics) == 1
+
+    def test_hook_without_backends(self):
+        hook = mock.Mock(side_effect=global_hook)
+        with settings(backends=[], hooks=[hook]):
+            go()
+        hook.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_nothing_listening_async(self):
+        with settings(backends=[], hooks=[]):
+            with mock.patch.object(Base, "get_record") as mocked_get_record:
+                assert await go_async("ok") == "ok"
+            mocked_get_record.assert_not_called()
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@time_execution
+def busy():
+    spin(0.02)
+
+
+@time_execution
+def idle():
+    time.sleep(0.02)
+
+
+class TestDuration:
+    def timed(self, func, **kwargs):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[], **kwargs):
+            func()
+        return collector.metrics[0][func.get_fqn()]
+
+    @pytest.mark.parametrize("resolution, decimals", [("ms", 0), ("us", 3), ("ns", 6)])
+    def test_resolution(self, resolution, decimals):
+        with mock.patch("time_execution.timed.perf_counter_ns", side_effect=[0, 1234567]):
+            metric = self.timed(go, duration_resolution=resolution)
+        assert metric["value"] == round(1.234567, decimals)
+
+    def test_sub_millisecond(self):
+        assert 0 < self.timed(go)["value"] < 1
+
+    def test_invalid_resolution(self):
+        with pytest.raises(ValueError):
+            settings.configure(duration_resolution="s")
+        with pytest.raises(ValueError):
+            self.timed(go, duration_resolution="s")
+        # rejected, the valid settings still apply
+        assert settings.duration_resolution == "us"
+        assert self.timed(go)["value"] >= 0
+
+    @mock.patch("time_execution.timed.logger")
+    def test_invalid_setting_changed_in_place(self, mocked_logger):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[], duration_resolution="us"):
+            # bypasses the check of the settings
+            settings._chain[0].duration_resolution = "s"
+            settings._changed()
+            assert go() is True
+        assert collector.metrics[0][go.get_fqn()]["value"] >= 0
+        mocked_logger.warning.assert_called_once()
+
+    def test_no_cpu_time_by_default(self):
+        assert "cpu_time" not in self.timed(go)
+
+    @pytest.mark.parametrize("cpu_time", ["process", "thread"])
+    def test_cpu_time(self, cpu_time):
+        metric = self.timed(busy, cpu_time=cpu_time)
+        assert metric["cpu_time"] >= 10
+        metric = self.timed(idle, cpu_time=cpu_time)
+        assert metric["value"] >= 20
+        assert metric["cpu_time"] < 10
+
+    def test_invalid_cpu_time(self):
+        with pytest.raises(ValueError):
+            self.timed(go, cpu_time="wall")
+        assert "cpu_time" not in self.timed(go)
+
+
+@time_execution
+def numbers(count):
+    for i in range(count):
+        spin(0.01)
+        yield i
+    return "done"
+
+
+@time_execution
+def echo():
+    value = None
+    while True:
+        try:
+            value = yield value
+        except ValueError:
+            value = "thrown"
+
+
+class TestGenerator:
+    def iterate(self, consume, **kwargs):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[], **kwargs):
+            result = consume()
+        return result, [(name, metric) for item in collector.metrics for name, metric in item.items()]
+
+    def test_exhausted(self):
+        result, [(name, metric)] = self.iterate(lambda: list(numbers(3)))
+        assert result == [0, 1, 2]
+        assert name == numbers.fqn
+        assert metric["item_count"] == 3
+        assert 10 <= metric["time_to_first_item"] < metric["value"]
+        assert 30 <= metric["active_time"] <= metric["value"]
+
+    def test_consumer_time_is_excluded(self):
+        def consume():
+            for _ in numbers(2):
+                time.sleep(0.03)
+
+        _, [(_, metric)] = self.iterate(consume)
+        assert metric["value"] >= 80
+        assert 20 <= metric["active_time"] < 50
+
+    def test_return_value(self):
+        def consume():
+            generator = numbers(1)
+            next(generator)
+            with pytest.raises(StopIteration) as info:
+                next(generator)
+            return info.value.value
+
+        result, [(_, metric)] = self.iterate(consume)
+        assert result == "done"
+        assert metric["item_count"] == 1
+
+    def test_send_and_throw(self):
+        def consume():
+            generator = echo()
+            next(generator)
+            values = [generator.send("sent"), generator.throw(ValueError), generator.send(None)]
+            generator.close()
+            return values
+
+        result, [(_, metric)] = self.iterate(consume)
+        assert result == ["sent", "thrown", None]
+        assert metric["item_count"] == 4
+
+    def test_closed(self):
+        def consume():
+            generator = numbers(5)
+            next(generator)
+            generator.close()
+
+        _, [(_, metric)] = self.iterate(consume)
+        assert metric["item_count"] == 1
+
+    def test_garbage_collected(self):
+        def consume():
+            generator = numbers(5)
+            next(generator)
+            del generator
+            gc.collect()
+
+        _, [(_, metric)] = self.iterate(consume)
+        assert metric["item_count"] == 1
+
+    def test_never_iterated(self):
+        _, metrics = self.iterate(lambda: numbers(1))
+        assert metrics == []
+
+    def test_exception(self):
+        @time_execution
+        def failing():
+            yield 1
+            raise RuntimeError("failed")
+
+        hook = mock.Mock(return_value=None)
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[hook]):
+            with pytest.raises(RuntimeError):
+                list(failing())
+        assert isinstance(hook.call_args.kwargs["exception"], RuntimeError)
+        assert collector.metrics[0][failing.fqn]["item_count"] == 1
+
+    def test_inactive(self):
+        with settings(backends=[], hooks=[]):
+            assert numbers(1).gi_code is numbers.__wrapped__.__code__
+
+    def test_spans(self):
+        def consume():
+            for _ in numbers(2):
+                go()
+
+        _, metrics = self.iterate(consume, spans=True)
+        (_, first), (_, second), (name, metric) = metrics
+        assert name == numbers.fqn
+        # the consumer's calls aren't part of the generator
+        assert "parent_id" not in first and "parent_id" not in second
+        assert metric["self_time"] == metric["active_time"]
@@ -3,14 +3,17 @@ from unittest.mock import Mock
 
 import pytest
 
-from time_execution import time_execution_async
+from tests.test_hooks import CollectorBackend
+from time_execution import settings, time_execution_async
 
 
 @pytest.fixture
 def patch_backend(monkeypatch):
     m = Mock()
     monkeypatch.setattr("time_execution.timed.write_metric", m)
-    return m
+    # Without any backend the decorator does not time the calls at all.
+    with settings(backends=[Mock()]):
+        yield m
 
 
 @time_execution_async
@@ -63,3 +66,191 @@ class TestTimeExecutionAsync:
         assert call_args["name"] == "tests.test_decorator_async.go_async_with_hook"
         assert call_args["value"] >= 10  # in ms
         assert call_args["dummy_hook_called"] is True
+
+
+@time_execution_async
+async def numbers_async(count):
+    for i in range(count):
+        await asyncio.sleep(0.01)
+        yield i
+
+
+@time_execution_async
+async def echo_async():
+    value = None
+    while True:
+        try:
+            value = yield value
+        except ValueError:
+            value = "thrown"
+
+
+class TestAsyncGenerator:
+    pytestmark = pytest.mark.asyncio
+
+    @pytest.fixture
+    def collector(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[]):
+            yield collector
+
+    def metrics(self, collector):
+        return [metric for item in collector.metrics for metric in item.values()]
+
+    async def test_exhausted(self, collector):
+        assert [item async for item in numbers_async(3)] == [0, 1, 2]
+        [metric] = self.metrics(collector)
+        assert metric["item_count"] == 3
+        assert 10 <= metric["time_to_first_item"] < metric["value"]
+        assert 30 <= metric["active_time"] <= metric["value"]
+
+    async def test_consumer_time_is_excluded(self, collector):
+        async for _ in numbers_async(2):
+            await asyncio.sleep(0.03)
+        [metric] = self.metrics(collector)
+        assert metric["value"] >= 80
+        assert 20 <= metric["active_time"] < 50
+
+    async def test_send_and_throw(self, collector):
+        generator = echo_async()
+        await generator.asend(None)
+        values = [await generator.asend("sent"), await generator.athrow(ValueError), await generator.asend(None)]
+        await generator.aclose()
+        assert values == ["sent", "thrown", None]
+        [metric] = self.metrics(collector)
+        assert metric["item_count"] == 4
+
+    async def test_closed(self, collector):
+        generator = numbers_async(5)
+        await generator.__anext__()
+        await generator.aclose()
+        [metric] = self.metrics(collector)
+        assert metric["item_count"] == 1
+
+    async def test_exception(self, collector):
+        @time_execution_async
+        async def failing():
+            yield 1
+            raise RuntimeError("failed")
+
+        with pytest.raises(RuntimeError):
+            async for _ in failing():
+                pass
+        assert self.metrics(collector)[0]["item_count"] == 1
+
+
+def slow_hook(key, delay, value=True):
+    async def hook(**kwargs):
+        await asyncio.sleep(delay)
+        return {key: value}
+
+    hook.__name__ = hook.__qualname__ = "slow_hook_%s" % key
+    return hook
+
+
+class TestConcurrentHooks:
+    pytestmark = pytest.mark.asyncio
+
+    @pytest.fixture
+    def collector(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[]):
+            yield collector
+
+    def metric(self, collector):
+        [item] = collector.metrics
+        [metric] = item.values()
+        return metric
+
+    async def test_concurrent(self, collector):
+        hooks = [slow_hook("hook_%d" % i, 0.02) for i in range(5)]
+
+        @time_execution_async(extra_hooks=hooks)
+        async def func():
+            pass
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        await func()
+        assert loop.time() - start < 0.08
+        metric = self.metric(collector)
+        assert all(metric["hook_%d" % i] for i in range(5))
+        assert "timed_out_hooks" not in metric
+
+    async def test_merged_in_order(self, collector):
+        # The later hooks win, whichever finishes first.
+        hooks = [slow_hook("key", 0.02, "first"), lambda **kwargs: {"key": "plain"}, slow_hook("key", 0, "last")]
+
+        @time_execution_async(extra_hooks=hooks)
+        async def func():
+            pass
+
+        await func()
+        assert self.metric(collector)["key"] == "last"
+
+    async def test_hook_timeout(self, collector):
+        cancelled = []
+
+        async def stuck_hook(**kwargs):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        @time_execution_async(extra_hooks=[slow_hook("fast", 0), stuck_hook])
+        async def func():
+            return "ok"
+
+        with settings(hook_timeout=0.02):
+            assert await func() == "ok"
+        metric = self.metric(collector)
+        assert metric["fast"] is True
+        assert metric["timed_out_hooks"] == [
+            "tests.test_decorator_async.TestConcurrentHooks.test_hook_timeout.stuck_hook"
+        ]
+        assert cancelled == [True]
+
+    async def test_own_timeout_error(self, collector):
+        async def failing_hook(**kwargs):
+            # e.g. of an HTTP client, rather than the `hook_timeout`
+            raise asyncio.TimeoutError()
+
+        @time_execution_async(extra_hooks=[slow_hook("fast", 0), failing_hook])
+        async def func():
+            pass
+
+        with settings(hook_timeout=5):
+            with pytest.raises(asyncio.TimeoutError):
+                await func()
+
+    async def test_total_hook_timeout(self, collector):
+        hooks = [slow_hook("fast", 0), slow_hook("slow", 1), slow_hook("slower", 2)]
+
+        @time_execution_async(extra_hooks=hooks)
+        async def func():
+            pass
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        with settings(hook_timeout=5, total_hook_timeout=0.02):
+            await func()
+        assert loop.time() - start < 0.5
+        metric = self.metric(collector)
+        assert metric["fast"] is True
+        assert "slow" not in metric
+        assert metric["timed_out_hooks"] == [
+            "tests.test_decorator_async.slow_hook_slow",
+            "tests.test_decorator_async.slow_hook_slower",
+        ]
+
+    async def test_exception(self, collector):
+        async def failing_hook(**kwargs):
+            raise RuntimeError("failed")
+
+        @time_execution_async(extra_hooks=[slow_hook("fast", 0), failing_hook])
+        async def func():
+            pass
+
+        with pytest.raises(RuntimeError):
+            await func()
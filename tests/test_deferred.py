@@ -0,0 +1,149 @@
+import multiprocessing
+import threading
+
+import mock
+import pytest
+
+from tests.conftest import MemoryBackend
+from tests.test_decorator_async import go_async
+from tests.test_hooks import CollectorBackend
+from time_execution import settings, time_execution
+from time_execution.backends.threaded import ThreadedBackend
+from time_execution.deferred import DeferredHook, _pool, deferred, flush
+from time_execution.timed import COROUTINE_HOOK, DEFERRED_HOOK, GENERATOR_HOOK, classify_hook
+
+
+@time_execution
+def view(*args, **kwargs):
+    return "response"
+
+
+def thread_hook(**kwargs):
+    return {"thread": threading.current_thread().name}
+
+
+def inputs_hook(**kwargs):
+    return {"inputs": kwargs}
+
+
+def generator_hook(func, func_args, func_kwargs):
+    yield
+    return {"generator": True}
+
+
+async def coroutine_hook(**kwargs):
+    return {"coroutine": True}
+
+
+def run(func, hooks, backend=None):
+    backend = backend or CollectorBackend()
+    with settings(backends=[backend], hooks=hooks):
+        func()
+        assert flush(timeout=5)
+    return backend
+
+
+def metric(collector):
+    [item] = collector.metrics
+    return next(iter(item.values()))
+
+
+class TestDeferred:
+    def test_unknown_inputs(self):
+        with pytest.raises(ValueError):
+            deferred(thread_hook, needs=("request",))
+
+    def test_decorator(self):
+        hook = deferred(needs=("response",))(thread_hook)
+        assert isinstance(hook, DeferredHook)
+        assert (hook.hook, hook.needs) == (thread_hook, ("response",))
+
+    def test_classify(self):
+        assert classify_hook(deferred(thread_hook)) == DEFERRED_HOOK
+        # hooks which must run around the call stay inline
+        assert classify_hook(deferred(generator_hook)) == GENERATOR_HOOK
+        assert classify_hook(deferred(coroutine_hook)) == COROUTINE_HOOK
+
+    def test_runs_on_the_pool(self):
+        release = threading.Event()
+
+        def slow_hook(**kwargs):
+            release.wait(5)
+            return thread_hook()
+
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[deferred(slow_hook)]):
+            assert view() == "response"
+            assert collector.metrics == []
+            release.set()
+            assert flush(timeout=5)
+        assert metric(collector)["thread"].startswith("TimeExecutionHooks")
+
+    def test_only_the_needed_inputs_are_captured(self):
+        collector = run(lambda: view(1, key=2), [deferred(inputs_hook, needs=("response", "func_args"))])
+        assert metric(collector)["inputs"] == {
+            "response": "response",
+            "exception": None,
+            "metric": None,
+            "func": None,
+            "func_args": (1,),
+            "func_kwargs": None,
+        }
+
+    def test_metric_of_the_inline_hooks(self):
+        inline_hook = mock.Mock(return_value={"inline": True})
+        collector = run(view, [deferred(inputs_hook, needs=("metric",)), inline_hook])
+        fields = metric(collector)
+        assert fields["inline"] is True
+        assert fields["inputs"]["metric"]["inline"] is True
+        assert "inputs" not in fields["inputs"]["metric"]
+
+    def test_failing_hook(self):
+        def failing_hook(**kwargs):
+            raise RuntimeError("failed")
+
+        with mock.patch("time_execution.deferred.logger") as mocked_logger:
+            collector = run(view, [deferred(failing_hook), deferred(thread_hook)])
+        mocked_logger.exception.assert_called_once()
+        assert "thread" in metric(collector)
+
+    def test_generator_hook_stays_inline(self):
+        collector = run(view, [deferred(generator_hook)])
+        assert metric(collector)["generator"] is True
+
+    def test_pool_is_full(self):
+        with mock.patch.object(_pool, "pending", threading.BoundedSemaphore(1)) as pending:
+            pending.acquire()
+            collector = run(view, [deferred(thread_hook)])
+        assert metric(collector)["thread"] == threading.current_thread().name
+
+    @pytest.mark.asyncio
+    async def test_async(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[deferred(thread_hook)]):
+            await go_async()
+            assert flush(timeout=5)
+        assert metric(collector)["thread"].startswith("TimeExecutionHooks")
+
+
+class TestThreadedBackend:
+    def test_runs_on_the_worker(self):
+        backend = run(view, [deferred(thread_hook)], ThreadedBackend(MemoryBackend))
+        assert backend.close(timeout=5)
+        [fields] = backend.backend.metrics
+        assert fields["thread"] == "TimeExecutionThread"
+
+    def test_not_with_other_backends(self):
+        collector = CollectorBackend()
+        backend = ThreadedBackend(MemoryBackend)
+        with settings(backends=[backend, collector], hooks=[deferred(thread_hook)]):
+            view()
+            assert flush(timeout=5)
+        assert backend.close(timeout=5)
+        assert backend.backend.metrics[0]["thread"] == metric(collector)["thread"]
+        assert metric(collector)["thread"].startswith("TimeExecutionHooks")
+
+    def test_not_with_multiprocessing_queue(self):
+        backend = ThreadedBackend(MemoryBackend, queue_class=multiprocessing.Queue)
+        assert not backend.accepts_deferred
+        backend.close(timeout=5)
@@ -1,7 +1,13 @@
+import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from uuid import UUID
 
 import mock
+import pytest
+import pytest_asyncio
 from elasticsearch.exceptions import TransportError
 from fqn_decorators import get_fqn
 from freezegun import freeze_time
@@ -9,7 +15,14 @@ from freezegun import freeze_time
 from tests.conftest import Dummy, go
 from tests.test_base_backend import TestBaseBackend
 from time_execution import settings
-from time_execution.backends.elasticsearch import ElasticsearchBackend
+from time_execution.backends.elasticsearch import (
+    AsyncElasticsearchBackend,
+    ElasticsearchBackend,
+    get_granularity,
+    json_serializer,
+    orjson_serializer,
+)
+from time_execution.telemetry import telemetry
 
 # These variables are set by tox-docker. See https://tox-docker.readthedocs.io/en/latest/#configuration
 ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST")
@@ -183,3 +196,271 @@ class TestTimeExecution(BaseTestTimeExecutionElasticSearch):
             assert mocked_index.call_args.kwargs["pipeline"] == "custom-pipeline"
 
         ElasticTestMixin._clear(backend)
+
+
+class TestBulkSerialization:
+    @pytest.fixture
+    def backend(self):
+        return ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+
+    @pytest.mark.parametrize("serializer", [json_serializer, orjson_serializer])
+    def test_serializers(self, serializer):
+        document = {"name": "metric.name", "value": 1.5, "timestamp": datetime(2016, 7, 13, 1, 2, 3, 4)}
+        assert json.loads(serializer(document)) == {
+            "name": "metric.name",
+            "value": 1.5,
+            "timestamp": "2016-07-13T01:02:03.000004",
+        }
+
+    @freeze_time("2016-07-13")
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_ndjson_body(self, mocked_bulk, backend):
+        metrics = [
+            {"name": "metric.name", "value": 1, "timestamp": datetime(2016, 7, 13)},
+            {"name": "metric.name", "value": 2, "timestamp": datetime(2016, 7, 13)},
+        ]
+        backend.bulk_write(metrics)
+
+        body = mocked_bulk.call_args.kwargs["operations"]
+        assert isinstance(body, bytes)
+        assert body.endswith(b"\n")
+        lines = [json.loads(line) for line in body.splitlines()]
+        assert lines == [
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "metric.name", "value": 1, "timestamp": "2016-07-13T00:00:00"},
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "metric.name", "value": 2, "timestamp": "2016-07-13T00:00:00"},
+        ]
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_custom_serializer(self, mocked_bulk):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, serializer=lambda document: b"{}")
+        backend.bulk_write([{"name": "metric.name"}])
+        assert mocked_bulk.call_args.kwargs["operations"].splitlines()[1] == b"{}"
+
+    @pytest.mark.parametrize("serializer", [json_serializer, orjson_serializer])
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_client_types(self, mocked_bulk, serializer):
+        # Like the client's own serializer.
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, serializer=serializer)
+        backend.bulk_write(
+            [
+                {
+                    "name": "metric.name",
+                    "request_id": UUID("12345678-1234-5678-1234-567812345678"),
+                    "cost": Decimal("1.5"),
+                }
+            ]
+        )
+        document = json.loads(mocked_bulk.call_args.kwargs["operations"].splitlines()[1])
+        assert (document["request_id"], document["cost"]) == ("12345678-1234-5678-1234-567812345678", 1.5)
+
+    @pytest.mark.parametrize("serializer", [json_serializer, orjson_serializer])
+    @mock.patch("time_execution.backends.elasticsearch.logger")
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_serialization_failure(self, mocked_bulk, mocked_logger, serializer):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, serializer=serializer)
+        backend.bulk_write([{"name": "metric.name", "tags": {"a"}}, {"name": "other.name"}])
+        mocked_logger.warning.assert_called_once()
+        lines = mocked_bulk.call_args.kwargs["operations"].splitlines()
+        assert [json.loads(line) for line in lines[1::2]] == [{"name": "other.name"}]
+
+        mocked_bulk.reset_mock()
+        backend.bulk_write([{"name": "metric.name", "tags": {"a"}}])
+        mocked_bulk.assert_not_called()
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk", side_effect=TransportError("mocked error"))
+    def test_raise_on_error(self, mocked_bulk):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, raise_on_error=True)
+        with pytest.raises(TransportError):
+            backend.bulk_write([{"name": "metric.name"}])
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_telemetry(self, mocked_bulk, backend):
+        telemetry.snapshot(reset=True)
+        telemetry.enable()
+        try:
+            backend.bulk_write([{"name": "metric.name"}])
+            mocked_bulk.side_effect = TransportError("mocked error")
+            backend.bulk_write([{"name": "metric.name"}, {"name": "metric.name"}])
+            snapshot = telemetry.snapshot(reset=True)
+        finally:
+            telemetry.disable()
+        assert snapshot["elasticsearch.bulk"]["count"] == 2
+        assert snapshot["elasticsearch.bulk_bytes"]["min"] == len(mocked_bulk.call_args_list[0].kwargs["operations"])
+        assert snapshot["elasticsearch.failures"]["sum"] == 2
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_empty_bulk(self, mocked_bulk, backend):
+        backend.bulk_write([])
+        mocked_bulk.assert_not_called()
+
+    def test_action_header_is_reused(self, backend):
+        header = backend.get_action_header("unittest-2016.07.13")
+        assert header == b'{"index":{"_index":"unittest-2016.07.13"}}'
+        assert backend.get_action_header("unittest-2016.07.13") is header
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch")
+    def test_http_compress(self, mocked_elasticsearch):
+        ElasticsearchBackend(ELASTICSEARCH_URI, http_compress=True)
+        assert mocked_elasticsearch.call_args.kwargs["http_compress"] is True
+
+
+class TestIndexName:
+    @pytest.mark.parametrize(
+        "index_pattern, granularity",
+        [
+            ("{index}-{date:%Y.%m.%d}", 24 * 60 * 60),
+            ("{index}-{date:%Y.%m}", 24 * 60 * 60),
+            ("{index}-{date:%Y.%m.%d.%H}", 60 * 60),
+            ("{index}-{date:%H%M}", 60),
+            ("{index}", None),
+            ("{index}-{date}", 0),
+            ("{index}-{date:%Y.%f}", 0),
+        ],
+    )
+    def test_granularity(self, index_pattern, granularity):
+        assert get_granularity(index_pattern) == granularity
+
+    def test_current_index_is_cached_until_midnight(self):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        with freeze_time("2016-07-13 23:59:59") as frozen_time:
+            with mock.patch.object(backend, "index_pattern", wraps=backend.index_pattern) as mocked_pattern:
+                assert backend.get_index() == "unittest-2016.07.13"
+                assert backend.get_index() == "unittest-2016.07.13"
+                assert mocked_pattern.format.call_count == 1
+                frozen_time.tick(timedelta(seconds=1))
+                assert backend.get_index() == "unittest-2016.07.14"
+                assert mocked_pattern.format.call_count == 2
+
+    def test_current_index_hourly(self):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest", index_pattern="{index}-{date:%Y.%m.%d.%H}")
+        with freeze_time("2016-07-13 10:30:00") as frozen_time:
+            assert backend.get_index() == "unittest-2016.07.13.10"
+            frozen_time.tick(timedelta(minutes=29))
+            assert backend.get_index() == "unittest-2016.07.13.10"
+            frozen_time.tick(timedelta(minutes=1))
+            assert backend.get_index() == "unittest-2016.07.13.11"
+
+    def test_constant_index(self):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest", index_pattern="{index}")
+        assert backend.get_index() == "unittest"
+        assert backend.get_index(datetime(2016, 7, 13)) == "unittest"
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_bulk_crossing_midnight(self, mocked_bulk):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        metrics = [
+            {"name": "a", "timestamp": datetime(2016, 7, 13, 23, 59, 59)},
+            {"name": "b", "timestamp": datetime(2016, 7, 14, 0, 0, 0)},
+            {"name": "c", "timestamp": datetime(2016, 7, 13, 23, 59, 59, 999999)},
+        ]
+        with freeze_time("2016-07-14 00:00:01"):
+            backend.bulk_write(metrics)
+
+        lines = [json.loads(line) for line in mocked_bulk.call_args.kwargs["operations"].splitlines()]
+        assert lines == [
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "a", "timestamp": "2016-07-13T23:59:59"},
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "c", "timestamp": "2016-07-13T23:59:59.999999"},
+            {"index": {"_index": "unittest-2016.07.14"}},
+            {"name": "b", "timestamp": "2016-07-14T00:00:00"},
+        ]
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_bulk_without_timestamps(self, mocked_bulk):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        with freeze_time("2016-07-14"):
+            backend.bulk_write([{"name": "a"}, {"name": "b", "timestamp": 1}])
+
+        lines = [json.loads(line) for line in mocked_bulk.call_args.kwargs["operations"].splitlines()]
+        assert lines[0] == lines[2] == {"index": {"_index": "unittest-2016.07.14"}}
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_bulk_with_timestamp_ns(self, mocked_bulk):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        backend.bulk_write([{"name": "a", "timestamp_ns": 1468454399000000000}])
+
+        lines = [json.loads(line) for line in mocked_bulk.call_args.kwargs["operations"].splitlines()]
+        assert lines == [
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "a", "timestamp": "2016-07-13T23:59:59"},
+        ]
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.index")
+    def test_write_with_timestamp_ns(self, mocked_index):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        backend.write("a", timestamp_ns=1468454399000000000)
+        assert mocked_index.call_args.kwargs["index"] == "unittest-2016.07.13"
+        assert mocked_index.call_args.kwargs["body"] == {"name": "a", "timestamp": datetime(2016, 7, 13, 23, 59, 59)}
+
+    @pytest.fixture
+    def auckland(self, monkeypatch):
+        monkeypatch.setenv("TZ", "Pacific/Auckland")
+        time.tzset()
+        yield
+        monkeypatch.undo()
+        time.tzset()
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.bulk")
+    def test_local_time(self, mocked_bulk, auckland):
+        # The timestamps are UTC, the index is rendered in local time like the current one.
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest", index_pattern="{index}-{date:%Y.%m.%d.%H}")
+        backend.bulk_write(
+            [
+                {"name": "a", "timestamp": datetime(2016, 7, 13, 11, 59, 59)},
+                {"name": "b", "timestamp": "2016-07-13T12:00:00"},
+                {"name": "c", "timestamp_ns": time.time_ns()},
+            ]
+        )
+        lines = [json.loads(line) for line in mocked_bulk.call_args.kwargs["operations"].splitlines()]
+        assert [line["index"]["_index"] for line in lines[::2]] == [
+            "unittest-2016.07.13.23",
+            "unittest-2016.07.14.00",
+            backend.get_index(),
+        ]
+
+    @mock.patch("time_execution.backends.elasticsearch.Elasticsearch.index")
+    def test_write_uses_timestamp(self, mocked_index):
+        backend = ElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        backend.write("a", timestamp=datetime(2016, 7, 13, 23, 59, 59))
+        assert mocked_index.call_args.kwargs["index"] == "unittest-2016.07.13"
+
+
+class TestAsyncElasticsearch:
+    pytestmark = pytest.mark.asyncio
+
+    @pytest_asyncio.fixture
+    async def backend(self):
+        backend = AsyncElasticsearchBackend(ELASTICSEARCH_URI, index="unittest")
+        yield backend
+        await backend.close()
+
+    @freeze_time("2016-07-13")
+    @mock.patch("time_execution.backends.elasticsearch.AsyncElasticsearch.bulk", new_callable=mock.AsyncMock)
+    async def test_bulk_write(self, mocked_bulk, backend):
+        await backend.bulk_write([{"name": "metric.name", "value": 1, "timestamp": datetime(2016, 7, 13)}])
+
+        lines = [json.loads(line) for line in mocked_bulk.call_args.kwargs["operations"].splitlines()]
+        assert lines == [
+            {"index": {"_index": "unittest-2016.07.13"}},
+            {"name": "metric.name", "value": 1, "timestamp": "2016-07-13T00:00:00"},
+        ]
+
+    @mock.patch("time_execution.backends.elasticsearch.AsyncElasticsearch.bulk", new_callable=mock.AsyncMock)
+    async def test_empty_bulk(self, mocked_bulk, backend):
+        await backend.bulk_write([])
+        mocked_bulk.assert_not_awaited()
+
+    @mock.patch("time_execution.backends.elasticsearch.logger")
+    async def test_bulk_write_error(self, mocked_logger, backend):
+        with mock.patch.object(backend.client, "bulk", side_effect=TransportError("mocked error")):
+            await backend.bulk_write([{"name": "metric.name"}])
+        mocked_logger.warning.assert_called_once()
+
+    @mock.patch("time_execution.backends.elasticsearch.AsyncElasticsearch.index", new_callable=mock.AsyncMock)
+    async def test_write(self, mocked_index, backend):
+        await backend.write("metric.name", value=1, timestamp=datetime(2016, 7, 13))
+        assert mocked_index.call_args.kwargs["index"] == "unittest-2016.07.13"
+        assert mocked_index.call_args.kwargs["body"]["name"] == "metric.name"
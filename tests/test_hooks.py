@@ -1,9 +1,11 @@
+import mock
 import pytest
 from fqn_decorators import get_fqn
 
 from tests.conftest import go
 from time_execution import GeneratorHookReturnType, settings, time_execution, time_execution_async
 from time_execution.backends.base import BaseMetricsBackend
+from time_execution.timed import COROUTINE_HOOK, GENERATOR_HOOK, PLAIN_HOOK, HookPlan, classify_hook
 
 
 class AssertBackend(BaseMetricsBackend):
@@ -298,3 +300,52 @@ class TestTimeExecution:
 
         with pytest.raises(RuntimeError, match="generator hook did not stop"):
             go()
+
+
+class TestHookPlan:
+    def test_classifies_hooks_in_order(self):
+        def generator_hook(func, func_args, func_kwargs):
+            yield
+            return {}
+
+        with settings(hooks=[global_hook, async_global_hook]):
+            plan = HookPlan(extra_hooks=[generator_hook, local_hook])
+            assert plan.steps == (
+                (PLAIN_HOOK, global_hook),
+                (COROUTINE_HOOK, async_global_hook),
+                (GENERATOR_HOOK, generator_hook),
+                (PLAIN_HOOK, local_hook),
+            )
+
+    def test_plan_is_cached(self):
+        with settings(hooks=[global_hook]):
+            plan = HookPlan()
+            with mock.patch("time_execution.timed.classify_hook", wraps=classify_hook) as mocked_classify:
+                for _ in range(3):
+                    plan.steps
+            mocked_classify.assert_called_once_with(global_hook)
+
+    def test_plan_follows_settings(self):
+        plan = HookPlan(extra_hooks=[local_hook])
+        with settings(hooks=[global_hook]):
+            assert plan.steps == ((PLAIN_HOOK, global_hook), (PLAIN_HOOK, local_hook))
+            with settings(hooks=[]):
+                assert plan.steps == ((PLAIN_HOOK, local_hook),)
+            assert plan.steps == ((PLAIN_HOOK, global_hook), (PLAIN_HOOK, local_hook))
+
+    def test_disable_default_hooks(self):
+        with settings(hooks=[global_hook]):
+            assert HookPlan(extra_hooks=[local_hook], disable_default_hooks=True).steps == ((PLAIN_HOOK, local_hook),)
+
+    def test_decorated_function_picks_up_new_hooks(self):
+        @time_execution
+        def go():
+            return True
+
+        with settings(backends=[CollectorBackend()], hooks=[]):
+            collector = settings.backends[0]
+            go()
+            assert "global_hook_key" not in collector.metrics[0][go.get_fqn()]
+            with settings(backends=[collector], hooks=[global_hook]):
+                go()
+            assert collector.metrics[1][go.get_fqn()]["global_hook_key"] == "global hook value"
@@ -0,0 +1,116 @@
+import threading
+import time
+from queue import Empty, Full
+
+import pytest
+
+from time_execution.queues import RingBufferQueue
+
+
+class TestRingBufferQueue:
+    def test_fifo(self):
+        q = RingBufferQueue()
+        for i in range(5):
+            q.put_nowait(i)
+        assert q.qsize() == 5
+        assert [q.get() for _ in range(5)] == list(range(5))
+        assert q.empty()
+
+    def test_bounded(self):
+        q = RingBufferQueue(maxsize=2)
+        q.put_nowait(1)
+        q.put_nowait(2)
+        assert q.full()
+        with pytest.raises(Full):
+            q.put_nowait(3)
+        assert q.get_nowait() == 1
+        q.put_nowait(3)
+        assert [q.get_nowait(), q.get_nowait()] == [2, 3]
+
+    def test_get_empty(self):
+        q = RingBufferQueue()
+        with pytest.raises(Empty):
+            q.get_nowait()
+        with pytest.raises(Empty):
+            q.get(block=False)
+        start = time.monotonic()
+        with pytest.raises(Empty):
+            q.get(timeout=0.05)
+        assert time.monotonic() - start >= 0.05
+
+    def test_get_wakes_up(self):
+        q = RingBufferQueue()
+        timer = threading.Timer(0.05, q.put_nowait, args=("item",))
+        timer.start()
+        start = time.monotonic()
+        assert q.get(timeout=5) == "item"
+        assert time.monotonic() - start < 5
+        timer.join()
+
+    def test_wait_for_items(self):
+        q = RingBufferQueue()
+        q.put_nowait(1)
+        producer = threading.Thread(target=lambda: [q.put_nowait(i) for i in range(2, 4)])
+        producer.start()
+        assert q.wait(3, timeout=5)
+        producer.join()
+        assert q.qsize() == 3
+
+    def test_wait_timeout(self):
+        q = RingBufferQueue()
+        q.put_nowait(1)
+        start = time.monotonic()
+        assert not q.wait(2, timeout=0.05)
+        assert time.monotonic() - start >= 0.05
+
+    def test_wake(self):
+        q = RingBufferQueue()
+        timer = threading.Timer(0.05, q.wake)
+        timer.start()
+        start = time.monotonic()
+        assert not q.wait(2, timeout=5)
+        assert time.monotonic() - start < 5
+        timer.join()
+
+    def test_put_waits_for_room(self):
+        q = RingBufferQueue(maxsize=1)
+        q.put_nowait(1)
+        timer = threading.Timer(0.05, q.get_nowait)
+        timer.start()
+        q.put(2, timeout=5)
+        timer.join()
+        assert q.get_nowait() == 2
+
+    def test_put_timeout(self):
+        q = RingBufferQueue(maxsize=1)
+        q.put_nowait(1)
+        with pytest.raises(Full):
+            q.put(2, block=False)
+        start = time.monotonic()
+        with pytest.raises(Full):
+            q.put(2, timeout=0.05)
+        assert time.monotonic() - start >= 0.05
+
+    def test_concurrent_producers(self):
+        q = RingBufferQueue()
+        count, producers = 10000, 4
+        received = []
+
+        def consume():
+            while len(received) < count * producers:
+                received.append(q.get(timeout=5))
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        threads = [
+            threading.Thread(target=lambda p=p: [q.put_nowait((p, i)) for i in range(count)]) for p in range(producers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        consumer.join()
+
+        assert len(received) == count * producers
+        for p in range(producers):
+            assert [i for producer, i in received if producer == p] == list(range(count))
@@ -0,0 +1,122 @@
+import pickle
+from datetime import datetime
+
+import mock
+
+from tests.conftest import go
+from tests.test_hooks import CollectorBackend
+from time_execution import SHORT_HOSTNAME, settings, time_execution
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.records import MetricRecord
+from time_execution.timestamps import convert_timestamps
+
+
+class RecordBackend(BaseMetricsBackend):
+    accepts_records = True
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, name, **data):
+        raise AssertionError("a record is expected")
+
+    def write_record(self, record):
+        self.records.append(record)
+
+
+def record(**kwargs):
+    return MetricRecord("name", 1.5, "value", "host", 1468371723000004000, **kwargs)
+
+
+class TestMetricRecord:
+    def test_to_dict(self):
+        assert record().to_dict() == {
+            "value": 1.5,
+            "hostname": "host",
+            "name": "name",
+            "timestamp_ns": 1468371723000004000,
+        }
+
+    def test_to_dict_with_optional_fields(self):
+        metric = record(cpu_time=1.0, origin="app", sample_weight=4.0).to_dict()
+        assert (metric["cpu_time"], metric["origin"], metric["sample_weight"]) == (1.0, "app", 4.0)
+
+    def test_to_dict_with_span(self):
+        assert record(span_id="b", parent_id="a", self_time=0.5).to_dict()["parent_id"] == "a"
+        metric = record(span_id="a", self_time=1.5).to_dict()
+        assert (metric["span_id"], metric["self_time"]) == ("a", 1.5)
+        assert "parent_id" not in metric
+
+    def test_extra_takes_precedence(self):
+        metric = record(extra={"value": 2.0, "key": "value"}).to_dict()
+        assert (metric["value"], metric["key"]) == (2.0, "value")
+
+    def test_get(self):
+        metric = record(origin="app", extra={"key": "value", "hostname": "other"})
+        assert metric.get("value") == 1.5
+        assert metric.get("name") == "name"
+        assert metric.get("hostname") == "other"
+        assert metric.get("timestamp_ns") == 1468371723000004000
+        assert metric.get("origin") == "app"
+        assert metric.get("key") == "value"
+        assert metric.get("cpu_time") is None
+        assert metric.get("missing", "default") == "default"
+
+    def test_pickle(self):
+        metric = record(origin="app", extra={"key": "value"})
+        assert pickle.loads(pickle.dumps(metric)) == metric
+
+
+class TestWriteRecord:
+    def test_backend_receives_record(self):
+        backend = RecordBackend()
+        with settings(backends=[backend], hooks=[]):
+            go()
+        (metric,) = backend.records
+        assert isinstance(metric, MetricRecord)
+        assert (metric.name, metric.hostname, metric.extra) == (go.get_fqn(), SHORT_HOSTNAME, None)
+        assert metric.duration >= 0
+
+    def test_hooks(self):
+        def hook(metric, **kwargs):
+            metric["value"] = -1
+            return {"key": "value"}
+
+        backend = RecordBackend()
+        with settings(backends=[backend], hooks=[hook]):
+            go()
+        metric = backend.records[0].to_dict()
+        assert (metric["value"], metric["key"]) == (-1, "value")
+
+    def test_backends_which_dont_accept_records(self):
+        record_backend, collector = RecordBackend(), CollectorBackend()
+        # A mock has any attribute, it's only given a record when `accepts_records` is `True`.
+        mocked_backend = mock.Mock()
+        with settings(backends=[record_backend, collector, mocked_backend], hooks=[]):
+            go()
+        metric = record_backend.records[0].to_dict()
+        # with a `timestamp` rather than `timestamp_ns`, like the metrics of `bulk_write`
+        convert_timestamps((metric,))
+        assert collector.metrics == [{metric.pop("name"): metric}]
+        assert isinstance(metric["timestamp"], datetime)
+        mocked_backend.write.assert_called_once()
+        mocked_backend.write_record.assert_not_called()
+
+    def test_default_write_record(self):
+        collector = CollectorBackend()
+        collector.write_record(record())
+        assert collector.metrics == [
+            {"name": {"value": 1.5, "hostname": "host", "timestamp": datetime(2016, 7, 13, 1, 2, 3, 4)}}
+        ]
+
+    def test_accepts_records_is_cached(self):
+        @time_execution
+        def func():
+            pass
+
+        backend = RecordBackend()
+        with settings(backends=[backend], hooks=[]):
+            func()
+            backend.accepts_records = False
+            func()  # the backends are only inspected when the settings change
+        assert len(backend.records) == 2
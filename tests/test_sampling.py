@@ -0,0 +1,152 @@
+import threading
+
+import mock
+import pytest
+
+from tests.test_hooks import CollectorBackend
+from time_execution import settings, time_execution
+from time_execution.sampling import AdaptiveSampler, FixedRateSampler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFixedRateSampler:
+    @pytest.mark.parametrize("rate", [0, -0.1, 1.5])
+    def test_invalid_rate(self, rate):
+        with pytest.raises(ValueError):
+            FixedRateSampler(rate)
+
+    def test_sample(self):
+        sampler = FixedRateSampler(0.25)
+        with mock.patch("time_execution.sampling.random", side_effect=[0.1, 0.3]):
+            assert sampler.sample("name") == 4.0
+            assert sampler.sample("name") == 0.0
+
+    def test_always(self):
+        sampler = FixedRateSampler(1)
+        assert all(sampler.sample("name") == 1.0 for _ in range(100))
+
+
+class TestAdaptiveSampler:
+    def test_below_target(self):
+        clock = FakeClock()
+        sampler = AdaptiveSampler(target=10, clock=clock)
+        for second in range(3):
+            for _ in range(5):
+                assert sampler.sample("name") == 1.0
+            clock.now += 1.0
+        assert sampler.rate("name") == 1.0
+
+    def test_adapts_to_arrival_rate(self):
+        clock = FakeClock()
+        sampler = AdaptiveSampler(target=10, clock=clock)
+        kept = []
+        with mock.patch("time_execution.sampling.random", return_value=0.5):
+            for _ in range(10):
+                for _ in range(100):
+                    kept.append(sampler.sample("name"))
+                clock.now += 1.0
+        # the first window runs out of budget after 10 calls, then the rate follows the arrival rate
+        assert sampler.rate("name") == pytest.approx(0.1)
+        assert sampler.rate("other") == 1.0
+
+    def test_weights_correct_counts(self):
+        clock = FakeClock()
+        sampler = AdaptiveSampler(target=50, clock=clock)
+        total = 0.0
+        calls = 20 * 1000
+        for _ in range(20):
+            for i in range(1000):
+                clock.now += 0.001
+                total += sampler.sample("name")
+        assert total == pytest.approx(calls, rel=0.1)
+        assert sampler.rate("name") < 0.1
+
+    def test_names_are_independent(self):
+        clock = FakeClock()
+        sampler = AdaptiveSampler(target=1, clock=clock)
+        assert sampler.sample("a") == 1.0
+        assert sampler.sample("b") == 1.0
+
+    def test_max_names(self):
+        clock = FakeClock()
+        sampler = AdaptiveSampler(target=10, clock=clock, max_names=3)
+        sampler.sample("idle")
+        clock.now += 1.0
+        sampler.sample("a")
+        sampler.sample("b")
+        # the idle name makes room
+        sampler.sample("c")
+        assert set(sampler._windows) == {"a", "b", "c"}
+        # none is idle, they're all forgotten
+        sampler.sample("d")
+        assert set(sampler._windows) == {"d"}
+
+    def test_threads(self):
+        # the window never ends, so every call is counted
+        sampler = AdaptiveSampler(target=1000000, clock=FakeClock())
+
+        def sample():
+            for i in range(10000):
+                sampler.sample("name-%d" % (i % 10))
+
+        threads = [threading.Thread(target=sample) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(window.seen for window in sampler._windows.values()) == 40000
+
+
+class TestSampledDecorator:
+    def test_unsampled_calls_skip_hooks(self):
+        hook = mock.Mock(return_value={})
+        sampler = FixedRateSampler(0.5)
+
+        @time_execution(sampler=sampler)
+        def go():
+            return True
+
+        with settings(backends=[CollectorBackend()], hooks=[hook]):
+            collector = settings.backends[0]
+            with mock.patch("time_execution.sampling.random", side_effect=[0.9, 0.1]):
+                assert go() is True
+                assert hook.call_count == 0
+                assert collector.metrics == []
+                assert go() is True
+            assert hook.call_count == 1
+            assert collector.metrics[0][go.get_fqn()]["sample_weight"] == 2.0
+
+    def test_sampler_from_settings(self):
+        @time_execution
+        def go():
+            return True
+
+        with settings(backends=[CollectorBackend()], hooks=[], sampler=FixedRateSampler(1)):
+            collector = settings.backends[0]
+            go()
+            assert collector.metrics[0][go.get_fqn()]["sample_weight"] == 1.0
+
+        with settings(backends=[collector], hooks=[]):
+            go()
+            assert "sample_weight" not in collector.metrics[1][go.get_fqn()]
+
+    @pytest.mark.asyncio
+    async def test_unsampled_async(self):
+        @time_execution(sampler=FixedRateSampler(0.5))
+        async def go():
+            return True
+
+        with settings(backends=[CollectorBackend()], hooks=[]):
+            collector = settings.backends[0]
+            with mock.patch("time_execution.sampling.random", side_effect=[0.9, 0.1]):
+                assert await go() is True
+                assert await go() is True
+            assert len(collector.metrics) == 1
+            assert collector.metrics[0][go.get_fqn()]["sample_weight"] == 2.0
@@ -0,0 +1,70 @@
+import json
+import random
+
+import pytest
+
+from time_execution.sketch import DDSketch
+
+
+@pytest.fixture
+def values():
+    rnd = random.Random(42)
+    return [rnd.lognormvariate(0, 2) for _ in range(10000)]
+
+
+class TestDDSketch:
+    @pytest.mark.parametrize("q", [0.01, 0.25, 0.5, 0.9, 0.99, 0.999])
+    def test_relative_accuracy(self, values, q):
+        sketch = DDSketch.of(values, relative_accuracy=0.01)
+        expected = sorted(values)[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+    def test_summary(self, values):
+        sketch = DDSketch.of(values)
+        assert sketch.count == len(values)
+        assert sketch.sum == pytest.approx(sum(values))
+        assert sketch.min == min(values)
+        assert sketch.max == max(values)
+        assert sketch.quantile(0) == min(values)
+        assert sketch.quantile(1) == max(values)
+
+    def test_empty(self):
+        assert DDSketch().quantile(0.5) is None
+
+    def test_zero(self):
+        sketch = DDSketch.of([0.0, 0.0, 0.0, 5.0])
+        assert sketch.zero_count == 3
+        assert sketch.quantile(0.5) == 0.0
+        assert sketch.quantile(1) == 5.0
+
+    def test_merge_is_exact(self, values):
+        whole = DDSketch.of(values)
+        merged = DDSketch.of(values[:3000])
+        merged.merge(DDSketch.of(values[3000:7000]))
+        merged.merge(DDSketch.of(values[7000:]))
+        assert merged.bins == whole.bins
+        assert merged.count == whole.count
+        assert (merged.min, merged.max) == (whole.min, whole.max)
+
+    def test_merge_different_accuracy(self):
+        with pytest.raises(ValueError):
+            DDSketch(relative_accuracy=0.01).merge(DDSketch(relative_accuracy=0.02))
+
+    def test_bounded_bins(self, values):
+        sketch = DDSketch.of(values, max_bins=64)
+        assert len(sketch.bins) == 64
+        assert sketch.count == len(values)
+        expected = sorted(values)[int(0.99 * (len(values) - 1))]
+        assert sketch.quantile(0.99) == pytest.approx(expected, rel=0.01)
+
+    def test_serialization_roundtrip(self, values):
+        sketch = DDSketch.of(values)
+        restored = DDSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+        assert restored.bins == sketch.bins
+        assert restored.quantile(0.5) == sketch.quantile(0.5)
+        assert (restored.count, restored.min, restored.max) == (sketch.count, sketch.min, sketch.max)
+
+    @pytest.mark.parametrize("kwargs", [{"relative_accuracy": 0}, {"relative_accuracy": 1}, {"max_bins": 0}])
+    def test_invalid_parameters(self, kwargs):
+        with pytest.raises(ValueError):
+            DDSketch(**kwargs)
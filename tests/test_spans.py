@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import threading
+
+import mock
+import pytest
+
+from tests.test_hooks import CollectorBackend
+from time_execution import settings, span, time_execution
+from time_execution.sampling import FixedRateSampler
+from time_execution.spans import Span, current_span, enter_span, exit_span
+
+
+@time_execution
+def leaf():
+    return current_span()
+
+
+@time_execution
+def branch():
+    leaf()
+    leaf()
+    return current_span()
+
+
+@time_execution
+async def leaf_async():
+    await asyncio.sleep(0.01)
+
+
+@time_execution
+async def gather():
+    await asyncio.gather(leaf_async(), leaf_async(), leaf_async())
+
+
+def timed(func, *args):
+    collector = CollectorBackend()
+    with settings(backends=[collector], hooks=[], spans=True):
+        result = func(*args)
+    metrics = [(name, metric) for item in collector.metrics for name, metric in item.items()]
+    return result, metrics
+
+
+class TestSpan:
+    def test_child_time(self):
+        span = Span(None)
+        span.child_started(10)
+        span.child_finished(30)
+        span.child_started(40)
+        assert span.child_time_ns(45) == 25
+        span.child_finished(50)
+        assert span.child_time_ns(100) == 30
+
+    def test_overlapping_children(self):
+        span = Span(None)
+        span.child_started(10)
+        span.child_started(20)
+        span.child_finished(25)
+        span.child_finished(40)
+        assert span.child_time_ns(100) == 30
+
+    def test_ids(self):
+        parent = Span(None)
+        child = Span(parent)
+        assert len(parent.span_id) == 16
+        assert parent.span_id != child.span_id
+        assert (parent.parent_id, child.parent_id) == (None, parent.span_id)
+
+    def test_enter_and_exit(self):
+        assert current_span() is None
+        parent, parent_token = enter_span(0)
+        child, child_token = enter_span(10)
+        assert current_span() is child
+        assert child.parent is parent
+        assert exit_span(child, child_token, 20) == 0
+        assert current_span() is parent
+        assert exit_span(parent, parent_token, 100) == 10
+        assert current_span() is None
+
+    def test_exit_in_copied_context(self):
+        span, token = enter_span(0)
+        context = contextvars.copy_context()
+        context.run(exit_span, span, token, 10)
+        assert context.run(current_span) is None
+        exit_span(span, token, 10)
+        assert current_span() is None
+
+
+class TestSpans:
+    def test_disabled_by_default(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[]):
+            assert branch() is None
+        assert all("span_id" not in metric for item in collector.metrics for metric in item.values())
+
+    def test_nesting(self):
+        span, metrics = timed(branch)
+        (leaf_name, first), (_, second), (branch_name, parent) = metrics
+        assert (leaf_name, branch_name) == (leaf.fqn, branch.fqn)
+        assert span.span_id == parent["span_id"]
+        assert "parent_id" not in parent
+        assert first["parent_id"] == second["parent_id"] == parent["span_id"]
+        assert first["self_time"] == first["value"]
+        assert parent["self_time"] == pytest.approx(parent["value"] - first["value"] - second["value"], abs=0.01)
+        assert current_span() is None
+
+    def test_self_time(self):
+        clock = iter([0, 1000000, 3000000, 5000000, 6000000, 10000000]).__next__
+        with mock.patch("time_execution.timed.perf_counter_ns", side_effect=clock):
+            _, metrics = timed(branch)
+        assert [(metric["value"], metric["self_time"]) for _, metric in metrics] == [
+            (2.0, 2.0),
+            (1.0, 1.0),
+            (10.0, 7.0),
+        ]
+
+    def test_failing_generator_hook(self):
+        def failing_hook(**kwargs):
+            raise RuntimeError("failed")
+            yield
+
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[failing_hook], spans=True):
+            with pytest.raises(RuntimeError):
+                leaf()
+            assert current_span() is None
+            # the next call is a root span again
+            with settings(hooks=[]):
+                leaf()
+        [metric] = collector.metrics[0].values()
+        assert "parent_id" not in metric
+
+    def test_block(self):
+        def run():
+            with span("block"):
+                leaf()
+
+        _, metrics = timed(run)
+        assert [name for name, _ in metrics] == [leaf.fqn, "block"]
+        assert metrics[0][1]["parent_id"] == metrics[1][1]["span_id"]
+
+    def test_block_inactive(self):
+        with settings(backends=[], hooks=[]):
+            with span("block") as timed_block:
+                assert timed_block is None
+
+    def test_block_sampled_out(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[], sampler=FixedRateSampler(0.5)):
+            with mock.patch("time_execution.sampling.random", return_value=0.9):
+                with span("block"):
+                    pass
+        assert collector.metrics == []
+
+    def test_block_hooks(self):
+        hook = mock.Mock(return_value={"key": "value"})
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[hook]):
+            with span("block"):
+                pass
+        assert hook.call_args.kwargs["func"] is None
+        assert collector.metrics[0]["block"]["key"] == "value"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_tasks(self):
+        collector = CollectorBackend()
+        with settings(backends=[collector], hooks=[], spans=True):
+            await gather()
+        *children, (name, parent) = [(name, metric) for item in collector.metrics for name, metric in item.items()]
+        assert name == gather.fqn
+        assert len(children) == 3
+        assert {child["parent_id"] for _, child in children} == {parent["span_id"]}
+        # the children ran concurrently, their time is only subtracted once
+        assert 0 <= parent["self_time"] < min(child["value"] for _, child in children)
+
+    def test_threads(self):
+        spans = {}
+
+        def run(key):
+            spans[key] = leaf()
+
+        @time_execution
+        def parent():
+            threads = [
+                threading.Thread(target=run, args=("plain",)),
+                threading.Thread(target=contextvars.copy_context().run, args=(run, "copied")),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return current_span()
+
+        parent_span, _ = timed(parent)
+        assert spans["plain"].parent is None
+        assert spans["copied"].parent is parent_span
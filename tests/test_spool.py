@@ -0,0 +1,126 @@
+import os
+from datetime import datetime
+
+import mock
+import pytest
+
+from time_execution.spool import RECORD_HEADER, SEGMENT_SUFFIX, DiskSpool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_bytes=4096, segment_size=1024)
+    yield spool
+    spool.close()
+
+
+def segment_files(directory):
+    return sorted(filename for filename in os.listdir(directory) if filename.endswith(SEGMENT_SUFFIX))
+
+
+class TestDiskSpool:
+    def test_replay_in_order(self, spool):
+        for i in range(60):
+            spool.append([{"name": "a", "value": i}])
+        assert spool.pending == 60
+        assert len(segment_files(spool.directory)) > 1
+
+        batches = []
+        assert spool.replay(batches.append)
+        assert batches == [[{"name": "a", "value": i}] for i in range(60)]
+        assert spool.pending == 0
+        assert segment_files(spool.directory) == []
+
+    def test_dates(self, spool):
+        spool.append([{"name": "a", "timestamp": datetime(2016, 7, 13, 1, 2, 3)}])
+        batches = []
+        spool.replay(batches.append)
+        assert batches == [[{"name": "a", "timestamp": "2016-07-13T01:02:03"}]]
+
+    def test_replay_stops_at_failure(self, spool):
+        for i in range(3):
+            spool.append([{"value": i}])
+        send = mock.Mock(side_effect=[None, RuntimeError("mocked error"), None, None])
+
+        assert not spool.replay(send)
+        assert spool.pending == 2
+        assert spool.replay(send)
+        sent = [call.args[0] for call in send.call_args_list]
+        assert sent == [[{"value": 0}], [{"value": 1}], [{"value": 1}], [{"value": 2}]]
+
+    def test_survives_restart(self, tmp_path):
+        spool = DiskSpool(str(tmp_path))
+        for i in range(3):
+            spool.append([{"value": i}])
+        spool.replay(mock.Mock(side_effect=[None, RuntimeError("mocked error")]))
+        spool.close()
+
+        spool = DiskSpool(str(tmp_path))
+        assert spool.pending == 2
+        spool.append([{"value": 3}])
+        batches = []
+        assert spool.replay(batches.append)
+        assert batches == [[{"value": i}] for i in range(1, 4)]
+        spool.close()
+
+    def test_torn_record_is_ignored(self, tmp_path):
+        spool = DiskSpool(str(tmp_path))
+        spool.append([{"value": 0}])
+        spool.append([{"value": 1}])
+        segment = spool._segments[0]
+        # Corrupt the payload of the second record, like a write cut short by a crash.
+        second = RECORD_HEADER.size + len(b'[{"value":0}]')
+        segment.mmap[second + RECORD_HEADER.size] = ord("x")
+        spool.close()
+
+        spool = DiskSpool(str(tmp_path))
+        batches = []
+        assert spool.replay(batches.append)
+        assert batches == [[{"value": 0}]]
+        spool.close()
+
+    def test_single_process(self, spool):
+        with pytest.raises(RuntimeError):
+            DiskSpool(spool.directory)
+
+    @mock.patch("time_execution.spool.logger")
+    def test_oldest_segments_are_discarded(self, mocked_logger, spool):
+        for i in range(200):
+            spool.append([{"name": "a", "value": i}])
+        assert spool.size <= spool.max_bytes
+        mocked_logger.warning.assert_called()
+
+        batches = []
+        spool.replay(batches.append)
+        assert batches[-1] == [{"name": "a", "value": 199}]
+        assert len(batches) < 200
+
+    def test_large_batch(self, spool):
+        metrics = [{"name": "a", "value": i} for i in range(100)]
+        spool.append(metrics)
+        batches = []
+        spool.replay(batches.append)
+        assert batches == [metrics]
+
+    @mock.patch("time_execution.spool.logger")
+    def test_batch_exceeding_the_spool(self, mocked_logger, spool):
+        spool.append([{"name": "a", "value": i} for i in range(1000)])
+        assert spool.pending == 0
+        mocked_logger.warning.assert_called_once()
+
+    @pytest.mark.skipif(not hasattr(os, "posix_fallocate"), reason="requires posix_fallocate")
+    def test_segments_are_allocated(self, spool):
+        spool.append([{"name": "a", "value": 1}])
+        (filename,) = segment_files(spool.directory)
+        assert os.stat(os.path.join(spool.directory, filename)).st_blocks * 512 >= 1024
+
+    @pytest.mark.skipif(not hasattr(os, "posix_fallocate"), reason="requires posix_fallocate")
+    def test_disk_full(self, spool):
+        with mock.patch("os.posix_fallocate", side_effect=OSError(28, "No space left on device")):
+            with pytest.raises(OSError):
+                spool.append([{"name": "a", "value": 1}])
+        assert segment_files(spool.directory) == []
+
+    def test_invalid_segment_size(self, tmp_path):
+        with pytest.raises(ValueError):
+            DiskSpool(str(tmp_path), max_bytes=1024, segment_size=2048)
@@ -0,0 +1,102 @@
+import time
+
+import mock
+import pytest
+
+from tests.conftest import MemoryBackend
+from time_execution import settings, time_execution
+from time_execution.backends.threaded import ThreadedBackend
+from time_execution.telemetry import Telemetry, telemetry
+
+
+@pytest.fixture
+def enabled():
+    telemetry.snapshot(reset=True)
+    telemetry.enable()
+    yield telemetry
+    telemetry.disable()
+    telemetry.snapshot(reset=True)
+
+
+def hook(**kwargs):
+    return {"hooked": True}
+
+
+@time_execution(extra_hooks=[hook])
+def go():
+    return True
+
+
+class TestTelemetry:
+    def test_record(self):
+        stats = Telemetry()
+        for value in (3, 1, 2):
+            stats.record("stat", value)
+        assert stats.snapshot() == {"stat": {"count": 3, "sum": 6, "min": 1, "max": 3}}
+        assert stats.snapshot(reset=True)["stat"]["count"] == 3
+        assert stats.snapshot() == {}
+
+    def test_gauge(self):
+        stats = Telemetry()
+        stats.gauge("size", lambda: 5)
+        stats.gauge("broken", mock.Mock(side_effect=NotImplementedError))
+        assert stats.snapshot() == {"size": {"value": 5}}
+
+    def test_disabled_by_default(self):
+        stats = Telemetry()
+        assert not stats.enabled
+        with settings(backends=[MemoryBackend()]):
+            go()
+        assert "decorator.write" not in telemetry.snapshot()
+
+    def test_decorator(self, enabled):
+        backend = MemoryBackend()
+        with settings(backends=[backend]):
+            go()
+            go()
+        snapshot = enabled.snapshot()
+        assert snapshot["decorator.hooks"]["count"] == 2
+        assert snapshot["decorator.write"]["count"] == 2
+        assert backend.metrics[0]["hooked"]
+
+    def test_emit(self, enabled):
+        backend = MemoryBackend()
+        enabled.record("decorator.write", 0.5)
+        with settings(backends=[backend]):
+            enabled.emit()
+        metrics = {metric["name"]: metric for metric in backend.metrics}
+        assert metrics["time_execution.decorator.write"]["count"] == 1
+        assert "hostname" in metrics["time_execution.decorator.write"]
+        assert "time_execution.threaded.queue_size" in metrics
+        # sending the telemetry isn't timed itself
+        assert "decorator.write" not in enabled.snapshot()
+
+    def test_emitter(self, enabled):
+        backend = MemoryBackend()
+        enabled.record("decorator.write", 0.5)
+        with settings(backends=[backend]):
+            enabled.start(interval=0.01)
+            time.sleep(0.1)
+            enabled.stop()
+        assert enabled.thread is None
+        names = [metric["name"] for metric in backend.metrics]
+        assert names.count("time_execution.decorator.write") == 1
+
+    def test_threaded_backend(self, enabled):
+        backend = ThreadedBackend(MemoryBackend, queue_timeout=0.01, bulk_timeout=0.01)
+        failing = ThreadedBackend(MemoryBackend, backend_kwargs={"fail": True}, queue_timeout=0.01, bulk_timeout=0.01)
+        # stop the workers, and send what they fetch when they stop
+        for threaded in (backend, failing):
+            thread = threaded.thread
+            threaded.worker_limit = 3
+            for i in range(3):
+                threaded.write("metric", value=i)
+            thread.join()
+
+        backend.worker_limit = 0
+        backend.write("queued")
+        snapshot = enabled.snapshot()
+        assert snapshot["threaded.batch_size"]["sum"] == 3
+        assert snapshot["threaded.bulk_write"]["count"] == 1
+        assert snapshot["threaded.failures"]["sum"] == 3
+        assert snapshot["threaded.queue_size"]["value"] >= 1
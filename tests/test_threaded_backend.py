@@ -1,5 +1,9 @@
+import multiprocessing
+import os
+import queue
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime
 from multiprocessing import Process
@@ -9,11 +13,17 @@ import mock
 import pytest
 from freezegun import freeze_time
 
-from tests.conftest import go
+from tests.conftest import MemoryBackend, go, wait_for
 from tests.test_base_backend import TestBaseBackend
 from time_execution import SHORT_HOSTNAME, settings
 from time_execution.backends import elasticsearch
-from time_execution.backends.threaded import ThreadedBackend
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend, _Wake
+from time_execution.batching import AdaptiveBatching
+from time_execution.columns import ColumnarBatch
+from time_execution.queues import RingBufferQueue
+from time_execution.records import MetricRecord
+from time_execution.spool import DiskSpool
 
 from .test_elasticsearch import ELASTICSEARCH_URI, ElasticTestMixin
 
@@ -80,6 +90,14 @@ class TestTimeExecution(TestBaseBackend):
             ]
         )
 
+    def test_timestamp_is_converted_by_the_worker(self):
+        self.stop_worker()
+        go()
+        record = self.backend._queue.get_nowait()
+        self.assertIsInstance(record, MetricRecord)
+        self.assertIsInstance(record.timestamp_ns, int)
+        self.assertNotIn("timestamp", record.to_dict())
+
     def test_double_start(self):
         self.assertEqual(0, self.backend.fetched_items)
         go()
@@ -142,6 +160,15 @@ class TestTimeExecution(TestBaseBackend):
         reason="multiprocessing.queues.Queue.qsize doesn't work on MacOS due to broken sem_getvalue()",
     )
     def test_producer_in_another_process(self):
+        # only the multiprocessing queue is shared with other processes
+        self.backend.worker_limit = 0
+        self.backend = ThreadedBackend(
+            self.MockedBackendClass,
+            queue_maxsize=self.qsize,
+            queue_timeout=self.qtimeout,
+            queue_class="multiprocessing.Queue",
+        )
+        settings.configure(backends=[self.backend])
         # assure worker is stopped
         self.stop_worker()
 
@@ -171,6 +198,322 @@ class TestTimeExecution(TestBaseBackend):
         mocked_bulk_write.assert_called_once()
         self.assertEqual(loops, len(mocked_bulk_write.call_args[0][0]))
 
+    def test_default_queue(self):
+        self.assertIsInstance(self.backend._queue, RingBufferQueue)
+        self.assertEqual(self.backend._queue.maxsize, self.qsize)
+
+    def test_queue_class(self):
+        backend = ThreadedBackend(self.MockedBackendClass, queue_class=queue.Queue, queue_maxsize=3, worker_limit=0)
+        self.assertIsInstance(backend._queue, queue.Queue)
+        self.assertEqual(backend._queue.maxsize, 3)
+
+
+class FileBackend(BaseMetricsBackend):
+    """Appends the names of the metrics to a file per process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def bulk_write(self, metrics):
+        with open(os.path.join(self.directory, "%d.txt" % os.getpid()), "a") as f:
+            f.write("".join("%s\n" % metric["name"] for metric in metrics))
+
+
+def read_names(directory, pid):
+    path = os.path.join(directory, "%d.txt" % pid)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork()")
+class TestFork:
+    def wait_for_names(self, directory, pid, count, timeout=10):
+        deadline = time.time() + timeout
+        while len(read_names(directory, pid)) < count and time.time() < deadline:
+            time.sleep(0.05)
+        return read_names(directory, pid)
+
+    def fork(self, target):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover, the child process
+            status = 1
+            try:
+                target()
+                status = 0
+            finally:
+                os._exit(status)
+        return pid
+
+    def test_child_gets_own_queue_and_worker(self, tmp_path):
+        directory = str(tmp_path)
+        backend = ThreadedBackend(
+            FileBackend, backend_args=(directory,), queue_maxsize=100000, queue_timeout=0.05, bulk_timeout=0.05
+        )
+        child_count = 500
+
+        def child():
+            assert backend.thread is None
+            assert backend._queue.empty()
+            assert backend.parent_thread is threading.current_thread()
+            backend.worker_limit = child_count
+            for i in range(child_count):
+                backend.write("child-%d" % i)
+            thread = backend.thread
+            thread.join()
+
+        # fork whilst other threads keep producing metrics in the parent
+        stop = threading.Event()
+        produced = []
+
+        def produce(producer):
+            i = 0
+            while not stop.is_set():
+                backend.write("parent-%d-%d" % (producer, i))
+                produced.append(1)
+                i += 1
+                time.sleep(0.0001)
+
+        producers = [Thread(target=produce, args=(producer,)) for producer in range(2)]
+        for producer in producers:
+            producer.start()
+        time.sleep(0.05)
+        children = [self.fork(child) for _ in range(3)]
+        time.sleep(0.05)
+        stop.set()
+        for producer in producers:
+            producer.join()
+        for pid in children:
+            _, status = os.waitpid(pid, 0)
+            assert status == 0
+
+        for pid in children:
+            names = self.wait_for_names(directory, pid, child_count)
+            assert names == ["child-%d" % i for i in range(child_count)]
+
+        names = self.wait_for_names(directory, os.getpid(), len(produced))
+        assert len(names) == len(produced) == len(set(names))
+        assert all(name.startswith("parent-") for name in names)
+        backend.worker_limit = 0
+
+    def test_child_shares_multiprocessing_queue(self, tmp_path):
+        directory = str(tmp_path)
+        backend = ThreadedBackend(
+            FileBackend,
+            backend_args=(directory,),
+            queue_timeout=0.05,
+            bulk_timeout=0.05,
+            queue_class="multiprocessing.Queue",
+        )
+
+        def child():
+            for i in range(10):
+                backend.write("child-%d" % i)
+            assert backend.thread is None
+            backend._queue.close()
+            backend._queue.join_thread()
+
+        pid = self.fork(child)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+
+        names = self.wait_for_names(directory, os.getpid(), 10)
+        assert names == ["child-%d" % i for i in range(10)]
+        assert read_names(directory, pid) == []
+        backend.worker_limit = 0
+
+
+class FlakyBackend(BaseMetricsBackend):
+    def __init__(self):
+        self.down = True
+        self.names = []
+
+    def bulk_write(self, metrics):
+        if self.down:
+            raise ConnectionError("mocked error")
+        self.names.extend(metric["name"] for metric in metrics)
+
+
+class TestSpool:
+    def test_failed_batches_are_replayed(self, tmp_path):
+        backend = ThreadedBackend(
+            FlakyBackend, queue_timeout=0.01, bulk_size=2, bulk_timeout=0.01, spool=str(tmp_path / "spool")
+        )
+        for i in range(5):
+            backend.write("down-%d" % i)
+        wait_for(lambda: backend.fetched_items == 5 and backend._queue.empty())
+        wait_for(lambda: backend.spool.pending >= 3)
+        assert backend.backend.names == []
+
+        backend.backend.down = False
+        backend.write("up")
+        wait_for(lambda: len(backend.backend.names) == 6)
+        assert backend.backend.names == ["up"] + ["down-%d" % i for i in range(5)]
+        assert backend.spool.pending == 0
+        backend.worker_limit = 0
+
+    def test_replay_without_new_metrics(self, tmp_path):
+        backend = ThreadedBackend(
+            FlakyBackend,
+            queue_timeout=0.01,
+            bulk_timeout=0.01,
+            spool=str(tmp_path / "spool"),
+            spool_retry_interval=0.05,
+        )
+        backend.write("down")
+        wait_for(lambda: backend.spool.pending == 1)
+        backend.backend.down = False
+        wait_for(lambda: backend.backend.names == ["down"])
+        backend.worker_limit = 0
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_spool_failure(self, mocked_logger, tmp_path):
+        backend = ThreadedBackend(
+            FlakyBackend, queue_timeout=0.01, bulk_timeout=0.01, spool=str(tmp_path / "spool"), spool_retry_interval=60
+        )
+        with mock.patch.object(backend.spool, "append", side_effect=OSError("No space left on device")):
+            backend.write("down")
+            wait_for(lambda: mocked_logger.warning.call_count == 2)
+        # the batch is lost, but the worker carries on
+        assert backend.thread.is_alive()
+        backend.backend.down = False
+        backend.write("up")
+        wait_for(lambda: backend.backend.names == ["up"])
+        backend.worker_limit = 0
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_left_to_parent(self, mocked_logger, tmp_path):
+        backend = ThreadedBackend(FlakyBackend, queue_timeout=0.01, spool=str(tmp_path / "spool"))
+        spool = backend.spool
+        backend.worker_limit = 0
+        backend.thread.join()
+        # as in a forked child
+        backend.after_fork_in_child()
+        assert backend.spool is None
+        mocked_logger.warning.assert_called_once()
+        assert str(tmp_path / "spool") in mocked_logger.warning.call_args[0]
+        spool.close()
+
+    def test_imported_on_demand(self):
+        code = "import sys, time_execution.backends.threaded; print('time_execution.spool' in sys.modules)"
+        assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"False"
+
+
+class TestOverflow:
+    def create_backend(self, **kwargs):
+        backend = ThreadedBackend(MemoryBackend, queue_maxsize=10, queue_timeout=0.01, bulk_timeout=0.01, **kwargs)
+        # stop the worker, so the queue fills up
+        backend.worker_limit = 0
+        backend.thread.join()
+        return backend
+
+    def queued_values(self, backend):
+        values = []
+        while not backend._queue.empty():
+            values.append(backend._queue.get_nowait()[1]["value"])
+        return values
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_drop_newest(self, mocked_logger):
+        backend = self.create_backend()
+        for i in range(15):
+            backend.write("metric", value=i)
+        mocked_logger.warning.assert_not_called()
+        assert backend.dropped.value == 5
+        assert self.queued_values(backend) == list(range(10))
+
+    def test_drop_oldest(self):
+        backend = self.create_backend(overflow="drop_oldest")
+        for i in range(15):
+            backend.write("metric", value=i)
+        assert backend.dropped.value == 5
+        assert self.queued_values(backend) == list(range(5, 15))
+
+    def test_drop_oldest_keeps_wake(self):
+        backend = self.create_backend(overflow="drop_oldest")
+        backend._queue.put_nowait(_Wake())
+        for i in range(10):
+            backend.write("metric", value=i)
+        assert backend.dropped.value == 1
+        queued = [backend._queue.get_nowait() for _ in range(10)]
+        assert [item[1]["value"] for item in queued[:-1]] == list(range(1, 10))
+        assert isinstance(queued[-1], _Wake)
+
+    def test_block(self):
+        backend = self.create_backend(overflow="block", block_timeout=5)
+        for i in range(10):
+            backend.write("metric", value=i)
+        timer = threading.Timer(0.05, backend._queue.get_nowait)
+        timer.start()
+        backend.write("metric", value=10)
+        timer.join()
+        assert backend.dropped.value == 0
+        assert self.queued_values(backend) == list(range(1, 11))
+
+    def test_block_deadline(self):
+        backend = self.create_backend(overflow="block", block_timeout=0.05)
+        for i in range(11):
+            backend.write("metric", value=i)
+        assert backend.dropped.value == 1
+
+    @mock.patch("time_execution.backends.threaded.random.random", return_value=0.5)
+    def test_sample(self, mocked_random):
+        backend = self.create_backend(overflow="sample")
+        for i in range(10):
+            backend.write("metric", value=i)
+        # the first half of the queue is always kept, beyond it ever fewer metrics are kept with a higher weight
+        queued = []
+        while not backend._queue.empty():
+            queued.append(backend._queue.get_nowait()[1])
+        assert [metric["value"] for metric in queued] == [0, 1, 2, 3, 4, 5, 6, 7]
+        assert "sample_weight" not in queued[5]
+        assert queued[6]["sample_weight"] == pytest.approx(5 / 4)
+        assert queued[7]["sample_weight"] == pytest.approx(5 / 3)
+        assert backend.dropped.value == 2
+
+    @mock.patch("time_execution.backends.threaded.random.random", return_value=0.5)
+    def test_sample_records(self, mocked_random):
+        backend = self.create_backend(overflow="sample")
+        for i in range(10):
+            backend.write_record(MetricRecord("metric", float(i), "value", "host", 0))
+        queued = []
+        while not backend._queue.empty():
+            queued.append(backend._queue.get_nowait())
+        # records are queued as is until the queue is half full, then sampled like the other metrics
+        assert all(isinstance(record, MetricRecord) for record in queued[:6])
+        assert queued[7][1]["sample_weight"] == pytest.approx(5 / 3)
+        assert backend.dropped.value == 2
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            ThreadedBackend(MemoryBackend, overflow="unknown")
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_report_drops(self, mocked_logger):
+        backend = self.create_backend()
+        assert backend.report_drops() is None
+        for i in range(15):
+            backend.write("metric", value=i)
+
+        report = backend.report_drops()
+        assert report["name"] == "time_execution.dropped_metrics"
+        assert report["count"] == 5
+        assert report["overflow"] == "drop_newest"
+        assert report["hostname"] == SHORT_HOSTNAME
+        mocked_logger.warning.assert_called_once()
+        assert backend.report_drops() is None
+
+    def test_worker_sends_drop_report(self):
+        backend = self.create_backend(drop_report_interval=0)
+        for i in range(15):
+            backend.write("metric", value=i)
+        backend.worker_limit = 10
+        backend.worker()
+        names = [metric["name"] for metric in backend.backend.metrics]
+        assert names.count("metric") == 10
+        assert names.count("time_execution.dropped_metrics") == 1
+
 
 class TestThreaded(object):
     def test_calling_thread_waits_for_worker(self):
@@ -226,3 +569,307 @@ class TestSetupBackend:
         )
 
         assert isinstance(backend.backend, elasticsearch.ElasticsearchBackend)
+
+
+class ColumnarBackend(BaseMetricsBackend):
+    accepts_columns = True
+
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, metrics):
+        raise AssertionError("a columnar batch is expected")
+
+    def bulk_write_columns(self, batch):
+        self.batches.append(batch)
+
+
+class TestColumns:
+    def test_columnar_batches(self):
+        backend = ThreadedBackend(ColumnarBackend, queue_timeout=0.01, bulk_timeout=0.01)
+        with settings(backends=[backend], hooks=[]):
+            go()
+        backend.write("written", value=1.0)
+        deadline = time.time() + 5
+        while sum(map(len, backend.backend.batches)) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        backend.worker_limit = 0
+
+        metrics = [metric for batch in backend.backend.batches for metric in batch.to_dicts()]
+        assert all(isinstance(batch, ColumnarBatch) for batch in backend.backend.batches)
+        assert [metric["name"] for metric in metrics] == ["tests.conftest.go", "written"]
+        assert all(isinstance(metric["timestamp"], datetime) for metric in metrics)
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_columns_failure(self, mocked_logger):
+        backend = ThreadedBackend(MemoryBackend, queue_timeout=0.01, bulk_timeout=0.01)
+        backend.backend.accepts_columns = True
+        with mock.patch.object(ColumnarBatch, "from_metrics", side_effect=OverflowError("mocked error")):
+            backend.write("written", value=1.0)
+            deadline = time.time() + 5
+            while not backend.backend.metrics and time.time() < deadline:
+                time.sleep(0.01)
+        # sent as dicts instead, the worker carries on
+        assert [metric["name"] for metric in backend.backend.metrics] == ["written"]
+        mocked_logger.warning.assert_called_once()
+        assert backend.thread.is_alive()
+        backend.worker_limit = 0
+
+
+class SlowBackend(BaseMetricsBackend):
+    def __init__(self):
+        self.metrics = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def bulk_write(self, metrics):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+            self.metrics.extend(metrics)
+
+
+class TestWorkers:
+    def create_backend(self, **kwargs):
+        return ThreadedBackend(
+            SlowBackend, queue_maxsize=1000, queue_timeout=0.01, bulk_size=5, bulk_timeout=0.01, **kwargs
+        )
+
+    def wait_for_metrics(self, backend, count):
+        deadline = time.time() + 5
+        while len(backend.backend.metrics) < count and time.time() < deadline:
+            time.sleep(0.01)
+        backend.worker_limit = 0
+        assert len(backend.backend.metrics) == count
+
+    def test_order_per_name(self):
+        backend = self.create_backend(workers=4)
+        for i in range(50):
+            for name in "abcdefgh":
+                backend.write(name, value=i)
+        self.wait_for_metrics(backend, 400)
+
+        values = {}
+        for metric in backend.backend.metrics:
+            values.setdefault(metric["name"], []).append(metric["value"])
+        assert values == {name: list(range(50)) for name in "abcdefgh"}
+
+    def test_concurrency_is_capped(self):
+        backend = self.create_backend(workers=3)
+        for i in range(200):
+            backend.write("metric-%d" % (i % 20), value=i)
+        self.wait_for_metrics(backend, 200)
+        assert 1 < backend.backend.max_in_flight <= 3
+
+    def test_threads(self):
+        backend = self.create_backend(workers=3)
+        threads = list(backend.threads)
+        assert backend.thread is threads[0]
+        assert [thread.name for thread in threads] == [
+            "TimeExecutionThread",
+            "TimeExecutionThread-1",
+            "TimeExecutionThread-2",
+        ]
+        backend.worker_limit = 0
+        for thread in threads:
+            thread.join()
+        assert backend.threads == [None, None, None]
+
+    def create_stopped_backend(self, **kwargs):
+        backend = ThreadedBackend(MemoryBackend, queue_maxsize=10, queue_timeout=0.01, workers=4, **kwargs)
+        threads = list(backend.threads)
+        backend.worker_limit = 0
+        for thread in threads:
+            thread.join()
+        return backend
+
+    def test_hot_name_gets_all_the_room(self):
+        backend = self.create_stopped_backend()
+        for i in range(15):
+            backend.write("metric", value=i)
+        assert backend.dropped.value == 5
+        assert backend._queue_for("metric").qsize() == 10
+
+    def test_queues_share_maxsize(self):
+        backend = self.create_stopped_backend()
+        for i in range(15):
+            backend.write("metric-%d" % i, value=i)
+        assert backend.dropped.value == 5
+        assert sum(queue.qsize() for queue in backend._queues) == 10
+
+    def test_drop_oldest_of_fullest_queue(self):
+        backend = self.create_stopped_backend(overflow="drop_oldest")
+        for i in range(10):
+            backend.write("metric", value=i)
+        other = next(name for name in "abcdefgh" if backend._queue_for(name) is not backend._queue_for("metric"))
+        backend.write(other, value=10)
+        assert backend.dropped.value == 1
+        assert backend._queue_for("metric").qsize() == 9
+        assert backend._queue_for(other).get_nowait()[1]["value"] == 10
+
+    def test_multiprocessing_queues_split_maxsize(self):
+        backend = ThreadedBackend(MemoryBackend, queue_class=multiprocessing.Queue, queue_maxsize=10, workers=4)
+        backend.worker_limit = 0
+        assert [queue._maxsize for queue in backend._queues] == [3, 3, 3, 3]
+
+    def test_invalid_workers(self):
+        with pytest.raises(ValueError):
+            ThreadedBackend(MemoryBackend, workers=0)
+
+
+EXIT_SCRIPT = """
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend
+from time_execution.batching import AdaptiveBatching
+
+
+class PrintBackend(BaseMetricsBackend):
+    def bulk_write(self, metrics):
+        print(",".join(metric["name"] for metric in metrics))
+
+
+backend = ThreadedBackend(PrintBackend, bulk_timeout=60, exit_timeout=%s)
+backend.write("a")
+backend.write("b")
+"""
+
+
+class TestFlushAndClose:
+    def create_backend(self, **kwargs):
+        kwargs.setdefault("bulk_timeout", 60)
+        return ThreadedBackend(MemoryBackend, bulk_size=100, **kwargs)
+
+    def test_idle_worker_sleeps(self):
+        get = mock.patch.object(RingBufferQueue, "get", autospec=True, side_effect=RingBufferQueue.get)
+        wait = mock.patch.object(RingBufferQueue, "wait", autospec=True, side_effect=RingBufferQueue.wait)
+        with get as mocked_get, wait as mocked_wait:
+            backend = self.create_backend()
+            time.sleep(0.1)
+            backend.write("wake up")
+            time.sleep(0.1)
+            # woken up by the metric, then waiting for the batch to fill up
+            calls = [mocked_get, mocked_wait]
+            assert [sum(call.args[0] is backend._queue for call in mocked.call_args_list) for mocked in calls] == [1, 1]
+            assert backend.backend.metrics == []
+            backend.close()
+        assert len(backend.backend.metrics) == 1
+
+    def test_batch_full(self):
+        backend = self.create_backend()
+        for i in range(100):
+            backend.write("metric-%d" % i)
+        deadline = time.time() + 5
+        while not backend.backend.metrics and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(backend.backend.metrics) == 100
+        backend.close()
+
+    def test_flush(self):
+        backend = self.create_backend(workers=2)
+        for i in range(10):
+            backend.write("metric-%d" % i)
+        assert backend.flush(timeout=5)
+        assert len(backend.backend.metrics) == 10
+        assert backend.flush(timeout=5)
+        assert all(backend.threads)
+        backend.close()
+
+    def test_flush_stopped(self):
+        backend = self.create_backend()
+        assert backend.close(timeout=5)
+        assert backend.flush(timeout=5)
+        backend.write("metric")
+        assert not backend.flush(timeout=5)
+
+    def test_flush_timeout(self):
+        backend = self.create_backend()
+        backend.backend.bulk_write = lambda metrics: time.sleep(0.5)
+        backend.write("slow")
+        assert not backend.flush(timeout=0.05)
+        backend.close()
+
+    def test_flush_drop_oldest(self):
+        backend = self.create_backend(queue_maxsize=5, overflow="drop_oldest")
+        sending = threading.Event()
+        bulk_write = backend.backend.bulk_write
+        backend.backend.bulk_write = lambda metrics: sending.wait(5) and bulk_write(metrics)
+        backend.write("first")
+        assert not backend.flush(timeout=0.05)
+        for i in range(4):
+            backend.write("metric-%d" % i)
+        flushed = []
+        flush = threading.Thread(target=lambda: flushed.append(backend.flush(timeout=5)))
+        flush.start()
+        deadline = time.time() + 5
+        while not backend._queue.full() and time.time() < deadline:
+            time.sleep(0.01)
+        # while the worker is busy, the oldest metrics are dropped, but not the wake-up of flush
+        for i in range(4, 20):
+            backend.write("metric-%d" % i)
+        sending.set()
+        flush.join()
+        assert flushed == [True]
+        assert [metric["name"] for metric in backend.backend.metrics] == ["first"] + [
+            "metric-%d" % i for i in range(16, 20)
+        ]
+        assert backend.close(timeout=5)
+
+    def test_close(self, tmp_path):
+        backend = self.create_backend(workers=2, spool=str(tmp_path / "spool"))
+        spool = backend.spool
+        for i in range(10):
+            backend.write("metric-%d" % i)
+        assert backend.close(timeout=5)
+        assert len(backend.backend.metrics) == 10
+        assert backend.threads == [None, None]
+        assert backend.backend.closed
+        assert backend.spool is None
+        # the lock of the spool is released
+        DiskSpool(spool.directory).close()
+
+    @mock.patch("time_execution.backends.threaded.logger")
+    def test_close_timeout(self, mocked_logger):
+        backend = self.create_backend()
+        backend.backend.bulk_write = lambda metrics: time.sleep(0.5)
+        backend.write("slow")
+        assert not backend.close(timeout=0.05)
+        mocked_logger.warning.assert_called_once()
+        assert not backend.backend.closed
+
+    def test_sent_at_exit(self):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, "-c", EXIT_SCRIPT % 5], cwd=os.getcwd())
+        assert output.decode().split() == ["a,b"]
+        assert time.time() - start < 5
+
+    def test_not_sent_at_exit(self):
+        output = subprocess.check_output([sys.executable, "-c", EXIT_SCRIPT % None], cwd=os.getcwd())
+        assert output == b""
+
+
+class TestAdaptiveBatching:
+    def test_bounds(self):
+        batching = AdaptiveBatching(target_delay=0.5, max_bulk_size=100)
+        backend = ThreadedBackend(MemoryBackend, bulk_size=5000, bulk_timeout=1, workers=2, batching=batching)
+        backend.worker_limit = 0
+        assert (backend.bulk_size, backend.bulk_timeout) == (100, 0.5)
+        assert batching.senders == 2
+
+    def test_settings_are_tuned(self):
+        batching = AdaptiveBatching(target_delay=0.5, window=0.01)
+        backend = ThreadedBackend(MemoryBackend, bulk_size=5, bulk_timeout=60, batching=batching)
+        for i in range(10):
+            backend.write("metric-%d" % i)
+            time.sleep(0.005)
+        assert backend.flush(timeout=5)
+        snapshot = batching.snapshot()
+        assert snapshot["latency"] is not None
+        assert snapshot["arrival_rate"] > 0
+        assert (backend.bulk_size, backend.bulk_timeout) == (snapshot["bulk_size"], snapshot["bulk_timeout"])
+        assert backend.bulk_timeout < 0.5
+        backend.close()
+        assert len(backend.backend.metrics) == 10
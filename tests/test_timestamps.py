@@ -0,0 +1,55 @@
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+
+from time_execution.timestamps import convert_timestamps, json_default, to_datetime
+
+
+class TestTimestamps:
+    def test_to_datetime(self):
+        assert to_datetime(1468371723000004000) == datetime(2016, 7, 13, 1, 2, 3, 4)
+        # to the nearest microsecond
+        assert to_datetime(1468371723000004999) == datetime(2016, 7, 13, 1, 2, 3, 5)
+
+    def test_like_utcnow(self):
+        before = datetime.utcnow()
+        timestamp = to_datetime(time.time_ns())
+        assert before <= timestamp <= datetime.utcnow()
+
+    def test_convert_timestamps(self):
+        own_timestamp = datetime(2020, 1, 1)
+        metrics = [
+            {"name": "a", "timestamp_ns": 1468371723000004000},
+            {"name": "b", "timestamp_ns": 1468371723999999000},
+            {"name": "c", "timestamp_ns": 1468371724000000000},
+            {"name": "d", "timestamp_ns": 1468371724000000000, "timestamp": own_timestamp},
+            {"name": "e"},
+        ]
+        convert_timestamps(metrics)
+        assert metrics == [
+            {"name": "a", "timestamp": datetime(2016, 7, 13, 1, 2, 3, 4)},
+            {"name": "b", "timestamp": datetime(2016, 7, 13, 1, 2, 3, 999999)},
+            {"name": "c", "timestamp": datetime(2016, 7, 13, 1, 2, 4)},
+            {"name": "d", "timestamp": own_timestamp},
+            {"name": "e"},
+        ]
+
+    def test_json_default(self):
+        metric = {
+            "timestamp": datetime(2016, 7, 13, 1, 2, 3, 4),
+            "day": date(2016, 7, 13),
+            "request_id": UUID("12345678-1234-5678-1234-567812345678"),
+            "amount": Decimal("1.5"),
+        }
+        assert json.loads(json.dumps(metric, default=json_default)) == {
+            "timestamp": "2016-07-13T01:02:03.000004",
+            "day": "2016-07-13",
+            "request_id": "12345678-1234-5678-1234-567812345678",
+            "amount": 1.5,
+        }
+        with pytest.raises(TypeError):
+            json.dumps({"tags": {"a"}}, default=json_default)
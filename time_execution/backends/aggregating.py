@@ -0,0 +1,169 @@
+import datetime
+import logging
+import threading
+
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import import_from_string
+from time_execution.sketch import DDSketch
+
+logger = logging.getLogger(__name__)
+
+
+class AggregatingBackend(BaseMetricsBackend):
+    """
+    Aggregates the metrics in-process instead of sending a document per call.
+
+    For every series (`name`, `hostname`, `origin`) the durations are counted in a quantile sketch, a sampled
+    metric as many times as its `sample_weight`, so the count, sum and percentiles stand for all the calls.
+    Every `flush_interval` seconds, one document per series is sent to the wrapped backend in a single
+    `bulk_write`, containing the count, sum, min, max, the chosen percentiles and, optionally, the serialized
+    sketch which can be merged exactly with the sketches of other processes (see `DDSketch.from_dict`).
+
+    Args:
+        backend: the backend (class or import path) to send the aggregates to
+        backend_args: positional arguments for the backend
+        backend_kwargs: keyword arguments for the backend
+        flush_interval: seconds between flushes; if `None`, flush only when `flush()` is called
+        duration_field: the field of a metric which holds the duration
+        percentiles: percentiles to include in every document, stored as `p<percentile>` fields
+        include_sketch: include the serialized sketch as the `sketch` field
+        relative_accuracy: relative accuracy of the sketches
+        max_bins: maximum number of bins of a sketch, which bounds the memory per series
+    """
+
+    accepts_records = True
+    accepts_columns = True
+
+    def __init__(
+        self,
+        backend,
+        backend_args=None,
+        backend_kwargs=None,
+        flush_interval=10,
+        duration_field="value",
+        percentiles=(50, 90, 99),
+        include_sketch=True,
+        relative_accuracy=0.01,
+        max_bins=2048,
+    ):
+        if backend_args is None:
+            backend_args = tuple()
+        if backend_kwargs is None:
+            backend_kwargs = dict()
+        if isinstance(backend, str):
+            backend = import_from_string(backend)
+
+        self.backend = backend(*backend_args, **backend_kwargs)
+        self.flush_interval = flush_interval
+        self.duration_field = duration_field
+        self.percentiles = tuple(percentiles)
+        self.include_sketch = include_sketch
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+
+        self.parent_thread = threading.current_thread()
+        self._series = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+        if flush_interval is not None:
+            self.start_flusher()
+
+    def write(self, name, **data):
+        self._add(name, data)
+
+    def write_record(self, record):
+        # The fields are read from the record, it's never turned into a dict.
+        self._add(record.name, record)
+
+    def bulk_write(self, metrics):
+        for metric in metrics:
+            self._add(metric.get("name"), metric)
+
+    def bulk_write_columns(self, batch):
+        if batch.duration_field != self.duration_field:
+            self.bulk_write(batch.to_dicts())
+            return
+        # One lookup of the sketch per series of the batch, rather than per metric.
+        for key, (durations, weights) in batch.series().items():
+            with self._lock:
+                sketch = self._sketch(key)
+                for duration, weight in zip(durations, weights):
+                    sketch.add(duration, weight)
+
+    def _add(self, name, data):
+        duration = data.get(self.duration_field)
+        if duration is None:
+            return
+        key = (name, data.get("hostname"), data.get("origin"))
+        with self._lock:
+            self._sketch(key).add(duration, data.get("sample_weight") or 1)
+
+    def _sketch(self, key):
+        sketch = self._series.get(key)
+        if sketch is None:
+            sketch = self._series[key] = DDSketch(self.relative_accuracy, self.max_bins)
+        return sketch
+
+    def flush(self):
+        """
+        Send the aggregates of all the series to the wrapped backend and start over.
+        """
+        with self._lock:
+            series, self._series = self._series, {}
+        if not series:
+            return
+
+        timestamp = datetime.datetime.utcnow()
+        documents = [self.to_document(key, sketch, timestamp) for key, sketch in series.items()]
+        try:
+            self.backend.bulk_write(documents)
+        except Exception as exc:
+            logger.warning("%r write failure %r", self.backend, exc)
+
+    def to_document(self, key, sketch, timestamp):
+        name, hostname, origin = key
+        document = {
+            "name": name,
+            "timestamp": timestamp,
+            "count": sketch.count,
+            "sum": sketch.sum,
+            "min": sketch.min,
+            "max": sketch.max,
+        }
+        if hostname is not None:
+            document["hostname"] = hostname
+        if origin is not None:
+            document["origin"] = origin
+        for percentile in self.percentiles:
+            document["p%s" % percentile] = sketch.quantile(percentile / 100.0)
+        if self.include_sketch:
+            document["sketch"] = sketch.to_dict()
+        return document
+
+    def start_flusher(self):
+        if self.thread:
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self.flusher, name="TimeExecutionAggregatingThread")
+        self.thread.daemon = False
+        self.thread.start()
+
+    def stop_flusher(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join()
+
+    def flusher(self):
+        # Wake up frequently enough to notice the parent thread finishing, and flush what's left then.
+        poll_interval = min(self.flush_interval, 1)
+        waited = 0
+        while not self._stop.wait(poll_interval):
+            waited += poll_interval
+            if waited >= self.flush_interval:
+                self.flush()
+                waited = 0
+            if not self.parent_thread.is_alive():
+                break
+        self.flush()
+        self.thread = None
@@ -0,0 +1,201 @@
+import asyncio
+import inspect
+import logging
+import time
+
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import import_from_string
+from time_execution.counters import AtomicCounter
+from time_execution.records import MetricRecord
+from time_execution.timestamps import TIMESTAMP_NS, convert_timestamps
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AsyncBatchingBackend(BaseMetricsBackend):
+    """
+    Batches the metrics of an asyncio application and sends them from a background task.
+
+    `write` only puts the metric in an `asyncio.Queue`, so it never blocks the event loop. The background task
+    is started on the event loop of the first `write`, and sends a batch whenever `bulk_size` metrics are
+    queued or the oldest one has waited `bulk_timeout` seconds. Call `aclose()` before the loop stops
+    to send the remaining metrics. The decorator's `MetricRecord` is queued as is, and turned into a dict
+    by the background task.
+
+    Args:
+        backend: the backend (class or import path) to send the metrics to. Its `bulk_write` may be
+            a coroutine function, e.g. of the `AsyncElasticsearchBackend`.
+        backend_args: positional arguments for the backend
+        backend_kwargs: keyword arguments for the backend
+        queue_maxsize: maximum number of metrics in the queue, further metrics are discarded
+        bulk_size: number of metrics sent at once
+        bulk_timeout: maximum number of seconds a metric waits to be sent
+        drop_report_interval: minimum number of seconds between the logs of the number of discarded metrics
+    """
+
+    accepts_records = True
+
+    def __init__(
+        self,
+        backend,
+        backend_args=None,
+        backend_kwargs=None,
+        queue_maxsize=10000,
+        bulk_size=500,
+        bulk_timeout=1,
+        drop_report_interval=60,
+    ):
+        if backend_args is None:
+            backend_args = tuple()
+        if backend_kwargs is None:
+            backend_kwargs = dict()
+        if isinstance(backend, str):
+            backend = import_from_string(backend)
+
+        self.backend = backend(*backend_args, **backend_kwargs)
+        self.queue_maxsize = queue_maxsize
+        self.bulk_size = bulk_size
+        self.bulk_timeout = bulk_timeout
+        self.drop_report_interval = drop_report_interval
+        self.dropped = AtomicCounter()
+        self._reported_drops = 0
+        self._drop_reason = None
+        self._report_at = 0.0
+
+        self._loop = None
+        self._queue = None
+        self._batch_full = None
+        self._task = None
+        self._closing = False
+
+    def write(self, name, **data):
+        if "timestamp" not in data and TIMESTAMP_NS not in data:
+            data[TIMESTAMP_NS] = time.time_ns()
+        data["name"] = name
+        self._submit(data)
+
+    def write_record(self, record):
+        self._submit(record)
+
+    def _submit(self, item):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if self._closing:
+            self._discard("the backend is closed")
+        elif loop is not None and loop is self._loop:
+            self._put(item)
+        elif loop is not None and (self._loop is None or self._loop.is_closed()):
+            self._start(loop)
+            self._put(item)
+        elif self._loop is not None and self._loop.is_running():
+            # Written from another thread than the one of the event loop.
+            self._loop.call_soon_threadsafe(self._put, item)
+        else:
+            self._discard("there's no running event loop")
+
+    def _start(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        self._batch_full = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _put(self, item):
+        queue = self._queue
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._discard("the queue is full")
+            return
+        # One metric is held by the background task whilst it waits for the batch to fill up.
+        if queue.qsize() + 1 >= self.bulk_size:
+            self._batch_full.set()
+
+    def _discard(self, reason):
+        self.dropped.increment()
+        self._drop_reason = reason
+        if time.monotonic() >= self._report_at:
+            self.report_drops()
+
+    def report_drops(self):
+        """
+        Log the number of metrics discarded since the previous report, and return it.
+
+        A metric discarded after a quiet period is reported right away, the next ones at most every
+        `drop_report_interval` seconds.
+        """
+        dropped = self.dropped.value
+        count = dropped - self._reported_drops
+        self._reported_drops = dropped
+        if count:
+            self._report_at = time.monotonic() + self.drop_report_interval
+            logger.warning("Discarded %d metrics, %s", count, self._drop_reason)
+        return count
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            first = await queue.get()  # idle until there's a metric
+            if first is _STOP:
+                return
+            batch = [first]
+            if queue.qsize() + 1 < self.bulk_size and not self._closing:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.bulk_timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            stop = False
+            while len(batch) < self.bulk_size:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._send(batch)
+            if time.monotonic() >= self._report_at:
+                self.report_drops()
+            if stop:
+                return
+
+    async def _send(self, batch):
+        batch = [item.to_dict() if isinstance(item, MetricRecord) else item for item in batch]
+        convert_timestamps(batch)
+        try:
+            result = self.backend.bulk_write(batch)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as exc:
+            logger.warning("%r write failure %r", self.backend, exc)
+
+    async def aclose(self, timeout=None):
+        """
+        Send the queued metrics and stop the background task. Further metrics are discarded.
+
+        Args:
+            timeout: maximum number of seconds to wait for the metrics to be sent
+        """
+        self._closing = True
+        task = self._task
+        if task is not None and not task.done():
+            await self._queue.put(_STOP)
+            self._batch_full.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("discarding %d metrics, sending them took too long", self._queue.qsize())
+                task.cancel()
+        self.report_drops()
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
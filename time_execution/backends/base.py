@@ -2,10 +2,28 @@
 Base metrics backend
 """
 
+from time_execution.timestamps import convert_timestamps
+
 
 class BaseMetricsBackend:
+    # Whether the decorator may pass a `MetricRecord` to `write_record` instead of calling `write` with a dict.
+    accepts_records = False
+    # Whether the `ThreadedBackend` may pass a `ColumnarBatch` to `bulk_write_columns` instead of a list of dicts.
+    accepts_columns = False
+    # Whether the records passed to `write_record` may still have deferred hooks, which the backend runs before
+    # sending them (see `time_execution.deferred`). Only when it's the only backend.
+    accepts_deferred = False
+
     def write(self, name, **data):
         raise NotImplementedError
 
+    def write_record(self, record):
+        metric = record.to_dict()
+        convert_timestamps((metric,))
+        self.write(**metric)
+
     def bulk_write(self, metrics):
         raise NotImplementedError
+
+    def bulk_write_columns(self, batch):
+        self.bulk_write(batch.to_dicts())
@@ -0,0 +1,191 @@
+"""
+Collecting the metrics of several processes (e.g. the workers of a pre-fork server) in a single process.
+
+The workers send batches of metrics as compact frames over a Unix domain socket to the `MetricsCollector`,
+which batches them once more and writes them to the actual backend. So there's only one connection pool
+and one stream of bulks to e.g. Elasticsearch, however many workers there are.
+
+A frame is a 4-byte big-endian length followed by a JSON array of metrics.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import weakref
+
+from time_execution.backends.base import BaseMetricsBackend
+from time_execution.backends.threaded import ThreadedBackend
+from time_execution.timestamps import json_default
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+# Clients to be reset in a forked child process.
+_clients: "weakref.WeakSet[CollectorClientBackend]" = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for client in list(_clients):
+        # The lock may be held by a thread left behind in the parent, and the connection is the parent's.
+        client._lock = threading.Lock()
+        client._disconnect()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def encode_frame(metrics):
+    payload = json.dumps(metrics, separators=(",", ":"), default=json_default).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class CollectorClientBackend(BaseMetricsBackend):
+    """
+    Sends the metrics to a `MetricsCollector`.
+
+    Use it wrapped in a `ThreadedBackend`, so a process only puts the metrics in a queue,
+    and they are sent to the collector in batches by the worker thread. `bulk_write` raises the
+    error when the collector is unavailable, for the `ThreadedBackend` to account for the failed
+    batch (and spool it), whilst `write` only logs it. The connection is shared by the threads, e.g. the
+    `workers` of the `ThreadedBackend`, which send their frames one at a time.
+
+    Args:
+        path: path of the Unix domain socket of the collector
+        timeout: socket timeout in seconds
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._lock = threading.Lock()
+        _clients.add(self)
+
+    def write(self, name, **data):
+        data["name"] = name
+        try:
+            self.bulk_write([data])
+        except OSError:
+            pass  # logged by `bulk_write`
+
+    def bulk_write(self, metrics):
+        frame = encode_frame(metrics)
+        with self._lock:
+            # Retry once on a fresh connection: the collector may have been restarted.
+            for attempt in range(2):
+                try:
+                    self._connect().sendall(frame)
+                    return
+                except OSError as exc:
+                    self._disconnect()
+                    if attempt:
+                        logger.warning(
+                            "sending %d metrics to the collector at %s failure %r", len(metrics), self.path, exc
+                        )
+                        raise
+
+    def _connect(self):
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._socket = sock
+        return self._socket
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class _FrameHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            header = self.rfile.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return  # the client has disconnected
+            (size,) = FRAME_HEADER.unpack(header)
+            if size > MAX_FRAME_SIZE:
+                logger.warning("closing the connection, frame of %d bytes exceeds the maximum", size)
+                return
+            payload = self.rfile.read(size)
+            if len(payload) < size:
+                return
+            try:
+                metrics = json.loads(payload)
+            except ValueError as exc:
+                logger.warning("discarding an invalid frame %r", exc)
+                continue
+            self.server.collector.collect(metrics)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsCollector:
+    """
+    Receives the metrics of other processes and sends them in batches to the backend.
+
+    Args:
+        path: path of the Unix domain socket to listen on
+        backend: the backend (class or import path) to send the metrics to
+        backend_args: positional arguments for the backend
+        backend_kwargs: keyword arguments for the backend
+        threaded_kwargs: keyword arguments for the `ThreadedBackend` which batches the metrics
+    """
+
+    def __init__(self, path, backend, backend_args=None, backend_kwargs=None, **threaded_kwargs):
+        threaded_kwargs.setdefault("queue_maxsize", 100000)
+        threaded_kwargs.setdefault("bulk_size", 500)
+        self.path = path
+        self.backend = ThreadedBackend(backend, backend_args, backend_kwargs, **threaded_kwargs)
+        self.thread = None
+
+        if os.path.exists(path):
+            os.unlink(path)  # a left-over of a previous collector
+        self._server = _Server(path, _FrameHandler)
+        self._server.collector = self
+
+    def collect(self, metrics):
+        for metric in metrics:
+            self.backend.write(metric.pop("name", None), **metric)
+
+    def serve_forever(self):
+        """Handle the frames until `shutdown()` is called."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def start(self):
+        """Handle the frames in a background thread."""
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self.serve_forever, name="TimeExecutionCollectorThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def shutdown(self):
+        self._server.shutdown()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
@@ -1,15 +1,106 @@
+import json
 import logging
-from datetime import datetime
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from string import Formatter
 
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 from elasticsearch.exceptions import TransportError
 
 from time_execution.backends.base import BaseMetricsBackend
+from time_execution.telemetry import telemetry
+from time_execution.timestamps import TIMESTAMP_NS, convert_timestamps, json_default, to_datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
 
 logger = logging.getLogger(__name__)
 
+# Number of rendered action headers and index names to keep.
+ACTION_HEADERS_CACHE_SIZE = 64
+INDEX_CACHE_SIZE = 64
+
+DAY = 24 * 60 * 60
+
+# Granularity in seconds of the `strftime` directives; unknown ones and microseconds are never cached.
+_DIRECTIVE_GRANULARITY = {
+    **dict.fromkeys("STXcrs", 1),
+    **dict.fromkeys("MR", 60),
+    **dict.fromkeys("HIkelp", 60 * 60),
+    **dict.fromkeys("aAwudjUWVDFxbBhmyYGgC%", DAY),
+}
+
+
+def get_granularity(index_pattern):
+    """
+    Get the number of seconds the rendered `index_pattern` stays the same, at most a day.
+
+    Returns `None` if the pattern doesn't depend on the date and `0` if it can't be cached.
+    """
+    granularity = None
+    for _, field, spec, conversion in Formatter().parse(index_pattern):
+        if field != "date":
+            continue
+        if conversion or not spec:
+            return 0
+        for directive in re.findall(r"%-?(.)", spec):
+            directive_granularity = _DIRECTIVE_GRANULARITY.get(directive, 0)
+            granularity = directive_granularity if granularity is None else min(granularity, directive_granularity)
+    return granularity
+
+
+def _truncate(value, granularity):
+    if granularity >= DAY:
+        return value.date()
+    if granularity >= 60 * 60:
+        return value.replace(minute=0, second=0, microsecond=0)
+    if granularity >= 60:
+        return value.replace(second=0, microsecond=0)
+    return value.replace(microsecond=0)
+
+
+def _to_local(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone().replace(tzinfo=None)
+
+
+def json_serializer(document):
+    """
+    Serialize a document to JSON bytes with the standard library.
+    """
+    return json.dumps(document, separators=(",", ":"), default=json_default).encode()
+
+
+def orjson_serializer(document):
+    """
+    Serialize a document to JSON bytes with `orjson`.
+    """
+    return orjson.dumps(document, default=json_default)
+
+
+default_serializer = orjson_serializer if orjson is not None else json_serializer
+
 
 class ElasticsearchBackend(BaseMetricsBackend):
+    """
+    Args:
+        hosts: the Elasticsearch hosts, passed to the client
+        index: the name of the index, used to render `index_pattern`
+        index_pattern: pattern of the index names, formatted with `index` and `date`
+        pipeline: the ingest pipeline to pre-process the documents with
+        serializer: callable which serializes a metric to JSON bytes in `bulk_write`,
+            uses `orjson` when it's installed
+        http_compress: compress the requests with gzip
+        raise_on_error: raise the transport errors of `bulk_write` after logging them, e.g. for
+            the `ThreadedBackend` to spool the failed bulks
+
+    Any other arguments are passed to the `Elasticsearch` client.
+    """
+
     def __init__(
         self,
         hosts=None,
@@ -17,6 +108,9 @@ class ElasticsearchBackend(BaseMetricsBackend):
         index_pattern="{index}-{date:%Y.%m.%d}",
         pipeline=None,
         *args,
+        serializer=None,
+        http_compress=False,
+        raise_on_error=False,
         **kwargs,
     ):
         # Assign these in the backend as they are needed when writing metrics
@@ -24,12 +118,96 @@ class ElasticsearchBackend(BaseMetricsBackend):
         self.index = index
         self.index_pattern = index_pattern
         self.pipeline = pipeline
+        self.serializer = serializer or default_serializer
+        self.raise_on_error = raise_on_error
+        self._action_headers = {}
+        self._granularity = get_granularity(index_pattern)
+        self._index_cache = {}
+        self._timestamp_index_cache = {}
+        self._current_index = None
+        self._current_index_expires = 0.0
 
         # setup the client
-        self.client = Elasticsearch(hosts=hosts, *args, **kwargs)
+        self.client = self.create_client(hosts, *args, http_compress=http_compress, **kwargs)
+
+    def create_client(self, hosts, *args, **kwargs):
+        return Elasticsearch(hosts=hosts, *args, **kwargs)
+
+    def get_index(self, date=None):
+        """
+        Get the name of the index for the date, for the current (local) time by default.
+
+        The names are cached until the next boundary of the time granularity of the pattern.
+        """
+        if date is not None:
+            return self._get_index_for_date(date)
+
+        if self._granularity == 0:
+            return self.index_pattern.format(index=self.index, date=datetime.now())
+        if time.time() >= self._current_index_expires:
+            now = datetime.now()
+            self._current_index = self.index_pattern.format(index=self.index, date=now)
+            if self._granularity is None:
+                self._current_index_expires = float("inf")
+            else:
+                start = _truncate(now, self._granularity)
+                if self._granularity >= DAY:
+                    boundary = datetime.combine(start, datetime.min.time()) + timedelta(days=1)
+                else:
+                    boundary = start + timedelta(seconds=self._granularity)
+                # Re-render at least every hour, so a daylight saving time change can't postpone the boundary.
+                self._current_index_expires = time.time() + min((boundary - now).total_seconds(), 60 * 60)
+        return self._current_index
+
+    def _get_index_for_date(self, date):
+        if self._granularity == 0:
+            return self.index_pattern.format(index=self.index, date=date)
+        key = None if self._granularity is None else _truncate(date, self._granularity)
+        index = self._index_cache.get(key)
+        if index is None:
+            if len(self._index_cache) >= INDEX_CACHE_SIZE:
+                self._index_cache.clear()
+            index = self._index_cache[key] = self.index_pattern.format(index=self.index, date=date)
+        return index
+
+    def get_metric_index(self, metric):
+        """
+        Get the name of the index for the metric, by its timestamp if it's a `datetime` or an ISO 8601 string
+        (e.g. the metrics of the collector or the spool), otherwise the current one.
+
+        The timestamps are UTC when they're naive, and converted to local time like the current index, so a
+        metric goes to the index of the day (or hour...) it was written on, wherever it's sent from.
+        """
+        timestamp = metric.get("timestamp") if isinstance(metric, dict) else None
+        if isinstance(timestamp, str):
+            try:
+                timestamp = datetime.fromisoformat(timestamp)
+            except ValueError:
+                timestamp = None
+        if not isinstance(timestamp, datetime) or self._granularity is None:
+            return self.get_index()
+        if self._granularity == 0:
+            return self.index_pattern.format(index=self.index, date=_to_local(timestamp))
+        # Local time differs from UTC by whole minutes, so the timestamps of a minute share their index.
+        key = _truncate(timestamp, min(self._granularity, 60))
+        index = self._timestamp_index_cache.get(key)
+        if index is None:
+            if len(self._timestamp_index_cache) >= INDEX_CACHE_SIZE:
+                self._timestamp_index_cache.clear()
+            index = self.index_pattern.format(index=self.index, date=_to_local(timestamp))
+            self._timestamp_index_cache[key] = index
+        return index
 
-    def get_index(self):
-        return self.index_pattern.format(index=self.index, date=datetime.now())
+    def get_action_header(self, index):
+        """
+        Get the serialized bulk action header for the index.
+        """
+        header = self._action_headers.get(index)
+        if header is None:
+            if len(self._action_headers) >= ACTION_HEADERS_CACHE_SIZE:
+                self._action_headers.clear()
+            header = self._action_headers[index] = json_serializer({"index": {"_index": index}})
+        return header
 
     def write(self, name, **data):
         """
@@ -40,23 +218,29 @@ class ElasticsearchBackend(BaseMetricsBackend):
             data (dict): Additional data to store with the metric
         """
 
-        data["name"] = name
-        if not ("timestamp" in data):
-            data["timestamp"] = datetime.utcnow()
-
+        data = self.get_document(name, data)
         try:
-            index_params = {
-                "index": self.get_index(),
-                "id": None,
-                "body": data,
-            }
-            if self.pipeline:
-                index_params["pipeline"] = self.pipeline
-
-            self.client.index(**index_params)
+            self.client.index(**self.get_index_params(data))
         except TransportError as exc:
             logger.warning("writing metric %r failure %r", data, exc)
 
+    def get_document(self, name, data):
+        data["name"] = name
+        timestamp_ns = data.pop(TIMESTAMP_NS, None)
+        if not ("timestamp" in data):
+            data["timestamp"] = datetime.utcnow() if timestamp_ns is None else to_datetime(timestamp_ns)
+        return data
+
+    def get_index_params(self, data):
+        index_params = {
+            "index": self.get_metric_index(data),
+            "id": None,
+            "body": data,
+        }
+        if self.pipeline:
+            index_params["pipeline"] = self.pipeline
+        return index_params
+
     def bulk_write(self, metrics):
         """
         Write multiple metrics to elasticsearch in one request
@@ -64,17 +248,107 @@ class ElasticsearchBackend(BaseMetricsBackend):
         Args:
             metrics (list): data with mappings to send to elasticsearch
         """
-        actions = []
-        index = self.get_index()
+        if not metrics:
+            return
+
+        bulk_params = self.get_bulk_params(metrics)
+        if bulk_params is None:
+            return
+        start = time.perf_counter()
+        try:
+            self.client.bulk(**bulk_params)
+        except TransportError as exc:
+            self.record_bulk(bulk_params, start, failed=len(metrics))
+            logger.warning("bulk_write metrics %r failure %r", metrics, exc)
+            if self.raise_on_error:
+                raise
+        else:
+            self.record_bulk(bulk_params, start)
+
+    def record_bulk(self, bulk_params, start, failed=0):
+        """Record the latency and size of a bulk request in the telemetry."""
+        if not telemetry.enabled:
+            return
+        telemetry.record("elasticsearch.bulk", (time.perf_counter() - start) * 1000.0)
+        telemetry.record("elasticsearch.bulk_bytes", len(bulk_params["operations"]))
+        if failed:
+            telemetry.record("elasticsearch.failures", failed)
+
+    def get_bulk_params(self, metrics):
+        """
+        Get the arguments of the bulk request of the metrics, leaving out the ones which can't be serialized,
+        `None` if that's all of them.
+        """
+        convert_timestamps(metrics)
+        # Metrics are written to the index of their own timestamp, grouped so the action headers are shared.
+        by_index = {}
         for metric in metrics:
-            actions.append({"index": {"_index": index}})
-            actions.append(metric)
+            index = self.get_metric_index(metric)
+            if index in by_index:
+                by_index[index].append(metric)
+            else:
+                by_index[index] = [metric]
 
-        bulk_params = {"operations": actions}
+        serialize = self.serializer
+        lines = []
+        discarded = 0
+        for index, index_metrics in by_index.items():
+            header = self.get_action_header(index)
+            for metric in index_metrics:
+                try:
+                    document = serialize(metric)
+                except Exception as exc:
+                    # Rather than losing the whole bulk to a field a hook filled with e.g. a set.
+                    logger.warning("discarding metric %r, serialization failure %r", metric, exc)
+                    discarded += 1
+                    continue
+                lines.append(header)
+                lines.append(document)
+        if discarded == len(metrics):
+            return None
+        # The NDJSON body is passed on by the client as is.
+        lines.append(b"")
+
+        bulk_params = {"operations": b"\n".join(lines)}
         if self.pipeline:
             bulk_params["pipeline"] = self.pipeline
+        return bulk_params
+
+
+class AsyncElasticsearchBackend(ElasticsearchBackend):
+    """
+    Elasticsearch backend for asyncio, using the `AsyncElasticsearch` client.
+
+    Its `write`, `bulk_write` and `close` methods are coroutines, so it's meant to be wrapped by the
+    `AsyncBatchingBackend` rather than to be used in the settings directly.
+    """
 
+    def create_client(self, hosts, *args, **kwargs):
+        return AsyncElasticsearch(hosts=hosts, *args, **kwargs)
+
+    async def write(self, name, **data):
+        data = self.get_document(name, data)
         try:
-            self.client.bulk(**bulk_params)
+            await self.client.index(**self.get_index_params(data))
         except TransportError as exc:
+            logger.warning("writing metric %r failure %r", data, exc)
+
+    async def bulk_write(self, metrics):
+        if not metrics:
+            return
+        bulk_params = self.get_bulk_params(metrics)
+        if bulk_params is None:
+            return
+        start = time.perf_counter()
+        try:
+            await self.client.bulk(**bulk_params)
+        except TransportError as exc:
+            self.record_bulk(bulk_params, start, failed=len(metrics))
             logger.warning("bulk_write metrics %r failure %r", metrics, exc)
+            if self.raise_on_error:
+                raise
+        else:
+            self.record_bulk(bulk_params, start)
+
+    async def close(self):
+        await self.client.close()
@@ -1,15 +1,42 @@
+import atexit
 import datetime
+import inspect
 import logging
+import multiprocessing.context
+import multiprocessing.queues
+import os
+import random
 import threading
 import time
+import weakref
 from importlib import import_module
-from multiprocessing import Queue
 from queue import Empty, Full
 
+from time_execution import SHORT_HOSTNAME, settings
 from time_execution.backends.base import BaseMetricsBackend
+from time_execution.columns import ColumnarBatch
+from time_execution.counters import AtomicCounter
+from time_execution.deferred import run_deferred_hooks
+from time_execution.queues import RingBufferQueue
+from time_execution.records import MetricRecord
+from time_execution.telemetry import telemetry
+from time_execution.timestamps import TIMESTAMP_NS, convert_timestamps
 
 logger = logging.getLogger(__name__)
 
+# What `write` does with a metric when the queue is full.
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+SAMPLE = "sample"
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK, SAMPLE)
+
+DROPPED_METRIC = "time_execution.dropped_metrics"
+
+
+class _Wake:
+    """Put in the queues by `flush` and `close`, so a worker waiting for metrics notices their request."""
+
 
 def import_from_string(val):
     """
@@ -24,18 +51,74 @@ def import_from_string(val):
         raise ImportError(msg)
 
 
+# Backends to be reset in a forked child process.
+_instances: "weakref.WeakSet[ThreadedBackend]" = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for backend in list(_instances):
+        backend.after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 class ThreadedBackend(BaseMetricsBackend):
+    """
+    Puts the metrics in a queue, from which worker threads send them in bulk to the wrapped backend.
+
+    A batch is sent once `bulk_size` metrics are queued or `bulk_timeout` seconds after the first of them.
+    Every worker has a queue of its own, and the metrics of a name always go to the same one, so they're
+    sent in order. Records are queued as is; a wrapped backend with `accepts_columns = True` gets them
+    as a `ColumnarBatch`. A forked child gets a fresh queue, unless it's a `multiprocessing.Queue`.
+
+    Args:
+        backend: the backend (class or import path) to send the metrics to
+        backend_args: positional arguments for the backend
+        backend_kwargs: keyword arguments for the backend
+        queue_maxsize: maximum number of metrics queued by all the workers together
+        queue_timeout: number of seconds after which an idle worker checks whether to stop, never if `None`
+        worker_limit: number of metrics after which the worker stops, unlimited if `None`
+        bulk_size: number of metrics sent at once
+        bulk_timeout: maximum number of seconds a metric waits to be sent
+        queue_class: the queue (class or import path), `RingBufferQueue` or e.g. `multiprocessing.Queue`
+        spool: a `DiskSpool` or its directory, for the batches which can't be sent
+        spool_retry_interval: number of seconds between the attempts to replay the spool
+        overflow: what to do when the queue is full, one of `OVERFLOW_POLICIES`
+        block_timeout: maximum number of seconds `write` waits for room with the `"block"` policy
+        drop_report_interval: number of seconds between the reports of the discarded metrics
+        workers: number of worker threads, i.e. the maximum number of bulks sent at once
+        exit_timeout: maximum number of seconds to send the queued metrics at exit, not at all if `None`
+        batching: an `AdaptiveBatching`, which tunes `bulk_size` and `bulk_timeout` after every batch
+    """
+
+    accepts_records = True
+
     def __init__(
         self,
         backend,
         backend_args=None,
         backend_kwargs=None,
         queue_maxsize=1000,
-        queue_timeout=0.5,
+        queue_timeout=None,
         worker_limit=None,
         bulk_size=50,
         bulk_timeout=1,
+        queue_class=RingBufferQueue,
+        spool=None,
+        spool_retry_interval=5,
+        overflow=DROP_NEWEST,
+        block_timeout=0.1,
+        drop_report_interval=60,
+        workers=1,
+        exit_timeout=5,
+        batching=None,
     ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s" % ", ".join(OVERFLOW_POLICIES))
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
         if backend_args is None:
             backend_args = tuple()
         if backend_kwargs is None:
@@ -43,72 +126,529 @@ class ThreadedBackend(BaseMetricsBackend):
         self.parent_thread = threading.current_thread()
         self.queue_timeout = queue_timeout
         self.worker_limit = worker_limit
-        self.thread = None
-        self.fetched_items = 0
+        self.workers = workers
+        self.threads = [None] * workers
+        self._fetched = AtomicCounter()
+        self.exit_timeout = exit_timeout
+        self._flush_condition = threading.Condition()
+        self._flush_seq = 0
+        self._flushed = [0] * workers
+        self._stopping = False
+        self.batching = batching
+        if batching is not None:
+            bulk_size, bulk_timeout = batching.bind(bulk_size, bulk_timeout, workers)
         self.bulk_size = bulk_size
         self.bulk_timeout = bulk_timeout
 
         if isinstance(backend, str):
             backend = import_from_string(backend)
 
+        if isinstance(queue_class, str):
+            queue_class = import_from_string(queue_class)
+
         self.backend = backend(*backend_args, **backend_kwargs)
-        self._queue = Queue(maxsize=queue_maxsize)
+        self._queue_class = queue_class
+        # A hot name may take up all the room, unless the size of the queues can't be counted cheaply.
+        self._shared_capacity = workers > 1 and queue_maxsize > 0 and not _is_multiprocessing_queue(queue_class)
+        if self._shared_capacity or workers == 1:
+            self._shard_maxsize = self._queue_maxsize = queue_maxsize
+        else:
+            # Each worker's share of the queue, rounded up.
+            self._shard_maxsize = self._queue_maxsize = -(-queue_maxsize // workers)
+        self._create_queues()
+        # The deferred hooks, and their inputs, can't be sent to another process.
+        self.accepts_deferred = not isinstance(self._queue, multiprocessing.queues.Queue)
+        if isinstance(spool, str):
+            # Imported on demand: the spool relies on `fcntl`, which isn't available everywhere.
+            from time_execution.spool import DiskSpool
+
+            spool = DiskSpool(spool)
+        self.spool = spool
+        self._spool_lock = threading.Lock()
+        self.spool_retry_interval = spool_retry_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.drop_report_interval = drop_report_interval
+        self.dropped = AtomicCounter()
+        self._reported_drops = 0
+        self._degrade_above = self._queue_maxsize // 2 if overflow == SAMPLE and queue_maxsize > 0 else None
+        self._start_on_write = False
+        _instances.add(self)
         self.start_worker()
 
+    @property
+    def thread(self):
+        """The thread of the first worker."""
+        return self.threads[0]
+
+    @property
+    def fetched_items(self):
+        """The number of metrics taken from the queues by the workers."""
+        return self._fetched.value
+
+    def _create_queues(self):
+        self._queues = [self._queue_class(maxsize=self._shard_maxsize) for _ in range(self.workers)]
+        # The queue of the first worker, the only one by default.
+        self._queue = self._queues[0]
+
+    def _queue_for(self, name):
+        if self.workers == 1:
+            return self._queue
+        return self._queues[hash(name) % self.workers]
+
+    def _size(self, queue):
+        """The number of metrics which count towards `queue_maxsize` for the queue."""
+        if self._shared_capacity:
+            return sum(queue.qsize() for queue in self._queues)
+        return queue.qsize()
+
+    def _put_nowait(self, queue, item):
+        if self._shared_capacity and self._size(queue) >= self._queue_maxsize:
+            raise Full
+        queue.put_nowait(item)
+
+    def after_fork_in_child(self):
+        """
+        Reset the state inherited from the parent process, where the worker threads are left behind.
+        """
+        self.parent_thread = threading.current_thread()
+        self.threads = [None] * self.workers
+        self._fetched = AtomicCounter()
+        self._flush_condition = threading.Condition()
+        self._flushed = [self._flush_seq] * self.workers
+        if self.spool is not None:
+            # The parent keeps replaying what it spooled, but only one process can hold the spool.
+            logger.warning(
+                "the spool at %s is left to the parent process, the batches which fail in process %d are discarded",
+                self.spool.directory,
+                os.getpid(),
+            )
+        self.spool = None
+        self._spool_lock = threading.Lock()
+        self.dropped = AtomicCounter()
+        self._reported_drops = 0
+        if not isinstance(self._queue, multiprocessing.queues.Queue):
+            # Never share the metrics queued by the parent, they'd be sent twice.
+            self._create_queues()
+            self._start_on_write = True
+
     def write(self, name, **data):
-        if "timestamp" not in data:
-            data["timestamp"] = datetime.datetime.utcnow()
+        if self._start_on_write:
+            self._start_on_write = False
+            self.start_worker()
+        if "timestamp" not in data and TIMESTAMP_NS not in data:
+            data[TIMESTAMP_NS] = time.time_ns()
+        queue = self._queue_for(name)
+        if self._degrade_above is not None and not self._sample(queue, data):
+            return
         try:
-            self._queue.put_nowait((name, data))
+            self._put_nowait(queue, (name, data))
         except Full:
-            logger.warning("Discard metric %s", name)
+            self._overflow(queue, (name, data))
+
+    def write_record(self, record):
+        queue = self._queue_for(record.name)
+        if self._degrade_above is not None and self._size(queue) > self._degrade_above:
+            # Sampling adds a field to the metric, leave it to `write`.
+            run_deferred_hooks(record)
+            self.write(**record.to_dict())
+            return
+        if self._start_on_write:
+            self._start_on_write = False
+            self.start_worker()
+        try:
+            self._put_nowait(queue, record)
+        except Full:
+            self._overflow(queue, record)
+
+    def _sample(self, queue, data):
+        size = self._size(queue)
+        if size <= self._degrade_above:
+            return True
+        rate = (self._queue_maxsize - size) / (self._queue_maxsize - self._degrade_above)
+        if rate > 0 and random.random() < rate:
+            data["sample_weight"] = data.get("sample_weight", 1) / rate
+            return True
+        self.dropped.increment()
+        return False
+
+    def _overflow(self, queue, item):
+        if self.overflow == DROP_OLDEST:
+            # The oldest metric of the fullest queue, which isn't necessarily the one of the new metric.
+            fullest = max(self._queues, key=lambda queue: queue.qsize()) if self._shared_capacity else queue
+            wake = None
+            try:
+                oldest = fullest.get_nowait()
+                while isinstance(oldest, _Wake):
+                    # Not a metric, keep it for the pending `flush` or `close`.
+                    wake = oldest
+                    oldest = fullest.get_nowait()
+                self.dropped.increment()
+            except Empty:
+                pass
+            try:
+                self._put_nowait(queue, item)
+                return
+            except Full:
+                pass
+            finally:
+                if wake is not None:
+                    try:
+                        fullest.put_nowait(wake)
+                    except Full:
+                        pass
+        elif self.overflow == BLOCK:
+            try:
+                if self._shared_capacity:
+                    self._put_blocking(queue, item)
+                else:
+                    queue.put(item, True, self.block_timeout)
+                return
+            except Full:
+                pass
+        self.dropped.increment()
+
+    def _put_blocking(self, queue, item):
+        # Polls for room in any of the queues, as `RingBufferQueue.put` does in its own.
+        deadline = time.monotonic() + self.block_timeout
+        interval = 0.0005
+        while True:
+            try:
+                return self._put_nowait(queue, item)
+            except Full:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.01)
+
+    def report_drops(self):
+        """
+        Log the number of metrics discarded since the previous report, and return it as a metric.
+        """
+        dropped = self.dropped.value
+        count = dropped - self._reported_drops
+        self._reported_drops = dropped
+        if not count:
+            return None
+        if telemetry.enabled:
+            telemetry.record("threaded.dropped", count)
+        logger.warning("Discarded %d metrics, the queue is full (%s)", count, self.overflow)
+        return {
+            "name": DROPPED_METRIC,
+            "count": count,
+            "overflow": self.overflow,
+            "hostname": SHORT_HOSTNAME,
+            "timestamp": datetime.datetime.utcnow(),
+        }
 
     def start_worker(self):
-        if self.thread:
+        if any(self.threads):
             return
-        self.fetched_items = 0
-        self.thread = threading.Thread(target=self.worker, name="TimeExecutionThread")
-        self.thread.daemon = False
-        self.thread.start()
+        self._fetched = AtomicCounter()
+        self._stopping = False
+        for shard in range(self.workers):
+            name = "TimeExecutionThread-%d" % shard if shard else "TimeExecutionThread"
+            thread = self.threads[shard] = threading.Thread(target=self.worker, args=(shard,), name=name)
+            # A worker which polls stops by itself after the thread which created the backend,
+            # the others are stopped at exit by `close`.
+            thread.daemon = self.queue_timeout is None
+            thread.start()
 
-    def batch_ready(self, batch):
-        return self.bulk_size < len(batch)
+    def flush(self, timeout=None):
+        """
+        Send the metrics queued so far, and wait until they're sent.
+
+        Args:
+            timeout: maximum number of seconds to wait
+
+        Returns:
+            whether they were sent in time, never if a worker is stopped with metrics left in its queue
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._flush_condition:
+            self._flush_seq += 1
+            seq = self._flush_seq
+        self._wake_workers()
+
+        def flushed():
+            return all(done >= seq or thread is None for done, thread in zip(self._flushed, self.threads))
+
+        with self._flush_condition:
+            if not self._flush_condition.wait_for(flushed, _remaining(deadline)):
+                return False
+        # Nothing sends the metrics in the queue of a stopped worker.
+        return all(thread is not None or queue.empty() for queue, thread in zip(self._queues, self.threads))
+
+    def close(self, timeout=None):
+        """
+        Send the queued metrics and stop the workers, then close the spool and the wrapped backend.
 
-    def batch_time(self, last_write):
-        return (time.time() - last_write) >= self.bulk_timeout
+        The metrics written afterwards are queued, but only sent if `start_worker` is called again.
+
+        Args:
+            timeout: maximum number of seconds to wait for the workers
+
+        Returns:
+            whether the workers stopped in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stop_workers()
+        return self._join(deadline)
+
+    def _stop_workers(self):
+        self._stopping = True
+        self._wake_workers()
+
+    def _wake_workers(self):
+        # The requests aren't queued, so they can't be dropped by the overflow policy.
+        for queue, thread in zip(self._queues, self.threads):
+            if thread is None:
+                continue
+            try:
+                queue.put_nowait(_Wake())
+            except Full:
+                # The worker has metrics to get anyway.
+                pass
+            wake = getattr(queue, "wake", None)
+            if wake is not None:
+                wake()
+
+    def _join(self, deadline):
+        for thread in list(self.threads):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(_remaining(deadline))
+        if any(self.threads):
+            logger.warning("%r didn't send all the queued metrics in time", self)
+            return False
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        close = getattr(self.backend, "close", None)
+        if close is not None and not inspect.iscoroutinefunction(close):
+            close()
+        return True
+
+    def batch_ready(self, batch):
+        return len(batch) >= self.bulk_size
 
     def has_work(self):
         if self.worker_limit is None:
             return True
         return self.fetched_items < self.worker_limit
 
-    def worker(self):
+    def worker(self, shard=0):
+        """
+        Send the metrics of the queue of a worker. The first one also reports the discarded metrics.
+
+        The worker sleeps until the next of its deadlines: sending the batch, reporting the discarded metrics,
+        and replaying the spool. It's woken up by a new metric when its batch is empty, and otherwise only
+        once the batch is full, if the queue supports it (see `RingBufferQueue.wait`). On a request of `flush`
+        or `close`, it sends the metrics queued so far, without waiting for more.
+        """
+        queue = self._queues[shard]
+        wait = getattr(queue, "wait", None)
+        reports_drops = shard == 0
         metrics = []
-        last_write = time.time()
+        now = time.monotonic()
+        send_at = None
+        report_at = now + self.drop_report_interval
+        replay_at = now + self.spool_retry_interval
 
         def send_metrics():
+            batch = None
+            if getattr(self.backend, "accepts_columns", False) is True:
+                try:
+                    batch = ColumnarBatch.from_metrics(metrics, settings.duration_field)
+                    bulk_write = self.backend.bulk_write_columns
+                except Exception as exc:
+                    logger.warning(
+                        "sending %d metrics as dicts, encoding them as columns failure %r", len(metrics), exc
+                    )
+                    batch = None
+            if batch is None:
+                batch = [item.to_dict() if isinstance(item, MetricRecord) else item for item in metrics]
+                convert_timestamps(batch)
+                bulk_write = self.backend.bulk_write
+            measure = telemetry.enabled
+            start = time.perf_counter()
             try:
-                self.backend.bulk_write(metrics)
+                bulk_write(batch)
             except Exception as exc:
                 logger.warning("%r write failure %r", self.backend, exc)
+                if self.batching is not None:
+                    self.bulk_size, self.bulk_timeout = self.batching.observe(
+                        len(metrics), time.perf_counter() - start, failed=True
+                    )
+                if measure:
+                    telemetry.record("threaded.failures", len(metrics))
+                if self.spool is not None:
+                    spool_batch(batch.to_dicts() if isinstance(batch, ColumnarBatch) else batch)
+                return False
+            latency = time.perf_counter() - start
+            if self.batching is not None:
+                self.bulk_size, self.bulk_timeout = self.batching.observe(len(metrics), latency)
+            if measure:
+                telemetry.record("threaded.bulk_write", latency * 1000.0)
+                telemetry.record("threaded.batch_size", len(metrics))
+            return True
+
+        def spool_batch(batch):
+            try:
+                with self._spool_lock:
+                    self.spool.append(batch)
+            except Exception as exc:
+                # E.g. the disk is full, the worker carries on all the same.
+                logger.warning("discarding %d metrics, spooling them failure %r", len(batch), exc)
+
+        def replay():
+            with self._spool_lock:
+                if self.spool.pending:
+                    self.spool.replay(self.backend.bulk_write)
 
-        while self.has_work():
-            if self.batch_ready(metrics) or (self.batch_time(last_write) and metrics):
-                send_metrics()
-                last_write = time.time()
+        def flushed(seq):
+            with self._flush_condition:
+                self._flushed[shard] = seq
+                self._flush_condition.notify_all()
+
+        # The flush sequence number and whether to stop, of the request being handled, and the number of
+        # items queued before it which are left (`None` if the queue can't tell).
+        request = None
+        left = None
+        stop = False
+        while not stop and self.has_work():
+            now = time.monotonic()
+            if reports_drops and now >= report_at:
+                report = self.report_drops()
+                if report:
+                    metrics.append(report)
+                    send_at = send_at or now + self.bulk_timeout
+                report_at = now + self.drop_report_interval
+            if metrics and (self.batch_ready(metrics) or now >= send_at):
+                sent = send_metrics()
                 metrics = []
+                send_at = None
+                if sent and self.spool is not None and self.spool.pending:
+                    # The backend is available again.
+                    replay()
+                    replay_at = time.monotonic() + self.spool_retry_interval
+            if self.spool is not None and now >= replay_at:
+                replay()
+                replay_at = time.monotonic() + self.spool_retry_interval
+
+            deadlines = [send_at]
+            if reports_drops:
+                deadlines.append(report_at)
+            if self.spool is not None and self.spool.pending:
+                deadlines.append(replay_at)
+            timeout = _remaining(min((deadline for deadline in deadlines if deadline is not None), default=None))
+            if self.queue_timeout is not None:
+                timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+
+            if request is None and (self._stopping or self._flush_seq > self._flushed[shard]):
+                request = (self._flush_seq, self._stopping)
+                left = _qsize(queue)
+
+            # The number of metrics which complete the batch.
+            missing = max(self.bulk_size - len(metrics), 1)
+            if self.worker_limit is not None:
+                missing = min(missing, self.worker_limit - self.fetched_items)
+            if left is not None:
+                missing = min(missing, left)
+            items = []
+            drained = False
             try:
-                name, data = self._queue.get(True, self.queue_timeout)
+                if request is not None:
+                    while len(items) < missing:
+                        items.append(queue.get_nowait())
+                elif metrics and wait is not None:
+                    # Wait for the batch to fill up, rather than waking up for every metric.
+                    wait(missing, timeout)
+                else:
+                    items.append(queue.get(True, timeout))
+                while len(items) < missing:
+                    items.append(queue.get_nowait())
             except Empty:
-                if not self.parent_thread.is_alive():
+                drained = True
+                if not items and not metrics and self.queue_timeout is not None and not self.parent_thread.is_alive():
                     break
-                continue
             except TypeError as err:
                 logger.warning("stopping the worker due to %r", err)
                 break
-            self.fetched_items += 1
-            data["name"] = name
-            metrics.append(data)
+
+            for item in items:
+                if isinstance(item, _Wake):
+                    continue
+                self._fetched.increment()
+                if isinstance(item, MetricRecord):
+                    if item.deferred is not None:
+                        run_deferred_hooks(item)
+                    metrics.append(item)
+                else:
+                    name, data = item
+                    data["name"] = name
+                    metrics.append(data)
+                if send_at is None:
+                    send_at = time.monotonic() + self.bulk_timeout
+
+            if request is not None:
+                if left is not None:
+                    left -= len(items)
+                if drained or left == 0:
+                    if metrics:
+                        send_metrics()
+                        metrics = []
+                        send_at = None
+                    seq, stop = request
+                    flushed(seq)
+                    request = left = None
+        report = self.report_drops() if reports_drops else None
+        if report:
+            metrics.append(report)
         if metrics:
             send_metrics()
-        self.thread = None
+        if self.spool is not None:
+            with self._spool_lock:
+                self.spool.flush()
+        with self._flush_condition:
+            self.threads[shard] = None
+            self._flush_condition.notify_all()
+
+
+def _is_multiprocessing_queue(queue_class):
+    if isinstance(queue_class, type):
+        return issubclass(queue_class, multiprocessing.queues.Queue)
+    # `multiprocessing.Queue` and its like are methods of a context.
+    return isinstance(getattr(queue_class, "__self__", None), multiprocessing.context.BaseContext)
+
+
+def _qsize(queue):
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # `multiprocessing.Queue` on macOS.
+        return None
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+def _queue_size():
+    return sum(queue.qsize() for backend in list(_instances) for queue in backend._queues)
+
+
+telemetry.gauge("threaded.queue_size", _queue_size)
+
+
+@atexit.register
+def _close_at_exit():
+    backends = [backend for backend in list(_instances) if backend.exit_timeout is not None and any(backend.threads)]
+    # Stop all the workers at once, so they send their last batches concurrently.
+    start = time.monotonic()
+    for backend in backends:
+        backend._stop_workers()
+    for backend in backends:
+        backend._join(start + backend.exit_timeout)
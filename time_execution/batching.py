@@ -0,0 +1,158 @@
+"""
+Adaptive batching for the `ThreadedBackend`.
+
+The size of the batches and the time a metric may wait for its batch are a trade-off: large batches spare
+requests at peak time, but delay the metrics when they trickle in. `AdaptiveBatching` tunes both from the
+observed latency of `bulk_write`, its failures and the arrival rate of the metrics, so that a metric is sent
+within `target_delay` seconds, whilst the batches stay large enough for the workers to keep up.
+"""
+
+from __future__ import annotations
+
+import threading
+from time import monotonic
+from typing import Callable, Dict, Optional, Tuple
+
+# Weight of a new observation in the moving averages.
+_SMOOTHING = 0.2
+# The batches hold this many more metrics than the workers need to keep up with the arrival rate.
+_HEADROOM = 1.25
+# Above this (averaged) share of failed batches, the batches stop growing.
+_ERROR_THRESHOLD = 0.1
+
+
+class AdaptiveBatching:
+    """
+    Tunes the batch size and the flush interval of a `ThreadedBackend`, within the given bounds.
+
+    After every batch, the flush interval is set to what's left of `target_delay` once the batch is sent,
+    and the batch size to the number of metrics a worker gets in that time; but never less than it gets
+    whilst sending a batch, as the queue would otherwise grow. A failed batch halves the batch size and
+    doubles the flush interval, to back off from an overloaded backend.
+
+    Args:
+        target_delay: number of seconds within which a metric should be sent
+        min_bulk_size: minimum number of metrics sent at once
+        max_bulk_size: maximum number of metrics sent at once
+        min_bulk_timeout: minimum number of seconds a metric waits to be sent
+        max_bulk_timeout: maximum number of seconds a metric waits to be sent, `target_delay` if `None`
+        window: length of the window, in seconds, over which the arrival rate is measured
+    """
+
+    def __init__(
+        self,
+        target_delay: float = 1.0,
+        min_bulk_size: int = 1,
+        max_bulk_size: int = 1000,
+        min_bulk_timeout: float = 0.01,
+        max_bulk_timeout: Optional[float] = None,
+        window: float = 1.0,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        if max_bulk_timeout is None:
+            max_bulk_timeout = target_delay
+        if target_delay <= 0:
+            raise ValueError(f"target_delay must be positive, got {target_delay!r}")
+        if not 1 <= min_bulk_size <= max_bulk_size:
+            raise ValueError(f"bulk sizes must satisfy 1 <= min <= max, got {min_bulk_size!r}, {max_bulk_size!r}")
+        if not 0 < min_bulk_timeout <= max_bulk_timeout:
+            raise ValueError(
+                f"bulk timeouts must satisfy 0 < min <= max, got {min_bulk_timeout!r}, {max_bulk_timeout!r}"
+            )
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window!r}")
+        self.target_delay = target_delay
+        self.min_bulk_size = min_bulk_size
+        self.max_bulk_size = max_bulk_size
+        self.min_bulk_timeout = min_bulk_timeout
+        self.max_bulk_timeout = max_bulk_timeout
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.bulk_size = min_bulk_size
+        self.bulk_timeout = max_bulk_timeout
+        # The number of workers which send batches concurrently.
+        self.senders = 1
+        self.latency: Optional[float] = None
+        self.arrival_rate: Optional[float] = None
+        self.error_rate = 0.0
+        self._window_start = clock()
+        self._arrived = 0
+
+    def bind(self, bulk_size: int, bulk_timeout: float, senders: int = 1) -> Tuple[int, float]:
+        """Start from the given settings, within the bounds, and return them."""
+        with self._lock:
+            self.bulk_size = self._clamp_size(bulk_size)
+            self.bulk_timeout = self._clamp_timeout(bulk_timeout)
+            self.senders = senders
+            return self.bulk_size, self.bulk_timeout
+
+    def observe(self, size: int, latency: float, failed: bool = False) -> Tuple[int, float]:
+        """
+        Account for a batch sent by a worker, and return the new batch size and flush interval.
+
+        Args:
+            size: number of metrics in the batch
+            latency: number of seconds `bulk_write` took
+            failed: whether `bulk_write` raised an exception
+        """
+        with self._lock:
+            now = self._clock()
+            self._arrived += size
+            elapsed = now - self._window_start
+            if elapsed >= self.window:
+                self.arrival_rate = _average(self.arrival_rate, self._arrived / elapsed)
+                self._window_start = now
+                self._arrived = 0
+            self.error_rate += _SMOOTHING * (float(failed) - self.error_rate)
+
+            if failed:
+                self.bulk_size = self._clamp_size(self.bulk_size // 2)
+                self.bulk_timeout = self._clamp_timeout(self.bulk_timeout * 2)
+            else:
+                self.latency = _average(self.latency, latency)
+                if self.arrival_rate is not None:
+                    self._tune(self.latency, self.arrival_rate)
+            return self.bulk_size, self.bulk_timeout
+
+    def _tune(self, latency: float, arrival_rate: float) -> None:
+        bulk_timeout = self._clamp_timeout(self.target_delay - latency)
+        # Every worker gets its share of the metrics.
+        rate = arrival_rate / self.senders
+        bulk_size = rate * max(bulk_timeout, latency * _HEADROOM)
+        if self.error_rate > _ERROR_THRESHOLD:
+            bulk_size = min(bulk_size, self.bulk_size)
+        self.bulk_timeout += _SMOOTHING * (bulk_timeout - self.bulk_timeout)
+        delta = bulk_size - self.bulk_size
+        step = round(_SMOOTHING * delta)
+        if not step and abs(delta) >= 1:
+            # Small batches still grow and shrink.
+            step = 1 if delta > 0 else -1
+        self.bulk_size = self._clamp_size(self.bulk_size + step)
+
+    def _clamp_size(self, bulk_size: float) -> int:
+        return int(min(max(bulk_size, self.min_bulk_size), self.max_bulk_size))
+
+    def _clamp_timeout(self, bulk_timeout: float) -> float:
+        return min(max(bulk_timeout, self.min_bulk_timeout), self.max_bulk_timeout)
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        """
+        Return the current batch size and flush interval, with the observations they're derived from:
+        the average latency of `bulk_write` in seconds, the arrival rate of the metrics per second and
+        the (averaged) share of failed batches. The latency and arrival rate are `None` until observed.
+        """
+        with self._lock:
+            return {
+                "bulk_size": self.bulk_size,
+                "bulk_timeout": self.bulk_timeout,
+                "latency": self.latency,
+                "arrival_rate": self.arrival_rate,
+                "error_rate": self.error_rate,
+            }
+
+
+def _average(average: Optional[float], value: float) -> float:
+    if average is None:
+        return value
+    return average + _SMOOTHING * (value - average)
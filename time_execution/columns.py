@@ -0,0 +1,220 @@
+"""
+Columnar batches of metrics, for the backends which work on whole batches.
+
+A backend with `accepts_columns = True` gets the batches of the `ThreadedBackend` as a `ColumnarBatch` through
+`bulk_write_columns`, instead of a list of dicts through `bulk_write`. The durations, timestamps and sample
+weights are typed `array` columns, which `to_numpy()` exposes as NumPy arrays without copying them. The names,
+hostnames and origins are dictionary-encoded: a column of codes into the list of the distinct values.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from time_execution.records import MetricRecord
+from time_execution.timestamps import TIMESTAMP_NS, convert_timestamps
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore[assignment]
+
+NAN = float("nan")
+
+SeriesKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class ColumnarBatch:
+    """
+    A batch of metrics, stored per field.
+
+    Missing values are `NaN` in the `durations` and `sample_weights`, and `-1` in the `timestamps_ns` (a
+    metric with a `timestamp` instead); missing names, hostnames and origins are encoded as `None`. All
+    the other fields of a metric, e.g. the ones added by the hooks, are kept in a dict in `extras`, or `None`;
+    so is a duration or sample weight which isn't a number.
+
+    Args:
+        duration_field: the field of a metric which holds the duration
+    """
+
+    __slots__ = (
+        "duration_field",
+        "names",
+        "name_codes",
+        "hostnames",
+        "hostname_codes",
+        "origins",
+        "origin_codes",
+        "durations",
+        "timestamps_ns",
+        "sample_weights",
+        "extras",
+        "_name_index",
+        "_hostname_index",
+        "_origin_index",
+    )
+
+    def __init__(self, duration_field: str = "value") -> None:
+        self.duration_field = duration_field
+        self.names: List[Optional[str]] = []
+        self.name_codes = array("I")
+        self.hostnames: List[Optional[str]] = []
+        self.hostname_codes = array("I")
+        self.origins: List[Optional[str]] = []
+        self.origin_codes = array("I")
+        self.durations = array("d")
+        self.timestamps_ns = array("q")
+        self.sample_weights = array("d")
+        self.extras: List[Optional[Dict[str, Any]]] = []
+        self._name_index: Dict[Optional[str], int] = {}
+        self._hostname_index: Dict[Optional[str], int] = {}
+        self._origin_index: Dict[Optional[str], int] = {}
+
+    @classmethod
+    def from_metrics(
+        cls, metrics: Iterable[MetricRecord | Dict[str, Any]], duration_field: str = "value"
+    ) -> ColumnarBatch:
+        batch = cls(duration_field)
+        for metric in metrics:
+            batch.append(metric)
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+    def append(self, metric: MetricRecord | Dict[str, Any]) -> None:
+        """Add a metric, either a `MetricRecord` or a dict."""
+        if isinstance(metric, MetricRecord):
+            if metric.extra is None and metric.duration_field == self.duration_field:
+                extra: Optional[Dict[str, Any]] = None if metric.cpu_time is None else {"cpu_time": metric.cpu_time}
+                if metric.span_id is not None:
+                    extra = extra or {}
+                    extra["span_id"] = metric.span_id
+                    if metric.parent_id is not None:
+                        extra["parent_id"] = metric.parent_id
+                    extra["self_time"] = metric.self_time
+                self._append(
+                    metric.name,
+                    metric.hostname,
+                    metric.origin,
+                    metric.duration,
+                    metric.timestamp_ns,
+                    metric.sample_weight,
+                    extra,
+                )
+                return
+            fields = metric.to_dict()
+        else:
+            fields = dict(metric)
+        self._append(
+            fields.pop("name", None),
+            fields.pop("hostname", None),
+            fields.pop("origin", None),
+            _pop_number(fields, self.duration_field),
+            fields.pop(TIMESTAMP_NS, None),
+            _pop_number(fields, "sample_weight"),
+            fields or None,
+        )
+
+    def _append(
+        self,
+        name: Optional[str],
+        hostname: Optional[str],
+        origin: Optional[str],
+        duration: Optional[float],
+        timestamp_ns: Optional[int],
+        sample_weight: Optional[float],
+        extra: Optional[Dict[str, Any]],
+    ) -> None:
+        self.name_codes.append(_encode(self.names, self._name_index, name))
+        self.hostname_codes.append(_encode(self.hostnames, self._hostname_index, hostname))
+        self.origin_codes.append(_encode(self.origins, self._origin_index, origin))
+        self.durations.append(NAN if duration is None else duration)
+        self.timestamps_ns.append(-1 if timestamp_ns is None else timestamp_ns)
+        self.sample_weights.append(NAN if sample_weight is None else sample_weight)
+        self.extras.append(extra)
+
+    def series(self) -> Dict[SeriesKey, Tuple[array, array]]:
+        """
+        Return the durations per series (`name`, `hostname`, `origin`), leaving out the missing ones, with
+        their sample weights (`1.0` for the metrics which weren't sampled).
+        """
+        columns: Dict[Tuple[int, int, int], Tuple[array, array]] = {}
+        for name_code, hostname_code, origin_code, duration, sample_weight in zip(
+            self.name_codes, self.hostname_codes, self.origin_codes, self.durations, self.sample_weights
+        ):
+            if duration != duration:  # NaN
+                continue
+            key = (name_code, hostname_code, origin_code)
+            series = columns.get(key)
+            if series is None:
+                series = columns[key] = (array("d"), array("d"))
+            series[0].append(duration)
+            series[1].append(sample_weight if sample_weight == sample_weight else 1.0)
+        return {
+            (self.names[name_code], self.hostnames[hostname_code], self.origins[origin_code]): series
+            for (name_code, hostname_code, origin_code), series in columns.items()
+        }
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Build the metrics as dicts, as `bulk_write` gets them (with a `timestamp`)."""
+        metrics = []
+        for i, extra in enumerate(self.extras):
+            metric: Dict[str, Any] = {"name": self.names[self.name_codes[i]]}
+            hostname = self.hostnames[self.hostname_codes[i]]
+            if hostname is not None:
+                metric["hostname"] = hostname
+            origin = self.origins[self.origin_codes[i]]
+            if origin is not None:
+                metric["origin"] = origin
+            duration = self.durations[i]
+            if duration == duration:
+                metric[self.duration_field] = duration
+            timestamp_ns = self.timestamps_ns[i]
+            if timestamp_ns != -1:
+                metric[TIMESTAMP_NS] = timestamp_ns
+            sample_weight = self.sample_weights[i]
+            if sample_weight == sample_weight:
+                metric["sample_weight"] = sample_weight
+            if extra:
+                metric.update(extra)
+            metrics.append(metric)
+        convert_timestamps(metrics)
+        return metrics
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """
+        Return the typed columns as NumPy arrays, which share the memory of the columns.
+
+        The batch can't grow whilst the arrays exist.
+        """
+        if numpy is None:
+            raise ImportError("ColumnarBatch.to_numpy() requires numpy, install timeexecution[numpy]")
+        return {
+            column: numpy.frombuffer(getattr(self, column), dtype=getattr(self, column).typecode)
+            for column in (
+                "name_codes",
+                "hostname_codes",
+                "origin_codes",
+                "durations",
+                "timestamps_ns",
+                "sample_weights",
+            )
+        }
+
+
+def _pop_number(fields: Dict[str, Any], key: str) -> Any:
+    # A value which isn't a number (e.g. written by hand) stays with the other fields, rather than in its column.
+    value = fields.get(key)
+    if isinstance(value, (int, float)):
+        return fields.pop(key)
+    return None
+
+
+def _encode(values: List[Optional[str]], index: Dict[Optional[str], int], value: Optional[str]) -> int:
+    code = index.get(value)
+    if code is None:
+        code = index[value] = len(values)
+        values.append(value)
+    return code
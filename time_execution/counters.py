@@ -0,0 +1,30 @@
+"""
+Counters which are cheap to increment from any thread.
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+
+
+class AtomicCounter:
+    """
+    Counter which is incremented without taking a lock.
+
+    `increment()` is the `__next__` of an `itertools.count`, which is atomic in CPython. Reading the value
+    also advances the count, so the reads are counted too, and subtracted, under a lock.
+    """
+
+    def __init__(self) -> None:
+        count = itertools.count()
+        self.increment = count.__next__
+        self._reads = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        with self._lock:
+            value = self.increment() - self._reads
+            self._reads += 1
+        return value
@@ -4,17 +4,79 @@ from __future__ import annotations
 
 from asyncio import iscoroutinefunction
 from collections.abc import Iterable
+from contextlib import nullcontext
 from functools import wraps
-from typing import Any, Callable, Dict, Generator, Optional, Tuple, TypeVar, cast
+from inspect import isasyncgenfunction, isgeneratorfunction
+from threading import RLock
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, Generator, Optional, Tuple, TypeVar, cast
+from weakref import WeakSet
 
 import fqn_decorators
 from pkgsettings import Settings
 from typing_extensions import Protocol, TypeAlias, overload
 
+if TYPE_CHECKING:
+    from time_execution.sampling import Sampler
+    from time_execution.timed import HookPlan
+
 _F = TypeVar("_F", bound=Callable[..., Any])
 
-settings = Settings()
-settings.configure(backends=(), hooks=(), duration_field="value")
+
+class _Settings(Settings):
+    """
+    Settings which notify the state derived from them (e.g. hook plans) whenever they change.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = RLock()
+        self._dependants: WeakSet[Any] = WeakSet()
+
+    def watch(self, dependant: Any) -> None:
+        """Call `dependant.invalidate()` on every change of the settings."""
+        self._dependants.add(dependant)
+
+    def configure(self, *args: Any, **kwargs: Any) -> None:
+        """Configure the settings, raising a `ValueError` (and ignoring them) if they're invalid."""
+        with self._lock:
+            layers = len(self._chain)
+            super().configure(*args, **kwargs)
+            if len(self._chain) > layers:
+                try:
+                    self._check()
+                except ValueError:
+                    self._chain.pop(0)
+                    raise
+            self._changed()
+
+    def _override_enable(self) -> None:
+        with self._lock:
+            super()._override_enable()
+            try:
+                self._check()
+            except ValueError:
+                super()._override_disable()
+                raise
+            self._changed()
+
+    def _check(self) -> None:
+        from time_execution.timed import check_settings  # work around the circular dependency
+
+        check_settings()
+
+    def _override_disable(self) -> None:
+        with self._lock:
+            super()._override_disable()
+            self._changed()
+
+    def _changed(self) -> None:
+        for dependant in list(self._dependants):
+            dependant.invalidate()
+
+
+settings = _Settings()
+# The defaults, which are valid, can't be checked yet: `time_execution.timed` depends on this module.
+Settings.configure(settings, backends=(), hooks=(), duration_field="value", duration_resolution="us")
 
 
 def write_metric(name: str, **metric: Any) -> None:
@@ -33,6 +95,7 @@ def time_execution(
     get_fqn: Callable[[Any], str] = fqn_decorators.get_fqn,
     extra_hooks: Optional[Iterable[Hook | GeneratorHook]] = None,
     disable_default_hooks: bool = False,
+    sampler: Optional[Sampler] = None,
 ) -> Callable[[_F], _F]:
     """
     Second-order (parametrized) decorator.
@@ -41,20 +104,66 @@ def time_execution(
         get_fqn: custom FQN getter (uses `fqn-decorators` by default)
         extra_hooks: additional hooks (next to defined in the settings)
         disable_default_hooks: if `True`, disable the hooks set by the settings
+        sampler: decides which calls are timed (overrides the sampler set by the settings)
     """
 
 
 def time_execution(__wrapped=None, get_fqn: Callable[[Any], str] = fqn_decorators.get_fqn, **kwargs):
-    from time_execution.timed import Timed, TimedAsync  # work around the circular dependency
+    # work around the circular dependency
+    from time_execution.timed import HookPlan, Timed, TimedAsync, TimedAsyncGenerator, TimedGenerator
 
     def wrap(__wrapped: _F) -> _F:
         fqn = get_fqn(__wrapped)
+        hook_plan = HookPlan(**kwargs)
+
+        if isgeneratorfunction(__wrapped) or isasyncgenfunction(__wrapped):
+            # The iteration is timed rather than the call, which only creates the generator.
+            timed_class = TimedGenerator if isgeneratorfunction(__wrapped) else TimedAsyncGenerator
 
-        if not iscoroutinefunction(__wrapped):
+            @wraps(__wrapped)
+            def wrapper(*call_args, **call_kwargs):
+                active = hook_plan.active
+                if active is None:
+                    active = hook_plan.refresh()
+                if not active:
+                    return __wrapped(*call_args, **call_kwargs)
+                sampler, sample_weight = hook_plan.sampler, None
+                if sampler is not None:
+                    sample_weight = sampler.sample(fqn)
+                    if not sample_weight:
+                        return __wrapped(*call_args, **call_kwargs)
+                timed = timed_class(
+                    wrapped=__wrapped,
+                    call_args=call_args,
+                    call_kwargs=call_kwargs,
+                    fqn=fqn,
+                    hook_plan=hook_plan,
+                    sample_weight=sample_weight,
+                )
+                return timed.run(__wrapped(*call_args, **call_kwargs))
+
+        elif not iscoroutinefunction(__wrapped):
 
             @wraps(__wrapped)
             def wrapper(*call_args, **call_kwargs):
-                with Timed(wrapped=__wrapped, call_args=call_args, call_kwargs=call_kwargs, fqn=fqn, **kwargs) as timed:
+                active = hook_plan.active
+                if active is None:
+                    active = hook_plan.refresh()
+                if not active:
+                    return __wrapped(*call_args, **call_kwargs)
+                sampler, sample_weight = hook_plan.sampler, None
+                if sampler is not None:
+                    sample_weight = sampler.sample(fqn)
+                    if not sample_weight:
+                        return __wrapped(*call_args, **call_kwargs)
+                with Timed(
+                    wrapped=__wrapped,
+                    call_args=call_args,
+                    call_kwargs=call_kwargs,
+                    fqn=fqn,
+                    hook_plan=hook_plan,
+                    sample_weight=sample_weight,
+                ) as timed:
                     timed.result = __wrapped(*call_args, **call_kwargs)
                     return timed.result
 
@@ -62,8 +171,23 @@ def time_execution(__wrapped=None, get_fqn: Callable[[Any], str] = fqn_decorator
 
             @wraps(__wrapped)
             async def wrapper(*call_args, **call_kwargs):
+                active = hook_plan.active
+                if active is None:
+                    active = hook_plan.refresh()
+                if not active:
+                    return await __wrapped(*call_args, **call_kwargs)
+                sampler, sample_weight = hook_plan.sampler, None
+                if sampler is not None:
+                    sample_weight = sampler.sample(fqn)
+                    if not sample_weight:
+                        return await __wrapped(*call_args, **call_kwargs)
                 async with TimedAsync(
-                    wrapped=__wrapped, call_args=call_args, call_kwargs=call_kwargs, fqn=fqn, **kwargs
+                    wrapped=__wrapped,
+                    call_args=call_args,
+                    call_kwargs=call_kwargs,
+                    fqn=fqn,
+                    hook_plan=hook_plan,
+                    sample_weight=sample_weight,
                 ) as timed:
                     timed.result = await __wrapped(*call_args, **call_kwargs)
                     return timed.result
@@ -79,6 +203,43 @@ def time_execution(__wrapped=None, get_fqn: Callable[[Any], str] = fqn_decorator
 # `time_execution` supports async out of the box.
 time_execution_async = time_execution
 
+# The hook plan of the blocks timed by `span`, created on first use.
+_span_plan: Optional[HookPlan] = None
+
+
+def span(name: str) -> ContextManager[Any]:
+    """
+    Time a block of code like a call of a decorated function, with `name` as the name of the metric.
+
+    With the `spans` setting, the block is nested like a call: it's a child of the timed call it's in,
+    and the parent of the calls timed within it. The hooks get `func=None`, and neither the response
+    nor the arguments.
+    """
+    from time_execution.timed import HookPlan, Timed  # work around the circular dependency
+
+    global _span_plan
+    hook_plan = _span_plan
+    if hook_plan is None:
+        hook_plan = _span_plan = HookPlan()
+    active = hook_plan.active
+    if active is None:
+        active = hook_plan.refresh()
+    if not active:
+        return nullcontext()
+    sampler, sample_weight = hook_plan.sampler, None
+    if sampler is not None:
+        sample_weight = sampler.sample(name)
+        if not sample_weight:
+            return nullcontext()
+    return Timed(
+        wrapped=None,
+        call_args=(),
+        call_kwargs={},
+        fqn=name,
+        hook_plan=hook_plan,
+        sample_weight=sample_weight,
+    )
+
 
 class Hook(Protocol):
     """Hook callback protocol."""
@@ -0,0 +1,192 @@
+"""
+Hooks which run after the timed call returned, off the caller's thread.
+
+A hook wrapped with `deferred` doesn't add to the latency of the call: the decorator only captures the inputs
+the hook declares it needs, and the hook runs later, with the fields it returns added to the metric before
+it's sent. When the only backend is a `ThreadedBackend`, its worker runs the hook; otherwise a thread of
+time_execution's own, which then writes the metric to the backends.
+
+Generator hooks start before the call, and coroutine hooks are awaited by the call, so they stay inline,
+even when wrapped with `deferred`.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from time_execution.records import MetricRecord
+
+logger = logging.getLogger(__name__)
+
+# Number of records waiting for the pool, beyond which the hooks run on the caller's thread again.
+MAX_PENDING = 10000
+
+# The inputs of a hook, which a deferred hook may need.
+HOOK_INPUTS = ("response", "exception", "metric", "func", "func_args", "func_kwargs")
+
+# Inputs given to a deferred hook which doesn't need them.
+_NOT_CAPTURED = dict.fromkeys(HOOK_INPUTS)
+
+
+class DeferredHook:
+    """
+    A hook to run off the caller's thread, see `deferred`.
+
+    Args:
+        hook: the hook
+        needs: the inputs of the hook to capture, the others are `None`
+    """
+
+    __slots__ = ("hook", "needs")
+
+    def __init__(self, hook: Callable[..., Any], needs: Iterable[str] = HOOK_INPUTS) -> None:
+        needs = tuple(needs)
+        unknown = set(needs).difference(HOOK_INPUTS)
+        if unknown:
+            raise ValueError("unknown hook inputs: %s" % ", ".join(sorted(unknown)))
+        self.hook = hook
+        self.needs = needs
+
+    def __call__(self, **kwargs: Any) -> Any:
+        # Inline, e.g. a generator hook.
+        return self.hook(**kwargs)
+
+    def __repr__(self) -> str:
+        return "deferred(%r, needs=%r)" % (self.hook, self.needs)
+
+    def run(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.hook(**{**_NOT_CAPTURED, **inputs})
+
+
+def deferred(hook: Optional[Callable[..., Any]] = None, *, needs: Iterable[str] = HOOK_INPUTS) -> Any:
+    """
+    Mark a hook to run off the caller's thread, as `deferred(hook, needs=...)` or as a decorator.
+
+    The captured inputs are kept until the hook runs: the `response`, `func_args` and `func_kwargs` must
+    not be changed in the meantime. The hook gets a copy of the `metric`, before the fields of the deferred
+    hooks are added.
+
+    Args:
+        hook: the hook
+        needs: the inputs of the hook to capture (`"response"`, `"exception"`, `"metric"`, `"func"`,
+            `"func_args"`, `"func_kwargs"`), the others are `None`. All of them by default.
+    """
+    if hook is None:
+        return lambda hook: DeferredHook(hook, needs)
+    return DeferredHook(hook, needs)
+
+
+def capture(
+    hook: DeferredHook,
+    response: Any,
+    exception: Optional[BaseException],
+    metric: Dict[str, Any],
+    func: Optional[Callable[..., Any]],
+    func_args: Tuple[Any, ...],
+    func_kwargs: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Return the inputs which the hook needs."""
+    available = {
+        "response": response,
+        "exception": exception,
+        "metric": metric,
+        "func": func,
+        "func_args": func_args,
+        "func_kwargs": func_kwargs,
+    }
+    return {name: available[name] for name in hook.needs}
+
+
+def run_deferred_hooks(record: MetricRecord) -> None:
+    """Run the deferred hooks of a record, and add the fields they return to it."""
+    hooks = record.deferred
+    if hooks is None:
+        return
+    record.deferred = None
+    fields: Dict[str, Any] = {}
+    for hook, inputs in hooks:
+        try:
+            result = hook.run(inputs)
+        except Exception:
+            logger.exception("deferred hook %r failed", hook)
+            continue
+        if result:
+            fields.update(result)
+    if fields:
+        if record.extra is None:
+            record.extra = fields
+        else:
+            record.extra.update(fields)
+
+
+class _Pool:
+    """A single thread running the deferred hooks in order, started on first use."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = threading.BoundedSemaphore(MAX_PENDING)
+
+    def executor(self) -> ThreadPoolExecutor:
+        executor = self._executor
+        if executor is None:
+            with self._lock:
+                executor = self._executor
+                if executor is None:
+                    executor = self._executor = ThreadPoolExecutor(1, thread_name_prefix="TimeExecutionHooks")
+        return executor
+
+    def reset(self) -> None:
+        # The thread of the parent process doesn't exist in a forked child.
+        self._lock = threading.Lock()
+        self._executor = None
+        self.pending = threading.BoundedSemaphore(MAX_PENDING)
+
+
+_pool = _Pool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_pool.reset)
+
+
+def _run_and_write(record: MetricRecord, write: Callable[[MetricRecord], None], pending: threading.Semaphore) -> None:
+    pending.release()
+    run_deferred_hooks(record)
+    try:
+        write(record)
+    except Exception:
+        logger.exception("writing %r failed", record)
+
+
+def submit(record: MetricRecord, write: Callable[[MetricRecord], None]) -> None:
+    """
+    Run the deferred hooks of a record on the pool, then `write` it. When the pool can't keep up, with
+    `MAX_PENDING` records waiting, they run straight away instead.
+    """
+    pending = _pool.pending
+    if not pending.acquire(False):
+        run_deferred_hooks(record)
+        write(record)
+        return
+    _pool.executor().submit(_run_and_write, record, write, pending)
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """
+    Wait until the records submitted to the pool so far are written.
+
+    Args:
+        timeout: maximum number of seconds to wait
+
+    Returns:
+        whether they were written in time
+    """
+    if _pool._executor is None:
+        return True
+    done = threading.Event()
+    _pool.executor().submit(done.set)
+    return done.wait(timeout)
@@ -0,0 +1,122 @@
+"""
+Queues connecting the producers of metrics with the worker of a `ThreadedBackend`.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from queue import Empty, Full
+from time import monotonic, sleep
+from typing import Any, Deque, Optional
+
+
+class RingBufferQueue:
+    """
+    Bounded in-process queue for any number of producers and a single consumer.
+
+    Producers don't take any lock: appending to a `deque` is atomic, and the consumer is only signalled
+    when it may be waiting for an item, or for a number of items with `wait`. Under contention, the queue
+    can exceed `maxsize` by at most the number of concurrent producers. It implements the subset of the
+    `queue.Queue` API which is used by the `ThreadedBackend`, and unlike `multiprocessing.Queue`, items are
+    neither pickled nor sent through a pipe.
+
+    Args:
+        maxsize: maximum number of items, unbounded if `0`
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        self.maxsize = maxsize
+        self._items: Deque[Any] = deque()
+        self._not_empty = threading.Event()
+        # Number of items the consumer waits for.
+        self._wake_at = 1
+
+    def put_nowait(self, item: Any) -> None:
+        items = self._items
+        if 0 < self.maxsize <= len(items):
+            raise Full
+        items.append(item)
+        if len(items) >= self._wake_at and not self._not_empty.is_set():
+            self._not_empty.set()
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        Put the item in the queue, waiting up to `timeout` seconds for a free slot if `block` is set.
+
+        The consumer doesn't signal free slots, so the producer polls for one with a growing interval:
+        the worker drains the queue in bulk, and a producer only waits when the queue is full.
+        """
+        try:
+            return self.put_nowait(item)
+        except Full:
+            if not block:
+                raise
+
+        deadline = None if timeout is None else monotonic() + timeout
+        interval = 0.0005
+        while True:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                raise Full
+            sleep(interval if remaining is None else min(interval, remaining))
+            interval = min(interval * 2, 0.01)
+            try:
+                return self.put_nowait(item)
+            except Full:
+                pass
+
+    def get_nowait(self) -> Any:
+        try:
+            return self._items.popleft()
+        except IndexError:
+            raise Empty from None
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        try:
+            return self._items.popleft()
+        except IndexError:
+            if not block:
+                raise Empty from None
+
+        deadline = None if timeout is None else monotonic() + timeout
+        self._wake_at = 1
+        while True:
+            self._not_empty.clear()
+            # Check again after clearing the flag, otherwise the signal of an item appended in the meantime is lost.
+            try:
+                return self._items.popleft()
+            except IndexError:
+                pass
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                raise Empty
+            self._not_empty.wait(remaining)
+
+    def wait(self, count: int, timeout: Optional[float] = None) -> bool:
+        """
+        Wait up to `timeout` seconds until the queue holds `count` items, or `wake()` is called.
+
+        Unlike `get`, the producers only signal the consumer once, when the last of the items is put.
+        Returns whether the queue holds the items.
+        """
+        self._wake_at = count
+        self._not_empty.clear()
+        # Check after clearing the flag, like `get`.
+        if len(self._items) < count:
+            self._not_empty.wait(timeout)
+        self._wake_at = 1
+        return len(self._items) >= count
+
+    def wake(self) -> None:
+        """Wake up the consumer, e.g. after putting an item it should handle right away."""
+        self._not_empty.set()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._items)
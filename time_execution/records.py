@@ -0,0 +1,123 @@
+"""
+Compact record of a timed call, used instead of a dict on the hot path.
+
+The decorator stores the core fields of a metric in the slots of a `MetricRecord`. A backend with
+`accepts_records = True` receives the record itself through `write_record`, e.g. the `ThreadedBackend` which
+only queues it; the dict is then built when the metric is serialized, off the caller's thread.
+Other backends get the dict through `write`, as before.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from time_execution.timestamps import TIMESTAMP_NS
+
+# Optional core fields, left out of the dict whilst `None`.
+_OPTIONAL_FIELDS = ("cpu_time", "origin", "sample_weight", "span_id", "parent_id", "self_time")
+
+
+class MetricRecord:
+    """
+    The metric of a timed call.
+
+    `extra` holds the fields added by the hooks, it's only set when there are any. As the hooks may also
+    change the core fields, the fields of `extra` take precedence over the slots. The span fields are only
+    set with the `spans` setting, see `time_execution.spans`. `deferred` holds the deferred hooks still to
+    run with their inputs, see `time_execution.deferred`.
+    """
+
+    __slots__ = (
+        "name",
+        "duration",
+        "duration_field",
+        "hostname",
+        "timestamp_ns",
+        "cpu_time",
+        "origin",
+        "sample_weight",
+        "extra",
+        "span_id",
+        "parent_id",
+        "self_time",
+        "deferred",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        duration: float,
+        duration_field: str,
+        hostname: str,
+        timestamp_ns: int,
+        cpu_time: Optional[float] = None,
+        origin: Optional[str] = None,
+        sample_weight: Optional[float] = None,
+        extra: Optional[Dict[str, Any]] = None,
+        span_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        self_time: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.duration = duration
+        self.duration_field = duration_field
+        self.hostname = hostname
+        self.timestamp_ns = timestamp_ns
+        self.cpu_time = cpu_time
+        self.origin = origin
+        self.sample_weight = sample_weight
+        self.extra = extra
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.self_time = self_time
+        self.deferred: Optional[List[Tuple[Any, Dict[str, Any]]]] = None
+
+    def __repr__(self) -> str:
+        return "MetricRecord(%r)" % (self.to_dict(),)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, MetricRecord):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value of a field like `dict.get`, without building the dict."""
+        extra = self.extra
+        if extra is not None and key in extra:
+            return extra[key]
+        if key == self.duration_field:
+            return self.duration
+        if key == "name":
+            return self.name
+        if key == "hostname":
+            return self.hostname
+        if key == TIMESTAMP_NS:
+            return self.timestamp_ns
+        if key in _OPTIONAL_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Build the dict of the metric, as written to the backends which don't accept records."""
+        metric = {
+            self.duration_field: self.duration,
+            "hostname": self.hostname,
+            "name": self.name,
+            TIMESTAMP_NS: self.timestamp_ns,
+        }
+        if self.cpu_time is not None:
+            metric["cpu_time"] = self.cpu_time
+        if self.origin:
+            metric["origin"] = self.origin
+        if self.sample_weight is not None:
+            metric["sample_weight"] = self.sample_weight
+        if self.span_id is not None:
+            metric["span_id"] = self.span_id
+            if self.parent_id is not None:
+                metric["parent_id"] = self.parent_id
+            metric["self_time"] = self.self_time
+        if self.extra:
+            metric.update(self.extra)
+        return metric
@@ -0,0 +1,111 @@
+"""
+Samplers decide which calls of a decorated function are timed.
+
+A sampler returns the weight of a timed call (how many calls the emitted metric stands for),
+or `0` when the call must not be timed at all.
+"""
+
+from __future__ import annotations
+
+import threading
+from random import random
+from time import monotonic
+from typing import Callable, Dict
+
+
+class Sampler:
+    def sample(self, name: str) -> float:
+        raise NotImplementedError
+
+
+class FixedRateSampler(Sampler):
+    """
+    Times the given fraction of the calls.
+
+    Args:
+        rate: probability of a call to be timed, `0 < rate <= 1`
+    """
+
+    def __init__(self, rate: float) -> None:
+        if not 0.0 < rate <= 1.0:
+            raise ValueError(f"sample rate must be in (0, 1], got {rate!r}")
+        self.rate = rate
+        self._weight = 1.0 / rate
+
+    def sample(self, name: str) -> float:
+        return self._weight if random() < self.rate else 0.0
+
+
+class _Window:
+    __slots__ = ("start", "seen", "kept", "rate")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.seen = 0
+        self.kept = 0
+        self.rate = 1.0
+
+
+class AdaptiveSampler(Sampler):
+    """
+    Keeps the number of timed calls of every name below `target` per second.
+
+    The sampling rate of a name is derived from its arrival rate in the previous window. When the budget
+    of a window runs out earlier (e.g. because of a burst), the rate is recalculated straight away.
+
+    Args:
+        target: maximum number of timed calls per second and name
+        window: length of the window, in seconds, over which the arrival rate is measured
+        max_names: maximum number of names tracked. Beyond it, the names without a call in the last window
+            are forgotten, or all of them if there are none, and start over at a rate of 1.
+    """
+
+    def __init__(
+        self, target: float, window: float = 1.0, clock: Callable[[], float] = monotonic, max_names: int = 10000
+    ) -> None:
+        if target <= 0:
+            raise ValueError(f"target must be positive, got {target!r}")
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window!r}")
+        self.target = target
+        self.window = window
+        self._budget = target * window
+        self._clock = clock
+        self.max_names = max_names
+        self._windows: Dict[str, _Window] = {}
+        self._lock = threading.Lock()
+
+    def sample(self, name: str) -> float:
+        now = self._clock()
+        with self._lock:
+            window = self._windows.get(name)
+            if window is None:
+                if len(self._windows) >= self.max_names:
+                    self._evict(now)
+                window = self._windows[name] = _Window(now)
+
+            elapsed = now - window.start
+            if elapsed >= self.window or (window.kept >= self._budget and elapsed > 0.0):
+                arrival_rate = window.seen / elapsed
+                window.rate = min(1.0, self.target / arrival_rate) if arrival_rate else 1.0
+                window.start = now
+                window.seen = window.kept = 0
+
+            window.seen += 1
+            rate = window.rate
+            if rate < 1.0 and random() >= rate:
+                return 0.0
+            window.kept += 1
+            return 1.0 / rate
+
+    def _evict(self, now: float) -> None:
+        idle = [name for name, window in self._windows.items() if now - window.start >= self.window]
+        if not idle:
+            self._windows.clear()
+        for name in idle:
+            del self._windows[name]
+
+    def rate(self, name: str) -> float:
+        """Current sampling rate of the name."""
+        window = self._windows.get(name)
+        return window.rate if window is not None else 1.0
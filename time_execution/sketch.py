@@ -0,0 +1,136 @@
+"""
+Mergeable quantile sketch with relative-error guarantees, in the style of DDSketch.
+
+Values are counted in logarithmically sized bins: bin `i` holds values in `(gamma ** (i - 1), gamma ** i]` with
+`gamma = (1 + alpha) / (1 - alpha)`, so any quantile is estimated within the relative accuracy `alpha`.
+Since a sketch consists of counts only, merging sketches with the same parameters is exact. The counts are
+integers, unless weighted values (e.g. sampled calls) are added.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Iterable, Optional
+
+
+class DDSketch:
+    """
+    Args:
+        relative_accuracy: relative error of the estimated quantiles
+        max_bins: maximum number of bins; when exceeded, the lowest bins are collapsed into one, which
+            keeps the memory bounded at the cost of accuracy of the lowest quantiles only
+    """
+
+    __slots__ = ("relative_accuracy", "max_bins", "bins", "zero_count", "count", "sum", "min", "max", "_log_gamma")
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048) -> None:
+        if not 0.0 < relative_accuracy < 1.0:
+            raise ValueError(f"relative accuracy must be in (0, 1), got {relative_accuracy!r}")
+        if max_bins < 1:
+            raise ValueError(f"max_bins must be positive, got {max_bins!r}")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._log_gamma = math.log((1.0 + relative_accuracy) / (1.0 - relative_accuracy))
+        self.bins: Dict[int, float] = {}
+        self.zero_count: float = 0
+        self.count: float = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: float = 1) -> None:
+        """Add a value, `count` times, which may be a fractional weight."""
+        if value > 0.0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            bins = self.bins
+            if index in bins:
+                bins[index] += count
+            else:
+                bins[index] = count
+                if len(bins) > self.max_bins:
+                    self._collapse()
+        else:
+            # Durations can't be negative, so everything else is accounted for as zero.
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: DDSketch) -> None:
+        """Add the values counted by the other sketch."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        bins = self.bins
+        for index, count in other.bins.items():
+            bins[index] = bins.get(index, 0) + count
+        if len(bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the `q`-quantile (`0 <= q <= 1`), `None` for an empty sketch."""
+        if not self.count:
+            return None
+        if q <= 0.0:
+            return self.min
+        if q >= 1.0:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Representative value of the bin, within the relative accuracy of any value in it.
+                value = 2.0 * math.exp(index * self._log_gamma) / (1.0 + math.exp(self._log_gamma))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        indexes = sorted(self.bins)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "indexes": indexes,
+            "counts": [self.bins[index] for index in indexes],
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], max_bins: int = 2048) -> DDSketch:
+        sketch = cls(relative_accuracy=data["relative_accuracy"], max_bins=max_bins)
+        sketch.bins = dict(zip(data["indexes"], data["counts"]))
+        if len(sketch.bins) > max_bins:
+            sketch._collapse()
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+    @classmethod
+    def of(cls, values: Iterable[float], **kwargs: Any) -> DDSketch:
+        sketch = cls(**kwargs)
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def _collapse(self) -> None:
+        indexes = sorted(self.bins)
+        excess = indexes[: len(indexes) - self.max_bins]
+        target = indexes[len(excess)]
+        collapsed = sum(self.bins.pop(index) for index in excess)
+        self.bins[target] = self.bins.get(target, 0) + collapsed
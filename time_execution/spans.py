@@ -0,0 +1,108 @@
+"""
+Nesting of the timed calls, with the `spans` setting.
+
+Every timed call (or block, see `time_execution.span`) is a span, which is the current span whilst it runs,
+in a `ContextVar`. The span of a call made meanwhile is its child: the metric of the child has the `span_id`
+of its parent as `parent_id`, and the time spent in the children is subtracted from the duration of the
+parent, as its `self_time`.
+
+An asyncio task inherits the current span from the code which creates it. A thread doesn't, unless it runs in
+a copy of its creator's context (`contextvars.copy_context().run`), so its spans are roots otherwise.
+"""
+
+from __future__ import annotations
+
+import threading
+from contextvars import ContextVar, Token
+from random import getrandbits
+from typing import Optional, Tuple
+
+# Guards the accounting of the children, which may finish in other threads.
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed call, whilst it runs.
+
+    Concurrent children (e.g. tasks gathered by the parent) overlap: the child time is the time during which
+    at least one child ran, so the self-time of the parent is never negative. The children are counted rather
+    than stored, so a parent with countless children takes no more memory.
+    """
+
+    __slots__ = ("span_id", "parent", "parent_id", "_running", "_busy_since", "_child_ns")
+
+    def __init__(self, parent: Optional[Span]) -> None:
+        self.span_id = "%016x" % getrandbits(64)
+        self.parent = parent
+        self.parent_id = None if parent is None else parent.span_id
+        self._running = 0
+        self._busy_since = 0
+        self._child_ns = 0
+
+    def child_started(self, now_ns: int) -> None:
+        with _lock:
+            if not self._running:
+                self._busy_since = now_ns
+            self._running += 1
+
+    def child_finished(self, now_ns: int) -> None:
+        with _lock:
+            self._running -= 1
+            if not self._running:
+                self._child_ns += now_ns - self._busy_since
+
+    def child_time_ns(self, now_ns: int) -> int:
+        """Return the time spent in the children until `now_ns`, including the ones still running."""
+        if not self._running and not self._child_ns:
+            # No children (yet), as for most spans.
+            return 0
+        with _lock:
+            if self._running:
+                return self._child_ns + now_ns - self._busy_since
+            return self._child_ns
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("time_execution_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Return the span of the timed call being run, e.g. to log its `span_id`."""
+    return _current_span.get()
+
+
+def enter_span(start_ns: int) -> Tuple[Span, Token[Optional[Span]]]:
+    """Start a span at `start_ns` (`perf_counter_ns`), as a child of the current one, and make it current."""
+    parent = _current_span.get()
+    span = Span(parent)
+    if parent is not None:
+        parent.child_started(start_ns)
+    return span, _current_span.set(span)
+
+
+def activate_span(span: Span) -> Token[Optional[Span]]:
+    """Make a span current again, e.g. whilst a timed generator runs."""
+    return _current_span.set(span)
+
+
+def deactivate_span(span: Span, token: Token[Optional[Span]]) -> None:
+    """Make the span which was current before `activate_span` (or `enter_span`) current again."""
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Ended in another context than the one it was started in, e.g. a copy of it.
+        if _current_span.get() is span:
+            _current_span.set(span.parent)
+
+
+def exit_span(span: Span, token: Optional[Token[Optional[Span]]], end_ns: int) -> int:
+    """
+    End a span at `end_ns`, make its parent current again (unless `token` is `None`, when the span
+    isn't current), and return the time spent in its children.
+    """
+    if token is not None:
+        deactivate_span(span, token)
+    parent = span.parent
+    if parent is not None:
+        parent.child_finished(end_ns)
+    return span.child_time_ns(end_ns)
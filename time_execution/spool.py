@@ -0,0 +1,216 @@
+"""
+Append-only disk spool for the batches of metrics a `ThreadedBackend` fails to send.
+
+The batches are appended as records to memory-mapped segment files, which are replayed in order once
+the backend is available again. A record is a header (state, payload size, CRC32) followed by the JSON
+array of metrics; it only becomes visible when its state byte is set, after the rest has been written,
+so a record torn by a crash is ignored. Replaying a record only rewrites its state byte, and a segment
+is deleted when all its records have been replayed.
+
+Since the pages of a memory map are written back by the kernel, the spool survives a crash or restart
+of the process, not of the machine.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Iterator, List, Optional, Tuple
+
+from time_execution.timestamps import json_default
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("!BII")
+SEGMENT_SUFFIX = ".spool"
+
+_EMPTY, _PENDING, _REPLAYED = 0, 1, 2
+
+
+class _Segment:
+    def __init__(self, path: str, size: Optional[int] = None) -> None:
+        self.path = path
+        created = size is not None
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if size is None:
+                size = os.fstat(fd).st_size
+            elif hasattr(os, "posix_fallocate"):
+                # Writing to a page of the map which has no disk space raises SIGBUS, so allocate it all
+                # up front, where a full disk raises an `OSError` instead.
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size)
+        except OSError:
+            if created:
+                os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+        self.size = size
+        self.offset = 0
+        self.pending = 0
+        for _, state, _ in self._scan():
+            if state == _PENDING:
+                self.pending += 1
+
+    def _scan(self) -> Iterator[Tuple[int, int, bytes]]:
+        # Also moves `offset` to the end of the last complete record.
+        offset = 0
+        while offset + RECORD_HEADER.size <= self.size:
+            state, length, checksum = RECORD_HEADER.unpack_from(self.mmap, offset)
+            end = offset + RECORD_HEADER.size + length
+            if state == _EMPTY or end > self.size:
+                break
+            payload = self.mmap[offset + RECORD_HEADER.size : end]
+            if zlib.crc32(payload) != checksum:
+                break
+            yield offset, state, payload
+            offset = end
+        self.offset = offset
+
+    def records(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield the offsets and payloads of the records which are still to be replayed."""
+        for offset, state, payload in self._scan():
+            if state == _PENDING:
+                yield offset, payload
+
+    def append(self, payload: bytes) -> bool:
+        end = self.offset + RECORD_HEADER.size + len(payload)
+        if end > self.size:
+            return False
+        self.mmap[self.offset + RECORD_HEADER.size : end] = payload
+        RECORD_HEADER.pack_into(self.mmap, self.offset, _EMPTY, len(payload), zlib.crc32(payload))
+        self.mmap[self.offset] = _PENDING
+        self.offset = end
+        self.pending += 1
+        return True
+
+    def mark_replayed(self, offset: int) -> None:
+        self.mmap[offset] = _REPLAYED
+        self.pending -= 1
+
+    def close(self) -> None:
+        if not self.mmap.closed:
+            self.mmap.flush()
+            self.mmap.close()
+
+    def remove(self) -> None:
+        self.close()
+        os.unlink(self.path)
+
+
+class DiskSpool:
+    """
+    Spools batches of metrics to a directory, to be replayed when the backend is available again.
+
+    Only one process can use the directory at a time. Replayed metrics have their dates as ISO 8601 strings.
+
+    Args:
+        directory: directory of the segment files, created if it doesn't exist
+        max_bytes: maximum size of all segments together, the oldest segments are discarded beyond it
+        segment_size: size of a segment file, or of a single batch if that's larger
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, segment_size: int = 1024 * 1024) -> None:
+        if segment_size > max_bytes:
+            raise ValueError("segment_size can't exceed max_bytes")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+
+        self._lock_file = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError("The spool directory %s is used by another process" % directory) from None
+
+        self._segments: Deque[_Segment] = deque()
+        self._active: Optional[_Segment] = None
+        self._sequence = 0
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(SEGMENT_SUFFIX):
+                continue
+            self._sequence = max(self._sequence, int(filename[: -len(SEGMENT_SUFFIX)]))
+            path = os.path.join(directory, filename)
+            if not os.path.getsize(path):
+                os.unlink(path)  # created right before a crash
+                continue
+            segment = _Segment(path)
+            if segment.pending:
+                self._segments.append(segment)
+            else:
+                segment.remove()
+
+    @property
+    def pending(self) -> int:
+        """Number of batches which are still to be replayed."""
+        return sum(segment.pending for segment in self._segments)
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def append(self, metrics: List[dict]) -> None:
+        payload = json.dumps(metrics, separators=(",", ":"), default=json_default).encode()
+        if self._active is None or not self._active.append(payload):
+            size = max(self.segment_size, RECORD_HEADER.size + len(payload))
+            if size > self.max_bytes:
+                logger.warning("Discard %d metrics, the batch exceeds the size of the spool", len(metrics))
+                return
+            self._discard(self.max_bytes - size)
+            self._sequence += 1
+            path = os.path.join(self.directory, "%012d%s" % (self._sequence, SEGMENT_SUFFIX))
+            self._active = _Segment(path, size)
+            self._segments.append(self._active)
+            self._active.append(payload)
+
+    def _discard(self, max_bytes: int) -> None:
+        while self._segments and self.size > max_bytes:
+            segment = self._segments.popleft()
+            logger.warning("Discard %d spooled batches, the spool is full", segment.pending)
+            if segment is self._active:
+                self._active = None
+            segment.remove()
+
+    def replay(self, send: Callable[[List[dict]], Any]) -> bool:
+        """
+        Send the spooled batches in order, until `send` raises an exception.
+
+        Returns whether all the batches have been replayed.
+        """
+        while self._segments:
+            segment = self._segments[0]
+            for offset, payload in segment.records():
+                try:
+                    send(json.loads(payload))
+                except Exception as exc:
+                    logger.warning("replaying spooled metrics failure %r", exc)
+                    return False
+                segment.mark_replayed(offset)
+            self._segments.popleft()
+            if segment is self._active:
+                self._active = None
+            segment.remove()
+        return True
+
+    def flush(self) -> None:
+        """Write the segments back to disk."""
+        for segment in self._segments:
+            segment.mmap.flush()
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+        self._active = None
+        self._lock_file.close()
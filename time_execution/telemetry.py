@@ -0,0 +1,116 @@
+"""
+Telemetry of time_execution itself: what timing the calls and sending the metrics costs.
+
+The telemetry is off by default. Once enabled, the decorator, the `ThreadedBackend` and the
+`ElasticsearchBackend` record their statistics, which can be read with `telemetry.snapshot()` or sent
+periodically as metrics named `time_execution.<statistic>`. That prefix is reserved for these metrics.
+
+Durations are in milliseconds. Sending the telemetry goes straight to the backends, so it's never timed
+or hooked itself.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "time_execution."
+
+
+class Telemetry:
+    """
+    Statistics (count, sum, min and max of the recorded values) and gauges (read on every snapshot).
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._stop = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def record(self, name: str, value: float) -> None:
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                self._stats[name] = [1, value, value, value]
+                return
+            stat[0] += 1
+            stat[1] += value
+            if value < stat[2]:
+                stat[2] = value
+            if value > stat[3]:
+                stat[3] = value
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """Register a callable which reads the current value of a gauge, e.g. the size of a queue."""
+        self._gauges[name] = read
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, float]]:
+        """
+        Get the statistics recorded since they were last reset, and the current values of the gauges.
+
+        Args:
+            reset: start the statistics over
+        """
+        with self._lock:
+            stats = self._stats
+            if reset:
+                self._stats = {}
+            else:
+                stats = {name: list(stat) for name, stat in stats.items()}
+
+        snapshot = {
+            name: {"count": count, "sum": total, "min": minimum, "max": maximum}
+            for name, (count, total, minimum, maximum) in stats.items()
+        }
+        for name, read in list(self._gauges.items()):
+            try:
+                snapshot[name] = {"value": read()}
+            except Exception as exc:
+                logger.debug("reading gauge %s failure %r", name, exc)
+        return snapshot
+
+    def emit(self) -> None:
+        """Send the snapshot, starting the statistics over, as metrics to the backends."""
+        from time_execution import write_metric
+        from time_execution.timed import SHORT_HOSTNAME
+
+        for name, fields in self.snapshot(reset=True).items():
+            write_metric(PREFIX + name, hostname=SHORT_HOSTNAME, **fields)
+
+    def start(self, interval: float = 60) -> None:
+        """Enable the telemetry and send it every `interval` seconds from a background thread."""
+        self.enable()
+        if self.thread:
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self.emitter, args=(interval,), name="TimeExecutionTelemetryThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.thread:
+            self.thread.join()
+
+    def emitter(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.emit()
+            except Exception as exc:
+                logger.warning("sending the telemetry failure %r", exc)
+        self.thread = None
+
+
+telemetry = Telemetry()
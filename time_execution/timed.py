@@ -1,17 +1,197 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 from collections.abc import Iterable
 from contextlib import AbstractAsyncContextManager, AbstractContextManager
-from inspect import iscoroutinefunction, isgenerator, isgeneratorfunction
+from contextvars import Token
+from functools import partial
+from inspect import iscoroutinefunction, isgeneratorfunction
 from socket import gethostname
-from timeit import default_timer
+from time import perf_counter, perf_counter_ns, process_time_ns, thread_time_ns, time_ns
 from types import TracebackType
-from typing import Any, Callable, Dict, Optional, Tuple, Type, cast
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    cast,
+)
+
+from fqn_decorators import get_fqn
 
 from time_execution import GeneratorHook, GeneratorHookReturnType, Hook, settings, write_metric
+from time_execution.deferred import DeferredHook, capture, submit
+from time_execution.records import MetricRecord
+from time_execution.sampling import Sampler
+from time_execution.spans import Span, activate_span, deactivate_span, enter_span, exit_span
+from time_execution.telemetry import telemetry
+from time_execution.timestamps import convert_timestamps
+
+logger = logging.getLogger(__name__)
 
 SHORT_HOSTNAME = gethostname()
 
+# Kinds of hooks, see `HookPlan`.
+PLAIN_HOOK = 0
+GENERATOR_HOOK = 1
+COROUTINE_HOOK = 2
+DEFERRED_HOOK = 3
+
+HookSteps = Tuple[Tuple[int, Any], ...]
+
+# Number of decimals of the duration in milliseconds, per `duration_resolution` setting.
+DURATION_RESOLUTIONS = {"ms": 0, "us": 3, "ns": 6}
+
+# Clocks of the `cpu_time` setting.
+CPU_CLOCKS: Dict[Optional[str], Optional[Callable[[], int]]] = {
+    None: None,
+    "process": process_time_ns,
+    "thread": thread_time_ns,
+}
+
+
+def check_settings() -> None:
+    """Raise a `ValueError` for the settings which the decorator can't make sense of."""
+    if getattr(settings, "duration_resolution", "us") not in DURATION_RESOLUTIONS:
+        raise ValueError("duration_resolution must be one of %s" % ", ".join(DURATION_RESOLUTIONS))
+    if getattr(settings, "cpu_time", None) not in CPU_CLOCKS:
+        raise ValueError("cpu_time must be None, 'process' or 'thread'")
+
+
+def classify_hook(hook: Any) -> int:
+    if isinstance(hook, DeferredHook):
+        # Only plain hooks can run after the call.
+        kind = classify_hook(hook.hook)
+        return DEFERRED_HOOK if kind == PLAIN_HOOK else kind
+    if isgeneratorfunction(hook):
+        return GENERATOR_HOOK
+    if iscoroutinefunction(hook):
+        return COROUTINE_HOOK
+    return PLAIN_HOOK
+
+
+class HookPlan:
+    """
+    Hooks of a decorated function, classified once at decoration time instead of on every call.
+
+    The plan holds `(kind, hook)` steps in the order the hooks are applied, the deferred hooks apart, the
+    sampler to use, whether anybody is listening at all (any backend or hook), the settings which shape the
+    metric, which backends accept a `MetricRecord`, and which one runs the deferred hooks (if `None`, they
+    run on the pool of `time_execution.deferred`). The settings invalidate the plan when they change, it is
+    then rebuilt lazily.
+    """
+
+    __slots__ = (
+        "_extra_hooks",
+        "_disable_default_hooks",
+        "_default_hooks",
+        "_sampler",
+        "_steps",
+        "_deferred_hooks",
+        "active",
+        "sampler",
+        "duration_field",
+        "duration_decimals",
+        "origin",
+        "cpu_clock",
+        "spans",
+        "backends",
+        "accepts_records",
+        "defer_to",
+        "hook_timeout",
+        "total_hook_timeout",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        extra_hooks: Optional[Iterable[Hook | GeneratorHook]] = None,
+        disable_default_hooks: bool = False,
+        sampler: Optional[Sampler] = None,
+    ) -> None:
+        self._extra_hooks = tuple(extra_hooks or ())
+        self._disable_default_hooks = disable_default_hooks
+        self._sampler = sampler
+        self.sampler = sampler
+        self.duration_field = "value"
+        self.duration_decimals = DURATION_RESOLUTIONS["us"]
+        self.origin: Optional[str] = None
+        self.cpu_clock: Optional[Callable[[], int]] = None
+        self.spans = False
+        # `(accepts_records, backend)` pairs, in the order of the settings.
+        self.backends: Tuple[Tuple[bool, Any], ...] = ()
+        self.accepts_records = False
+        self.defer_to: Optional[Any] = None
+        self.hook_timeout: Optional[float] = None
+        self.total_hook_timeout: Optional[float] = None
+        self._default_hooks: Optional[Tuple[Any, ...]] = None
+        self._steps: HookSteps = ()
+        self._deferred_hooks: Tuple[DeferredHook, ...] = ()
+        # `None` until the plan is (re)built, `False` when calls don't need to be timed at all.
+        self.active: Optional[bool] = None
+        settings.watch(self)
+
+    @property
+    def steps(self) -> HookSteps:
+        if self.active is None:
+            self.refresh()
+        return self._steps
+
+    @property
+    def deferred_hooks(self) -> Tuple[DeferredHook, ...]:
+        if self.active is None:
+            self.refresh()
+        return self._deferred_hooks
+
+    def invalidate(self) -> None:
+        self.active = None
+
+    def refresh(self) -> bool:
+        with settings._lock:
+            default_hooks = () if self._disable_default_hooks else tuple(settings.hooks)
+            if self._default_hooks is None or self._default_hooks != default_hooks:
+                hooks = (*default_hooks, *self._extra_hooks)
+                steps = tuple((classify_hook(hook), hook) for hook in hooks)
+                self._steps = tuple(step for step in steps if step[0] != DEFERRED_HOOK)
+                self._deferred_hooks = tuple(hook for kind, hook in steps if kind == DEFERRED_HOOK)
+                self._default_hooks = default_hooks
+            self.sampler = self._sampler or getattr(settings, "sampler", None)
+            self.duration_field = settings.duration_field
+            # Checked by `settings.configure`, unless the settings were changed in place since: the timed
+            # functions must carry on all the same.
+            resolution = getattr(settings, "duration_resolution", "us")
+            if resolution not in DURATION_RESOLUTIONS:
+                logger.warning("ignoring the invalid duration_resolution %r", resolution)
+                resolution = "us"
+            cpu_time = getattr(settings, "cpu_time", None)
+            if cpu_time not in CPU_CLOCKS:
+                logger.warning("ignoring the invalid cpu_time %r", cpu_time)
+                cpu_time = None
+            self.duration_decimals = DURATION_RESOLUTIONS[resolution]
+            self.cpu_clock = CPU_CLOCKS[cpu_time]
+            self.origin = getattr(settings, "origin", None)
+            self.spans = bool(getattr(settings, "spans", False))
+            self.hook_timeout = getattr(settings, "hook_timeout", None)
+            self.total_hook_timeout = getattr(settings, "total_hook_timeout", None)
+            self.backends = tuple(
+                (getattr(backend, "accepts_records", False) is True, backend) for backend in settings.backends
+            )
+            self.accepts_records = any(accepts for accepts, _ in self.backends)
+            # A single backend which runs the deferred hooks itself, e.g. on the worker of a `ThreadedBackend`.
+            self.defer_to = None
+            if len(self.backends) == 1 and getattr(self.backends[0][1], "accepts_deferred", False) is True:
+                self.defer_to = self.backends[0][1]
+            active = self.active = bool(self._steps or self._deferred_hooks or self.backends)
+        return active
+
 
 class Base:
     """
@@ -22,59 +202,138 @@ class Base:
         "result",
         "_wrapped",
         "_fqn",
-        "_hooks",
+        "_hook_plan",
+        "_hook_steps",
+        "_deferred_hooks",
+        "_generator_hooks",
         "_call_args",
         "_call_kwargs",
         "_start_time",
+        "_cpu_clock",
+        "_cpu_start_time",
+        "_sample_weight",
+        "_span",
+        "_span_token",
     )
 
     def __init__(
         self,
         *,
-        wrapped: Callable[..., Any],
+        wrapped: Optional[Callable[..., Any]],
         fqn: str,
         call_args: Tuple[Any, ...],
         call_kwargs: Dict[str, Any],
         extra_hooks: Optional[Iterable[Hook | GeneratorHook]] = None,
         disable_default_hooks: bool = False,
+        hook_plan: Optional[HookPlan] = None,
+        sample_weight: Optional[float] = None,
     ) -> None:
         self.result: Optional[Any] = None
+        self._sample_weight = sample_weight
         self._wrapped = wrapped
         self._fqn = fqn
         self._call_args = call_args
         self._call_kwargs = call_kwargs
 
-        hooks = extra_hooks or ()
-        if not disable_default_hooks:
-            hooks = (*settings.hooks, *hooks)
+        if hook_plan is None:
+            hook_plan = HookPlan(extra_hooks=extra_hooks, disable_default_hooks=disable_default_hooks)
+        self._hook_steps = hook_plan.steps
+        self._deferred_hooks = hook_plan.deferred_hooks
+        self._hook_plan = hook_plan
 
-        self._hooks = tuple(
-            (
-                cast(Hook, hook)
-                if not isgeneratorfunction(hook)  # simple hook, we'll call it in the exit
-                # For a generator hook, call it. We'll start in the entrance.
-                else cast(GeneratorHookReturnType, hook(func=wrapped, func_args=call_args, func_kwargs=call_kwargs))
-            )
-            for hook in hooks
-        )
+        # For a generator hook, call it now. We'll start it in the entrance.
+        self._generator_hooks: List[GeneratorHookReturnType] = [
+            hook(func=wrapped, func_args=call_args, func_kwargs=call_kwargs)
+            for kind, hook in self._hook_steps
+            if kind == GENERATOR_HOOK
+        ]
 
     def enter(self) -> Any:
-        self._start_time = default_timer()
-        for hook in self._hooks:
-            if isgenerator(hook):
-                hook.send(None)  # start a generator hook
+        self._cpu_clock = cpu_clock = self._hook_plan.cpu_clock
+        if cpu_clock is not None:
+            self._cpu_start_time = cpu_clock()
+        self._start_time = perf_counter_ns()
+        span: Optional[Span] = None
+        token: Optional[Token[Optional[Span]]] = None
+        if self._hook_plan.spans:
+            span, token = enter_span(self._start_time)
+        self._span = span
+        self._span_token = token
+        try:
+            for generator in self._generator_hooks:
+                next(generator)  # start a generator hook
+        except BaseException:
+            # The call isn't timed, don't leave its span current.
+            if span is not None:
+                exit_span(span, token, perf_counter_ns())
+            raise
         return self
 
+    def get_record(self) -> MetricRecord:
+        end_time = perf_counter_ns()
+        elapsed = end_time - self._start_time
+        hook_plan = self._hook_plan
+        decimals = hook_plan.duration_decimals
+        cpu_time = None
+        if self._cpu_clock is not None:
+            cpu_time = round((self._cpu_clock() - self._cpu_start_time) / 1e6, decimals)
+
+        record = MetricRecord(
+            self._fqn,
+            round(elapsed / 1e6, decimals),
+            hook_plan.duration_field,
+            SHORT_HOSTNAME,
+            time_ns(),
+            cpu_time,
+            hook_plan.origin or None,
+            self._sample_weight,
+        )
+        span = self._span
+        if span is not None:
+            # The span ends with the call, the hooks and the backends already run in the parent's.
+            child_time = exit_span(span, self._span_token, end_time)
+            record.span_id = span.span_id
+            record.parent_id = span.parent_id
+            record.self_time = round((elapsed - child_time) / 1e6, decimals)
+        return record
+
     def get_metric(self) -> Dict[str, Any]:
-        duration_millis = round(default_timer() - self._start_time, 3) * 1000.0
+        return self.get_record().to_dict()
 
-        metric = {settings.duration_field: duration_millis, "hostname": SHORT_HOSTNAME, "name": self._fqn}
+    def write(self, record: MetricRecord, metric: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Write the record to the backends which accept records, and its dict (`metric`) to the others.
 
-        origin = getattr(settings, "origin", None)
-        if origin:
-            metric["origin"] = origin
+        A record with deferred hooks is written once they ran, off the caller's thread.
+        """
+        hook_plan = self._hook_plan
+        if record.deferred is None:
+            write_to_backends(hook_plan, record, metric)
+        elif hook_plan.defer_to is not None:
+            hook_plan.defer_to.write_record(record)
+        else:
+            submit(record, partial(write_to_backends, hook_plan))
 
-        return metric
+    def defer_hooks(
+        self, record: MetricRecord, exception: Optional[BaseException], metric: Optional[Dict[str, Any]]
+    ) -> None:
+        """Capture the inputs of the deferred hooks in the record, they run when it's written."""
+        snapshot = None
+        deferred = []
+        for hook in self._deferred_hooks:
+            if snapshot is None and "metric" in hook.needs:
+                snapshot = record.to_dict() if metric is None else dict(metric)
+            inputs = capture(
+                hook,
+                self.result,
+                exception,
+                cast(Dict[str, Any], snapshot),
+                self._wrapped,
+                self._call_args,
+                self._call_kwargs,
+            )
+            deferred.append((hook, inputs))
+        record.deferred = deferred
 
     def apply_hook(
         self,
@@ -83,26 +342,43 @@ class Base:
         metric: Dict[str, Any],
         metadata: Dict[str, Any],
     ) -> None:
-        if not isgenerator(hook):
-            hook_result = cast(Hook, hook)(
-                response=self.result,
-                exception=exception,
-                metric=metric,
-                func=self._wrapped,
-                func_args=self._call_args,
-                func_kwargs=self._call_kwargs,
-            )
+        hook_result = cast(Hook, hook)(
+            response=self.result,
+            exception=exception,
+            metric=metric,
+            # `None` for the blocks timed by `span`.
+            func=cast(Callable[..., Any], self._wrapped),
+            func_args=self._call_args,
+            func_kwargs=self._call_kwargs,
+        )
+        if hook_result:
+            metadata.update(hook_result)
+
+    def finish_generator_hook(
+        self,
+        generator: GeneratorHookReturnType,
+        exception: Optional[BaseException],
+        metric: Dict[str, Any],
+        metadata: Dict[str, Any],
+    ) -> None:
+        # Generator hook: send the results and obtain custom metadata.
+        try:
+            generator.send((self.result, exception, metric))
+        except StopIteration as e:
+            hook_result = e.value
         else:
-            # Generator hook: send the results and obtain custom metadata.
-            try:
-                hook.send((self.result, exception, metric))
-            except StopIteration as e:
-                hook_result = e.value
-            else:
-                raise RuntimeError("generator hook did not stop")
+            raise RuntimeError("generator hook did not stop")
         if hook_result:
             metadata.update(hook_result)
 
+    def apply_hooks(self, exception: Optional[BaseException], metric: Dict[str, Any], metadata: Dict[str, Any]) -> None:
+        generators: Iterator[GeneratorHookReturnType] = iter(self._generator_hooks)
+        for kind, hook in self._hook_steps:
+            if kind == GENERATOR_HOOK:
+                self.finish_generator_hook(next(generators), exception, metric, metadata)
+            else:
+                self.apply_hook(hook, exception, metric, metadata)
+
 
 class Timed(AbstractContextManager, Base):
 
@@ -116,14 +392,32 @@ class Timed(AbstractContextManager, Base):
         __exc_tb: Optional[TracebackType],
     ) -> None:
 
-        metadata: Dict[str, Any] = dict()
-        metric: Dict[str, Any] = self.get_metric()
+        record = self.get_record()
+        metric: Optional[Dict[str, Any]] = None
+        measure = telemetry.enabled
+
+        if self._hook_steps:
+            # The hooks get the metric as a dict, which the record then carries along.
+            metadata: Dict[str, Any] = dict()
+            metric = record.to_dict()
+            if measure:
+                start = perf_counter()
+                self.apply_hooks(exception=__exc_val, metric=metric, metadata=metadata)
+                telemetry.record("decorator.hooks", (perf_counter() - start) * 1000.0)
+            else:
+                self.apply_hooks(exception=__exc_val, metric=metric, metadata=metadata)
+            metric.update(metadata)
+            record.extra = metric
 
-        for hook in self._hooks:
-            self.apply_hook(hook=hook, exception=__exc_val, metric=metric, metadata=metadata)
+        if self._deferred_hooks:
+            self.defer_hooks(record, __exc_val, metric)
 
-        metric.update(metadata)
-        write_metric(**metric)  # type: ignore[arg-type]
+        if measure:
+            start = perf_counter()
+            self.write(record, metric)
+            telemetry.record("decorator.write", (perf_counter() - start) * 1000.0)
+        else:
+            self.write(record, metric)
 
 
 class TimedAsync(AbstractAsyncContextManager, Base):
@@ -138,31 +432,284 @@ class TimedAsync(AbstractAsyncContextManager, Base):
         __exc_tb: Optional[TracebackType],
     ) -> None:
 
-        metadata: Dict[str, Any] = dict()
-        metric: Dict[str, Any] = self.get_metric()
+        record = self.get_record()
+        metric: Optional[Dict[str, Any]] = None
+        measure = telemetry.enabled
+
+        if self._hook_steps:
+            # The hooks get the metric as a dict, which the record then carries along.
+            metadata: Dict[str, Any] = dict()
+            metric = record.to_dict()
+            if measure:
+                start = perf_counter()
+                await self._apply_hooks(exception=__exc_val, metric=metric, metadata=metadata)
+                telemetry.record("decorator.hooks", (perf_counter() - start) * 1000.0)
+            else:
+                await self._apply_hooks(exception=__exc_val, metric=metric, metadata=metadata)
+            metric.update(metadata)
+            record.extra = metric
 
-        for hook in self._hooks:
-            await self._apply_hook(hook=hook, exception=__exc_val, metric=metric, metadata=metadata)
+        if self._deferred_hooks:
+            self.defer_hooks(record, __exc_val, metric)
 
-        metric.update(metadata)
-        write_metric(**metric)  # type: ignore[arg-type]
+        if measure:
+            start = perf_counter()
+            self.write(record, metric)
+            telemetry.record("decorator.write", (perf_counter() - start) * 1000.0)
+        else:
+            self.write(record, metric)
 
-    async def _apply_hook(
+    async def _apply_hooks(
         self,
-        hook: Any,
         exception: Optional[BaseException],
         metric: Dict[str, Any],
         metadata: Dict[str, Any],
     ) -> None:
-        if iscoroutinefunction(hook):
-            hook_result = await hook(
-                response=self.result,
-                exception=exception,
-                metric=metric,
-                func=self._wrapped,
-                func_args=self._call_args,
-                func_kwargs=self._call_kwargs,
-            )
-            metadata.update(hook_result)
+        """
+        Apply the hooks, running the coroutine hooks concurrently, within the `hook_timeout` of each of them
+        and the `total_hook_timeout` of all of them. Their results are merged in the order of the hooks all the
+        same. The hooks which timed out are cancelled, and listed in the `timed_out_hooks` field.
+        """
+        generators: Iterator[GeneratorHookReturnType] = iter(self._generator_hooks)
+        # The metadata of the hooks, in their order; the coroutine hooks' once they're awaited.
+        results: List[Optional[Dict[str, Any]]] = []
+        coroutines: Dict[int, Tuple[Any, Awaitable[Optional[Dict[str, Any]]]]] = {}
+        for kind, hook in self._hook_steps:
+            if kind == COROUTINE_HOOK:
+                coroutine = hook(
+                    response=self.result,
+                    exception=exception,
+                    metric=metric,
+                    func=self._wrapped,
+                    func_args=self._call_args,
+                    func_kwargs=self._call_kwargs,
+                )
+                coroutines[len(results)] = (hook, coroutine)
+                results.append(None)
+                continue
+            fields: Dict[str, Any] = {}
+            if kind == GENERATOR_HOOK:
+                self.finish_generator_hook(next(generators), exception, metric, fields)
+            else:
+                self.apply_hook(hook, exception, metric, fields)
+            results.append(fields)
+
+        timed_out = await self._await_hooks(coroutines, results) if coroutines else None
+        for hook_metadata in results:
+            if hook_metadata:
+                metadata.update(hook_metadata)
+        if timed_out:
+            metadata["timed_out_hooks"] = timed_out
+
+    async def _await_hooks(
+        self,
+        coroutines: Dict[int, Tuple[Any, Awaitable[Optional[Dict[str, Any]]]]],
+        results: List[Optional[Dict[str, Any]]],
+    ) -> List[str]:
+        """Await the coroutine hooks, put their metadata in `results`, and return the ones which timed out."""
+        hook_timeout = self._hook_plan.hook_timeout
+        total_hook_timeout = self._hook_plan.total_hook_timeout
+        if len(coroutines) == 1 and hook_timeout is None and total_hook_timeout is None:
+            # Nothing to run concurrently.
+            [(index, (_, coroutine))] = coroutines.items()
+            results[index] = await coroutine
+            return []
+
+        tasks = {
+            index: asyncio.ensure_future(coroutine if hook_timeout is None else _with_timeout(coroutine, hook_timeout))
+            for index, (_, coroutine) in coroutines.items()
+        }
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=total_hook_timeout)
+        except BaseException:
+            # E.g. the timed coroutine is cancelled.
+            for task in tasks.values():
+                task.cancel()
+            raise
+        for task in pending:
+            task.cancel()
+
+        timed_out = []
+        error: Optional[BaseException] = None
+        for index, task in tasks.items():
+            hook_error = None if task in pending else task.exception()
+            # Unlike a `TimeoutError` of the hook itself, e.g. of its HTTP client.
+            if task in pending or isinstance(hook_error, _HookTimedOut):
+                hook = coroutines[index][0]
+                timed_out.append(get_fqn(hook.hook if isinstance(hook, DeferredHook) else hook))
+            elif hook_error is not None:
+                # The exception of the first failed hook is raised, as if they were awaited in turn.
+                error = error or hook_error
+            else:
+                results[index] = task.result()
+        if error is not None:
+            raise error
+        return timed_out
+
+
+class _HookTimedOut(Exception):
+    """Raised when a coroutine hook exceeds the `hook_timeout`."""
+
+
+async def _with_timeout(coroutine: Awaitable[Any], timeout: float) -> Any:
+    """Like `asyncio.wait_for`, but raises `_HookTimedOut` rather than a `TimeoutError` the hook could raise too."""
+    task = asyncio.ensure_future(coroutine)
+    try:
+        done, _ = await asyncio.wait([task], timeout=timeout)
+    except BaseException:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        raise _HookTimedOut
+    return task.result()
+
+
+def write_to_backends(hook_plan: HookPlan, record: MetricRecord, metric: Optional[Dict[str, Any]] = None) -> None:
+    if not hook_plan.accepts_records:
+        write_metric(**_plain_metric(record, metric))
+        return
+    for accepts_records, backend in hook_plan.backends:
+        if accepts_records:
+            backend.write_record(record)
         else:
-            self.apply_hook(hook=hook, exception=exception, metric=metric, metadata=metadata)
+            metric = _plain_metric(record, metric)
+            backend.write(**metric)
+
+
+def _plain_metric(record: MetricRecord, metric: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The metric for the backends which don't accept records, with a `timestamp` rather than `timestamp_ns`."""
+    if metric is None:
+        metric = record.to_dict()
+    convert_timestamps((metric,))
+    return metric
+
+
+class GeneratorBase(Base):
+    """
+    Shared behaviour of the timed generators, which time the iteration rather than the call.
+
+    The duration runs from the first item asked for until the generator is exhausted, closed (e.g. by
+    the garbage collector) or fails. The metric also gets the `time_to_first_item`, the `active_time`
+    spent in the generator itself rather than in its consumer, and the `item_count`. The span of the
+    generator is only current whilst the generator runs, and its `self_time` excludes the consumer's time.
+    """
+
+    __slots__ = ("_active_time", "_first_item_time", "_item_count")
+
+    def enter(self) -> Any:
+        self._active_time = 0
+        self._first_item_time: Optional[int] = None
+        self._item_count = 0
+        super().enter()
+        if self._span is not None:
+            deactivate_span(self._span, cast(Token, self._span_token))
+            self._span_token = None
+        return self
+
+    def resume(self) -> Tuple[Optional[Any], int]:
+        """Call before resuming the generator, then `suspend` with the result."""
+        span = self._span
+        return (None if span is None else activate_span(span)), perf_counter_ns()
+
+    def suspend(self, token: Optional[Any], start: int, item: bool) -> None:
+        """Call once the generator returns, `item` tells whether it yielded one."""
+        now = perf_counter_ns()
+        self._active_time += now - start
+        if token is not None:
+            deactivate_span(cast(Span, self._span), token)
+        if item:
+            self._item_count += 1
+            if self._first_item_time is None:
+                self._first_item_time = now - self._start_time
+
+    def get_record(self) -> MetricRecord:
+        record = super().get_record()
+        decimals = self._hook_plan.duration_decimals
+        active_time = round(self._active_time / 1e6, decimals)
+        fields: Dict[str, Any] = {"active_time": active_time, "item_count": self._item_count}
+        if self._first_item_time is not None:
+            fields["time_to_first_item"] = round(self._first_item_time / 1e6, decimals)
+        if record.self_time is not None:
+            # The child time is part of the active time.
+            record.self_time = round(active_time - (record.duration - record.self_time), decimals)
+        record.extra = fields
+        return record
+
+
+class TimedGenerator(GeneratorBase, Timed):
+    __slots__ = ()
+
+    def run(self, generator: Generator[Any, Any, Any]) -> Generator[Any, Any, Any]:
+        """Iterate over the generator like `yield from`, timing it."""
+        self.enter()
+        exception: Optional[BaseException] = None
+        value: Any = None
+        thrown: Optional[BaseException] = None
+        try:
+            while True:
+                token, start = self.resume()
+                try:
+                    item = generator.send(value) if thrown is None else generator.throw(thrown)
+                except StopIteration as stop:
+                    self.suspend(token, start, False)
+                    return stop.value
+                except BaseException:
+                    self.suspend(token, start, False)
+                    raise
+                self.suspend(token, start, True)
+                try:
+                    value, thrown = (yield item), None
+                except GeneratorExit:
+                    raise
+                except BaseException as exc:
+                    thrown = exc
+        except GeneratorExit:
+            raise
+        except BaseException as exc:
+            exception = exc
+            raise
+        finally:
+            generator.close()
+            self.__exit__(None if exception is None else type(exception), exception, None)
+
+
+class TimedAsyncGenerator(GeneratorBase, TimedAsync):
+    __slots__ = ()
+
+    async def run(self, generator: AsyncGenerator[Any, Any]) -> AsyncGenerator[Any, Any]:
+        """Iterate over the asynchronous generator, passing on what's sent and thrown in, timing it."""
+        self.enter()
+        exception: Optional[BaseException] = None
+        value: Any = None
+        thrown: Optional[BaseException] = None
+        try:
+            while True:
+                token, start = self.resume()
+                try:
+                    item = await (generator.asend(value) if thrown is None else generator.athrow(thrown))
+                except StopAsyncIteration:
+                    self.suspend(token, start, False)
+                    return
+                except BaseException:
+                    self.suspend(token, start, False)
+                    raise
+                self.suspend(token, start, True)
+                try:
+                    value, thrown = (yield item), None
+                except GeneratorExit:
+                    raise
+                except BaseException as exc:
+                    thrown = exc
+        except GeneratorExit:
+            raise
+        except BaseException as exc:
+            exception = exc
+            raise
+        finally:
+            await generator.aclose()
+            await self.__aexit__(None if exception is None else type(exception), exception, None)
@@ -0,0 +1,57 @@
+"""
+Timestamps of the metrics, captured as integer nanoseconds on the hot path.
+
+A timed call is stamped with `time.time_ns()` in its `timestamp_ns` field, which is much cheaper than
+creating a `datetime`. The backends convert it to a `timestamp` off the caller's thread, a batch at a time
+(e.g. in the worker of the `ThreadedBackend`), and serialize it in their own format.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable
+from uuid import UUID
+
+TIMESTAMP_NS = "timestamp_ns"
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND_US = 1000000
+
+
+def to_datetime(timestamp_ns: int) -> datetime:
+    """Convert nanoseconds since the epoch to a naive UTC `datetime`, like `datetime.utcnow()`, to the microsecond."""
+    return _EPOCH + timedelta(microseconds=(timestamp_ns + 500) // 1000)
+
+
+def convert_timestamps(metrics: Iterable[Dict[str, Any]]) -> None:
+    """
+    Replace the `timestamp_ns` of the metrics by a `timestamp`, unless they already have one.
+
+    The metrics of a batch mostly share their second, so the `datetime` of the second is reused.
+    """
+    second = None
+    start = _EPOCH
+    for metric in metrics:
+        timestamp_ns = metric.pop(TIMESTAMP_NS, None)
+        if timestamp_ns is None or "timestamp" in metric:
+            continue
+        metric_second, microsecond = divmod((timestamp_ns + 500) // 1000, _SECOND_US)
+        if metric_second != second:
+            second = metric_second
+            start = _EPOCH + timedelta(seconds=metric_second)
+        metric["timestamp"] = start.replace(microsecond=microsecond)
+
+
+def json_default(value: Any) -> Any:
+    """
+    Serialize the values of the metrics which JSON doesn't support, as the Elasticsearch client does: dates
+    as ISO 8601 strings, UUIDs as strings and decimals as floats. Pass it as `default` to `json.dumps`.
+    """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)